@@ -0,0 +1,253 @@
+"""asyncio collection engine for OpenstackStats.
+
+Fetches the listings a collection needs concurrently over aiohttp before the
+collectors run, instead of one paginated openstacksdk call after the other.
+The Keystone session, token and service catalog of the openstacksdk
+connection are shared, only the HTTP requests are sent by aiohttp, through a
+single connection pool bounded by a semaphore. The raw API objects are turned
+into the same openstacksdk resources the synchronous listings return, so the
+collectors can't tell the difference.
+"""
+
+import asyncio
+import ssl
+import time
+from urllib.parse import urljoin
+
+import aiohttp
+
+from cloudstats.selfmetrics import endpoint_label
+
+from openstack import utils
+from openstack.block_storage.v3.volume import Volume
+from openstack.compute.v2.hypervisor import Hypervisor
+from openstack.compute.v2.server import Server
+from openstack.identity.v3.project import Project
+from openstack.image.v2.image import Image
+from openstack.network.v2.floating_ip import FloatingIP
+from openstack.network.v2.network import Network
+from openstack.network.v2.network_ip_availability import NetworkIPAvailability
+from openstack.network.v2.router import Router
+
+# Cache name: (connection proxy, path, query, openstacksdk resource)
+LISTINGS = {
+    "projects": ("identity", "/projects", {}, Project),
+    "hypervisors": ("compute", "/os-hypervisors/detail", {}, Hypervisor),
+    "servers": ("compute", "/servers/detail", {"all_tenants": "True"}, Server),
+    "networks": ("network", "/networks", {"fields": "id"}, Network),
+    "ipas": ("network", "/network-ip-availabilities", {}, NetworkIPAvailability),
+    "routers": ("network", "/routers", {"fields": "id"}, Router),
+    "floating_ip": ("network", "/floatingips", {}, FloatingIP),
+    "volumes": ("block_storage", "/volumes/detail", {"all_tenants": "True"}, Volume),
+    "images": ("image", "/images", {}, Image),
+}
+
+# Service names used in the OpenStack-API-Version microversion header
+MICROVERSION_SERVICES = {"compute": "compute", "block_storage": "volume"}
+
+
+class AsyncEngineError(Exception):
+    """Raised if a listing can't be fetched."""
+
+    pass
+
+
+def _next_url(url, body, resources_key):
+    """Return the URL of the next page of a listing, if any."""
+    # Nova, Neutron and Cinder
+    for link in body.get("{}_links".format(resources_key)) or []:
+        if link.get("rel") == "next":
+            return link["href"]
+    # Keystone
+    links = body.get("links")
+    if isinstance(links, dict) and links.get("next"):
+        return urljoin(url, links["next"])
+    # Glance
+    if body.get("next"):
+        return urljoin(url, body["next"])
+    return None
+
+
+class AsyncEngine:
+    """Fill the listing caches of an OpenstackStats concurrently."""
+
+    def __init__(self, stats, max_concurrency=64):
+        """Create an engine sharing the connection of stats."""
+        self.stats = stats
+        self.connection = stats.connection
+        self.logger = stats.logger
+        self.max_concurrency = max_concurrency
+        self._token = None
+
+    def _ssl(self):
+        """Return the TLS setting matching the Keystone session."""
+        verify = self.connection.session.verify
+        if verify is False:
+            return False
+        if isinstance(verify, str) and verify:
+            return ssl.create_default_context(cafile=verify)
+        return None
+
+    def _headers(self, proxy, resource):
+        """Return the headers for listing a resource of a proxy."""
+        headers = {"Accept": "application/json", "X-Auth-Token": self._token}
+        service = MICROVERSION_SERVICES.get(proxy)
+        if service:
+            # Negotiated the way openstacksdk does, e.g. so servers embed
+            # their flavor and hypervisors return cpu_info as a dict
+            microversion = utils.maximum_supported_microversion(
+                getattr(self.connection, proxy), resource._max_microversion
+            )
+            if microversion:
+                headers["OpenStack-API-Version"] = "{} {}".format(service, microversion)
+        return headers
+
+    def prefetch(self, names, object_accounts=False):
+        """Fetch the listings in names, and the Swift accounts, concurrently.
+
+        The endpoints, microversions and token are resolved synchronously
+        through the openstacksdk connection first, and the flavors missing
+        from the servers fetched after, so only the HTTP requests run in the
+        event loop.
+        """
+        self._token = self.connection.session.get_token()
+        requests = {}
+        for name in names:
+            proxy, path, query, resource = LISTINGS[name]
+            endpoint = getattr(self.connection, proxy).get_endpoint()
+            if endpoint:
+                url = endpoint.rstrip("/") + path
+                headers = self._headers(proxy, resource)
+                requests[name] = (proxy, url, query, headers, resource)
+        object_endpoint = (
+            self.stats._object_store_endpoint() if object_accounts else None
+        )
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                self._prefetch(requests, object_accounts, object_endpoint)
+            )
+        finally:
+            loop.close()
+
+        # Ocata servers don't embed their flavor, openstacksdk fetches it
+        for server in self.stats._servers_cache or []:
+            self.stats._complete_flavor(server)
+
+    async def _prefetch(self, requests, object_accounts, object_endpoint):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, ssl=self._ssl())
+        async with aiohttp.ClientSession(connector=connector) as http:
+            listings = {
+                name: asyncio.ensure_future(self._list(http, semaphore, name, *request))
+                for name, request in requests.items()
+            }
+            tasks = list(listings.values())
+            if object_accounts:
+                tasks.append(
+                    self._object_accounts(http, semaphore, listings, object_endpoint)
+                )
+            # A failed listing is left to the synchronous properties
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(result, Exception):
+                    self.logger.warning(
+                        "Asynchronous listing failed: {!r}".format(result)
+                    )
+
+    async def _request(
+        self, http, semaphore, proxy, method, url, params=None, headers=None
+    ):
+        """Send a request, returning its status, headers and decoded body."""
+        labels = (proxy.replace("_", "-"), endpoint_label(url))
+        async with semaphore:
+            start = time.perf_counter()
+            async with http.request(
+                method, url, params=params, headers=headers
+            ) as response:
+                body = None
+                if method == "GET" and response.status == 200:
+                    body = await response.json(content_type=None)
+                status = response.status
+                response_headers = response.headers
+            self.stats.metrics.request_duration.labels(*labels).observe(
+                time.perf_counter() - start
+            )
+            self.stats.metrics.requests.labels(*labels, str(status)).inc()
+        return status, response_headers, body
+
+    async def _list(self, http, semaphore, name, proxy, url, query, headers, resource):
+        """Page through a listing and store it in its cache."""
+        results = []
+        params = query
+        while url:
+            status, _, body = await self._request(
+                http, semaphore, proxy, "GET", url, params=params, headers=headers
+            )
+            if status != 200:
+                raise AsyncEngineError("Listing {} returned {}".format(name, status))
+            for raw in body[resource.resources_key]:
+                results.append(resource.existing(connection=self.connection, **raw))
+            # Next links already carry the query
+            url = _next_url(url, body, resource.resources_key)
+            params = None
+        setattr(self.stats, "_{}_cache".format(name), results)
+        return results
+
+    async def _object_accounts(self, http, semaphore, listings, endpoint):
+        """HEAD the Swift account of every project.
+
+        Without the projects listing, the accounts are left to the synchronous
+        property rather than listing the projects from the event loop.
+        """
+        if "projects" not in listings:
+            return
+        projects = await listings["projects"]
+        headers = {"X-Auth-Token": self._token}
+
+        async def get_account(project_id, project_name, url):
+            status, response_headers, _ = await self._request(
+                http, semaphore, "object_store", "HEAD", url, headers=headers
+            )
+            if status not in (200, 204):
+                self.stats._skip_object_account(project_id, status)
+                return None
+            account = self.stats._object_account(
+                project_id, project_name, response_headers
+            )
+            if self.stats.config["object_store"]["container_details"].get(bool):
+                account["container_list"] = await self._list_containers(
+                    http, semaphore, url, headers
+                )
+            return account
+
+        accounts = await asyncio.gather(
+            *[
+                get_account(*args)
+                for args in self.stats._object_account_urls(endpoint, projects)
+            ]
+        )
+        self.stats._object_accounts_cache = [
+            account for account in accounts if account is not None
+        ]
+
+    async def _list_containers(self, http, semaphore, url, headers):
+        """Page through the containers of a Swift account."""
+        containers = []
+        params = {"format": "json"}
+        while True:
+            status, _, page = await self._request(
+                http,
+                semaphore,
+                "object_store",
+                "GET",
+                url,
+                params=params,
+                headers=headers,
+            )
+            if status != 200 or not page:
+                break
+            containers.extend(page)
+            params = {"format": "json", "marker": page[-1]["name"]}
+
+        return containers
@@ -1,5 +1,9 @@
 """Module for interacting with Rest API."""
 
+import gzip
+import json
+import random
+import threading
 import urllib
 from datetime import datetime, timedelta
 
@@ -10,6 +14,31 @@ from cloudstats.storage import Storage
 import jwt
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Connections kept alive per host by the sessions of the reporter
+POOL_MAXSIZE = 4
+
+# Compression level of gzip request bodies
+GZIP_LEVEL = 6
+
+# Refresh tokens are renewed this long before they expire
+REFRESH_TOKEN_LEAD = timedelta(days=5)
+
+
+def pooled_adapter(hosts=1, maxsize=POOL_MAXSIZE):
+    """Return a keep-alive connection pool to mount on requests sessions.
+
+    Sessions sharing the adapter share its connections, hosts is the number
+    of hosts whose connections are kept and maxsize the connections kept per
+    host, at least POOL_MAXSIZE.
+    """
+    return HTTPAdapter(pool_connections=hosts, pool_maxsize=max(maxsize, POOL_MAXSIZE))
 
 
 class ApiError(Exception):
@@ -25,7 +54,18 @@ class AuthenticationError(ApiError):
 class UpdateFailed(ApiError):
     """Raised if a patch update doesn't return 200."""
 
-    pass
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        """Return whether the update may succeed later, unlike a rejection."""
+        return (
+            self.status_code is None
+            or self.status_code == 429
+            or self.status_code >= 500
+        )
 
 
 class TokenError(ApiError):
@@ -34,6 +74,32 @@ class TokenError(ApiError):
     pass
 
 
+class RequestBody:
+    """JSON request body serialized once and compressed on demand.
+
+    The same body is sent again as is when a request is retried, and each
+    content coding is only compressed once.
+    """
+
+    def __init__(self, data):
+        """Serialize data to JSON."""
+        self.json = json.dumps(data, separators=(",", ":")).encode("utf8")
+        self._encoded = {None: self.json}
+
+    def __len__(self):
+        return len(self.json)
+
+    def encode(self, encoding):
+        """Return the body compressed with encoding, or as is for None."""
+        if encoding not in self._encoded:
+            if encoding == "zstd":
+                encoded = zstandard.ZstdCompressor().compress(self.json)
+            else:
+                encoded = gzip.compress(self.json, compresslevel=GZIP_LEVEL)
+            self._encoded[encoding] = encoded
+        return self._encoded[encoding]
+
+
 class Token:
     def __init__(self, encoded):
         """Initialize Rest API Token."""
@@ -42,7 +108,8 @@ class Token:
         )
         self.encoded = encoded
         self.type = decoded["token_type"]
-        self.expires = datetime.fromtimestamp(decoded["exp"])
+        # Naive UTC, as compared with utcnow()
+        self.expires = datetime.utcfromtimestamp(decoded["exp"])
 
     def __eq__(self, other):
         if self.encoded == other.encoded:
@@ -76,25 +143,196 @@ class Token:
             target_time = datetime.utcnow()
 
         if self.type == "refresh":
-            target_time = datetime.utcnow() + timedelta(days=5)
+            target_time = datetime.utcnow() + REFRESH_TOKEN_LEAD
 
         return self.expires < target_time
 
+    @property
+    def expires_in(self):
+        """Seconds until this token expires."""
+        return (self.expires - datetime.utcnow()).total_seconds()
+
+
+class TokenManager:
+    """Tokens of a cloud, refreshed in the background ahead of their expiry.
+
+    The access token is refreshed lead seconds, minus up to jitter seconds,
+    before it expires, and the refresh token rotated REFRESH_TOKEN_LEAD
+    before it expires, so requests get a current token without waiting. For
+    short-lived tokens the lead is at most half of their lifetime, and
+    refreshes are never scheduled less than RETRY_DELAY apart. A refresh is
+    single-flight: callers holding the same stale token wait for one refresh
+    instead of each sending their own.
+    """
+
+    # Seconds before retrying a failed background refresh, plus jitter
+    RETRY_DELAY = 60
+
+    def __init__(self, request_tokens, storage, cloud="", lead=300, jitter=60):
+        """Create a manager refreshing tokens with request_tokens.
+
+        request_tokens is called with the refresh token and returns the new
+        access and refresh tokens, which are stored for cloud in storage.
+        """
+        self.logger = get_logger()
+        self.request_tokens = request_tokens
+        self.storage = storage
+        self.cloud = cloud
+        self.lead = lead
+        self.jitter = jitter
+        self.tokens = {}
+        # Seconds each token had left when it was received
+        self._lifetimes = {}
+        self._lock = threading.Lock()
+        self._timer_lock = threading.Lock()
+        self._timer = None
+        self._closed = False
+
+    def load(self, refresh_config=None):
+        """Load the stored tokens and schedule their refresh without blocking.
+
+        The newest of the stored and configured refresh tokens is used. If no
+        current access token is stored, it is refreshed right away in the
+        background.
+        """
+        valid_tokens = []
+
+        for token in (self.storage.get_token("refresh", self.cloud), refresh_config):
+            if token is not None:
+                valid_tokens.append(token)
+
+        if not valid_tokens:
+            raise TokenError("No refresh tokens available for API.")
+
+        newest_token = max(valid_tokens)
+        self._set_lifetime("refresh", newest_token)
+        self.tokens["refresh"] = newest_token
+        if newest_token == refresh_config and not newest_token.needs_refresh:
+            self.storage.store_token(newest_token, self.cloud)
+
+        access = self.storage.get_token("access", self.cloud)
+        if access is not None and access.is_current:
+            self._set_lifetime("access", access)
+            self.tokens["access"] = access
+        self.schedule()
+
+    def access(self):
+        """Return a current access token, only waiting for a refresh if none is."""
+        token = self.tokens.get("access")
+        if token is None or not token.is_current:
+            self.refresh(token)
+            token = self.tokens["access"]
+        return token
+
+    def refresh(self, stale):
+        """Refresh the tokens, unless the access token stale was replaced."""
+        with self._lock:
+            if self.tokens.get("access") is not stale:
+                return
+            tokens = self.request_tokens(self.tokens["refresh"])
+            with self.storage.transaction():
+                for token in (tokens["refresh"], tokens["access"]):
+                    self.storage.store_token(token, self.cloud)
+            for kind in ("refresh", "access"):
+                self._set_lifetime(kind, tokens[kind])
+            # The access token last, callers don't lock once it is current
+            self.tokens["refresh"] = tokens["refresh"]
+            self.tokens["access"] = tokens["access"]
+        self.schedule()
+
+    def _set_lifetime(self, kind, token):
+        """Keep the lifetime of a token, unless it is the one already held."""
+        held = self.tokens.get(kind)
+        if held is None or held.encoded != token.encoded:
+            self._lifetimes[kind] = max(token.expires_in, 0)
+
+    def _lead(self, kind, lead):
+        """Return lead, at most half of the lifetime of the token of a kind."""
+        return min(lead, self._lifetimes.get(kind, 0) / 2)
+
+    def delay(self):
+        """Return the seconds until the next background refresh."""
+        access = self.tokens.get("access")
+        if access is None:
+            return 0
+        refresh = self.tokens["refresh"]
+        refresh_at = min(
+            access.expires_in - self._lead("access", self.lead),
+            refresh.expires_in
+            - self._lead("refresh", REFRESH_TOKEN_LEAD.total_seconds()),
+        )
+        return max(refresh_at - random.uniform(0, self.jitter), self.RETRY_DELAY)
+
+    def schedule(self, delay=None):
+        """Schedule the next background refresh."""
+        with self._timer_lock:
+            if self._closed:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(
+                self.delay() if delay is None else delay,
+                self._background_refresh,
+                [self.tokens.get("access")],
+            )
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _background_refresh(self, stale):
+        try:
+            self.refresh(stale)
+        except (ApiError, requests.exceptions.RequestException) as e:
+            self.logger.warning(
+                "Token refresh failed ({}), retrying in {}s.".format(
+                    e, self.RETRY_DELAY
+                )
+            )
+            self.schedule(self.RETRY_DELAY + random.uniform(0, self.jitter))
+
+    def close(self):
+        """Stop refreshing the tokens."""
+        with self._timer_lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+
 
 class RestClient:
-    """Class implementing a rest client."""
+    """Class implementing a rest client.
+
+    A client is meant to be long-lived: its requests share one session whose
+    connections are kept alive between calls, and its TokenManager keeps the
+    tokens in memory and refreshes them in the background.
+    """
 
-    def __init__(self):
-        """Initialize the client."""
+    def __init__(self, config=None, cloud="", storage=None, adapter=None):
+        """Initialize the client.
+
+        config is the api config section, by default the global one, and
+        cloud the key of the tokens of this client in the storage. Clients
+        given the same adapter share its connection pool.
+        """
         self.logger = get_logger()
-        self.config = Config().get_config("api")
+        self.config = config if config is not None else Config().get_config("api")
+        self._cloud = cloud
+        self._adapter = adapter
         self._base_url = None
         self._session = None
-        self._tokens = {}
         self._timeout = 5
-        self._storage = Storage()
-        self._setup_tokens()
+        self._compression = self._setup_compression()
+        self._accepted_encodings = set()
+        self._storage = storage if storage is not None else Storage()
+        # Before the tokens, whose refresh may start right away and uses it
         self._setup_session()
+        self._token_manager = TokenManager(
+            self._request_tokens,
+            self._storage,
+            cloud,
+            lead=self.config["token_refresh_lead"].as_number(),
+            jitter=self.config["token_refresh_jitter"].as_number(),
+        )
+        self._tokens = self._token_manager.tokens
+        self._setup_tokens()
 
     @property
     def base_url(self):
@@ -110,10 +348,39 @@ class RestClient:
 
         return base
 
+    def _setup_compression(self):
+        """Return the configured content coding of the request bodies."""
+        compression = self.config["compression"].as_choice(
+            ["auto", "gzip", "zstd", "none"]
+        )
+        if compression == "zstd" and zstandard is None:
+            self.logger.warning("zstandard isn't installed, using gzip.")
+            return "gzip"
+        return compression
+
+    def _content_encoding(self, body):
+        """Return the content coding to send a body with, None for none."""
+        if body is None or len(body) < self.config["compression_threshold"].get(int):
+            return None
+        if self._compression in ("gzip", "zstd"):
+            return self._compression
+        if self._compression == "auto":
+            if zstandard is not None and "zstd" in self._accepted_encodings:
+                return "zstd"
+            if "gzip" in self._accepted_encodings:
+                return "gzip"
+        return None
+
+    def _learn_encodings(self, response):
+        """Keep the content codings the API accepts, as it advertises them."""
+        accepted = response.headers.get("Accept-Encoding")
+        if accepted is not None:
+            self._accepted_encodings = {
+                coding.split(";")[0].strip().lower() for coding in accepted.split(",")
+            }
+
     def _setup_tokens(self):
         """Load tokens."""
-        # Set the refresh token
-        refresh_db = self._storage.get_token("refresh")
         try:
             refresh_config_encoded = self.config["refresh_token"].get(str)
             refresh_config = Token(refresh_config_encoded)
@@ -121,53 +388,24 @@ class RestClient:
             self.logger.error("Invalid refresh_token in config.")
             refresh_config = None
 
-        # Check which exist
-        valid_tokens = []
-
-        for token in (refresh_db, refresh_config):
-            if token is not None:
-                valid_tokens.append(token)
-
-        if not valid_tokens:
-            raise TokenError("No refresh tokens available for API.")
-
-        # At least one token is available
-        newest_token = max(valid_tokens)
-
-        # TODO: Do I want to error here, it will error when used anyway.
-        # if not newest_token.is_current:
-        #     raise TokenError("Refresh tokens have all expired.")
-
-        self._tokens["refresh"] = newest_token
-
-        if newest_token.needs_refresh:
-            self._refresh_auth()
-
-            return  # Nothing more to do if a refresh is required
-
-        if newest_token == refresh_config:
-            self._storage.store_token(newest_token)
-
-        # Set the access token
-        access = self._storage.get_token("access")
-
-        if access is not None and access.is_current:
-            self._tokens["access"] = access
-        else:
-            self._refresh_auth()
+        self._token_manager.load(refresh_config)
 
     def _setup_session(self):
         """Setup requests session."""
         self._session = requests.Session()
-        self._session.timeout = self._timeout
-        self._setup_headers()
+        adapter = self._adapter if self._adapter is not None else pooled_adapter()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
         self._setup_proxies()
 
-    def _setup_headers(self):
-        """Return authenticated request headers."""
-        headers = {"Authorization": "Bearer {}".format(self._tokens["access"].encoded)}
-        self._session.headers.update(headers)
-        self.logger.debug("Using headers: {}".format(headers))
+    def close(self):
+        """Stop refreshing the tokens and close the connections of the session.
+
+        Connections of a shared pool are left open.
+        """
+        self._token_manager.close()
+        if self._adapter is None:
+            self._session.close()
 
     def _get_proxies(self):
         """Get system proxies."""
@@ -184,47 +422,83 @@ class RestClient:
         """Add proxies to session."""
         self._session.proxies = self._get_proxies()
 
-    def _refresh_auth(self):
-        """Refresh expired authentication."""
-        # Using requests directly, proxies aren't set on the session yet
-        proxies = self._get_proxies()
-        response = requests.post(
+    def _request_tokens(self, refresh):
+        """Return new access and refresh tokens obtained with refresh."""
+        # Over the pooled connections and proxies of the session, which sends
+        # no Authorization header of its own
+        response = self._session.post(
             self.base_url + "auth/token/refresh/",
             timeout=self._timeout,
-            json={"refresh": self._tokens["refresh"].encoded},
-            proxies=proxies,
+            json={"refresh": refresh.encoded},
         )
 
-        if response.status_code == 200:
-            # Successful refresh
-            data = response.json()
-            access = Token(data["access"])
-            refresh = Token(data["refresh"])
-            self._tokens["access"] = access
-            self._tokens["refresh"] = refresh
-            self._storage.store_token(access)
-            self._storage.store_token(refresh)
-
-            if self._session:
-                self._setup_headers()
-        else:
+        if response.status_code != 200:
             raise AuthenticationError(
                 "Refresh failed with code: {}".format(response.status_code)
             )
 
+        data = response.json()
+        return {"access": Token(data["access"]), "refresh": Token(data["refresh"])}
+
+    def _send(self, url, body, encoding, token):
+        """Send a PATCH with body compressed with encoding, authorized by token."""
+        headers = {"Authorization": "Bearer {}".format(token.encoded)}
+        data = None
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            if encoding is not None:
+                headers["Content-Encoding"] = encoding
+            data = body.encode(encoding)
+        return self._session.patch(
+            url, data=data, headers=headers, timeout=self._timeout
+        )
+
+    def _patch(self, url, data=None):
+        """Send an authenticated PATCH, refreshing the tokens if rejected.
+
+        The body is compressed if the API accepts it, which it advertises in
+        the Accept-Encoding header of its responses, or as configured. A
+        compressed body rejected as unsupported is sent again uncompressed,
+        and compression only resumes with a coding the API advertised.
+        """
+        body = None if data is None else RequestBody(data)
+        token = self._token_manager.access()
+        encoding = self._content_encoding(body)
+        response = self._send(url, body, encoding, token)
+
+        if response.status_code == 401:
+            # Revoked before its expiry, one refresh and retry
+            self.logger.info("Access token rejected, refreshing it.")
+            self._token_manager.refresh(token)
+            token = self._token_manager.access()
+            response = self._send(url, body, encoding, token)
+
+        if response.status_code == 415 and encoding is not None:
+            self.logger.warning(
+                "API rejected a {} request body, sending it uncompressed.".format(
+                    encoding
+                )
+            )
+            self._compression = "auto"
+            self._accepted_encodings = set()
+            self._learn_encodings(response)
+            self._accepted_encodings.discard(encoding)
+            response = self._send(url, body, None, token)
+
+        if self._compression == "auto":
+            self._learn_encodings(response)
+        return response
+
     def get_cloud_info(self, cloud):
         """Return cloud information from cloud number."""
 
-        if not self._tokens["access"].is_current:
-            self._refresh_auth()
-        response = self._session.patch(
-            self.base_url + "clouds/{}/".format(cloud),
-        )
+        response = self._patch(self.base_url + "clouds/{}/".format(cloud))
         self.logger.debug("Cloud Info response: {}".format(response))
 
         if response.status_code != 200:
             raise UpdateFailed(
-                "Get Info failed with code: {}".format(response.status_code)
+                "Get Info failed with code: {}".format(response.status_code),
+                response.status_code,
             )
 
         return response.json()
@@ -232,24 +506,25 @@ class RestClient:
     def update_cloud_info(self, cloud, data):
         """Update data on specified cloud."""
 
-        if not self._tokens["access"].is_current:
-            self._refresh_auth()
-        response = self._session.patch(
-            self.base_url + "clouds/{}/".format(cloud),
-            json=data,
-        )
+        response = self._patch(self.base_url + "clouds/{}/".format(cloud), data)
         self.logger.debug("Cloud Update response: {}".format(response))
 
         if response.status_code != 200:
+            try:
+                reply = response.json()
+            except ValueError:
+                # Proxies and overloaded servers answer errors in HTML
+                reply = response.text
             self.logger.error(
                 "Cloud Update response: {}\r reply: {}".format(
-                    response.status_code, response.json()
+                    response.status_code, reply
                 )
             )
             raise UpdateFailed(
                 "Update failed with code: {}\r reply: {}".format(
-                    response.status_code, response.json()
-                )
+                    response.status_code, reply
+                ),
+                response.status_code,
             )
 
         return response.json()
@@ -0,0 +1,209 @@
+"""Record and replay the HTTP traffic of a collection cycle.
+
+Both openstacksdk (through keystoneauth) and the Prometheus queries use
+requests, so traffic is captured at requests' HTTPAdapter. The asyncio
+collection engine sends its requests with aiohttp instead, so collections
+fall back to the synchronous engine while a cassette is active. A cassette holds
+the responses keyed by method and URL, with credentials redacted, plus the
+non-secret config needed to make the same requests again without a network.
+"""
+
+import base64
+import contextlib
+import gzip
+import json
+import threading
+from collections import defaultdict, deque
+
+from cloudstats.config import Config
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+REDACTED = "REDACTED"
+
+# Response headers and JSON keys whose values are credentials
+SECRET_HEADERS = ("authorization", "set-cookie", "x-auth-token", "x-subject-token")
+SECRET_KEYS = ("access", "password", "refresh", "refresh_token", "secret")
+
+# Config needed to replay, the passwords and tokens are never recorded
+RECORDED_CONFIG = {
+    "openstack": (
+        "auth_url",
+        "auth_type",
+        "username",
+        "user_domain_name",
+        "project_domain_name",
+        "project_name",
+        "region_name",
+        "identity_interface",
+        "identity_api_version",
+        "auth_version",
+    ),
+    "prometheus": ("url",),
+}
+
+
+# Number of cassettes recording or replaying
+_active = 0
+
+
+def active():
+    """Return whether a cassette is recording or replaying the traffic."""
+    return _active > 0
+
+
+@contextlib.contextmanager
+def _activated():
+    global _active
+    _active += 1
+    try:
+        yield
+    finally:
+        _active -= 1
+
+
+class CassetteError(Exception):
+    """Raised if a request can't be replayed from a cassette."""
+
+    pass
+
+
+def _redact(data):
+    """Return a copy of decoded JSON with secret values replaced."""
+    if isinstance(data, dict):
+        return {
+            key: REDACTED if key in SECRET_KEYS else _redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [_redact(value) for value in data]
+    return data
+
+
+class Cassette:
+    """HTTP interactions recorded during a cycle."""
+
+    def __init__(self, interactions=None, config=None):
+        """Create a cassette from recorded interactions."""
+        self.interactions = interactions or []
+        self.config = config or {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(method, url):
+        return "{} {}".format(method, url)
+
+    def _record_response(self, request, response):
+        """Store a redacted copy of a response."""
+        headers = {
+            name: REDACTED if name.lower() in SECRET_HEADERS else value
+            for name, value in response.headers.items()
+        }
+        body = response.content or b""
+        try:
+            body = json.dumps(_redact(json.loads(body)))
+            encoding = "json"
+        except ValueError:
+            body = base64.b64encode(body).decode("ascii")
+            encoding = "base64"
+
+        with self._lock:
+            self.interactions.append(
+                {
+                    "request": self._key(request.method, request.url),
+                    "status": response.status_code,
+                    "headers": headers,
+                    "body": body,
+                    "encoding": encoding,
+                }
+            )
+
+    def _record_config(self):
+        """Store the config needed to send the same requests again."""
+        for section, keys in RECORDED_CONFIG.items():
+            config = Config().get_config(section)
+            self.config[section] = {key: config[key].get() for key in keys}
+
+    @staticmethod
+    def _build_response(request, interaction):
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        if interaction["encoding"] == "json":
+            response._content = interaction["body"].encode("utf8")
+        else:
+            response._content = base64.b64decode(interaction["body"])
+        response.url = request.url
+        response.request = request
+        # Recorded bodies are already decoded
+        response.headers.pop("Content-Encoding", None)
+        return response
+
+    @contextlib.contextmanager
+    def record(self):
+        """Capture all HTTP traffic sent through requests."""
+        send = requests.adapters.HTTPAdapter.send
+        cassette = self
+
+        def recording_send(self, request, **kwargs):
+            response = send(self, request, **kwargs)
+            cassette._record_response(request, response)
+            return response
+
+        requests.adapters.HTTPAdapter.send = recording_send
+        try:
+            with _activated():
+                yield self
+        finally:
+            requests.adapters.HTTPAdapter.send = send
+            self._record_config()
+
+    @contextlib.contextmanager
+    def replay(self):
+        """Answer all HTTP traffic sent through requests from the cassette.
+
+        Responses to the same request are served in recorded order, the last
+        one is repeated once they run out (e.g. re-authentication).
+        """
+        queues = defaultdict(deque)
+        for interaction in self.interactions:
+            queues[interaction["request"]].append(interaction)
+        lock = threading.Lock()
+        send = requests.adapters.HTTPAdapter.send
+        cassette = self
+
+        def replaying_send(self, request, **kwargs):
+            key = cassette._key(request.method, request.url)
+            with lock:
+                queue = queues.get(key)
+                if not queue:
+                    raise CassetteError("Request not in cassette: {}".format(key))
+                interaction = queue.popleft() if len(queue) > 1 else queue[0]
+            return cassette._build_response(request, interaction)
+
+        for section, values in self.config.items():
+            config = Config().get_config(section)
+            for key, value in values.items():
+                config[key].set(value)
+        Config().get_config("openstack")["password"].set(REDACTED)
+
+        requests.adapters.HTTPAdapter.send = replaying_send
+        try:
+            with _activated():
+                yield self
+        finally:
+            requests.adapters.HTTPAdapter.send = send
+
+    def save(self, filename):
+        """Write the cassette as gzip compressed JSON."""
+        data = {"config": self.config, "interactions": self.interactions}
+        with gzip.open(filename, "wt", encoding="utf8") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a cassette written by save."""
+        with gzip.open(filename, "rt", encoding="utf8") as f:
+            data = json.load(f)
+        return cls(data["interactions"], data["config"])
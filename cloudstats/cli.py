@@ -1,17 +1,48 @@
 #!/usr/bin/env python3
 
 import argparse
+import contextlib
 import json
+import sys
+import time
+from datetime import datetime
+
+from prometheus_client import CollectorRegistry, generate_latest
 
 from . import prometheus
+from .cassette import Cassette
+from .config import Config
 from .exporter import StatsExporterDaemon
+from .opensdk import OpenstackStats
+from .profiling import Profiler, add_profile_arguments
 from .reporter import StatsReporterDaemon
+from .storage import DAILY, HOURLY, RAW, Storage
+
+RESOLUTIONS = {RAW: "raw", HOURLY: "hourly", DAILY: "daily"}
 
 
 def print_json(data):
     print(json.dumps(data, indent=4, sort_keys=True))
 
 
+def stat_history(stat, days, cloud=None):
+    """Return the history of a stat over the last days from the local store."""
+    if cloud is None:
+        cloud = Config().get_config("api")["cloud_uuid"].get(str)
+    samples = Storage().get_stat_history(cloud, stat, time.time() - days * DAILY)
+    return [
+        {
+            "time": datetime.utcfromtimestamp(at).isoformat() + "Z",
+            "resolution": RESOLUTIONS[resolution],
+            "count": count,
+            "mean": mean,
+            "min": low,
+            "max": high,
+        }
+        for at, resolution, count, mean, low, high in samples
+    ]
+
+
 def main():
     cli = argparse.ArgumentParser(
         prog="cloudstats",
@@ -57,21 +88,99 @@ def main():
         help="Build Grafana dashboard JSON data and print",
     )
 
+    cli.add_argument(
+        "--view-openstack",
+        dest="view_openstack",
+        action="store_true",
+        help="Collect OpenStack stats once and print the exported metrics",
+    )
+
+    cli.add_argument(
+        "--stat-history",
+        dest="stat_history",
+        metavar="STAT",
+        help="Print the history of a reported stat from the local store",
+    )
+
+    cli.add_argument(
+        "--days",
+        dest="days",
+        type=float,
+        default=90,
+        help="Days of history printed by --stat-history (default: 90)",
+    )
+
+    cli.add_argument(
+        "--cloud",
+        dest="cloud",
+        metavar="UUID",
+        help="Cloud of the history printed by --stat-history "
+        "(default: api.cloud_uuid)",
+    )
+
+    add_profile_arguments(cli)
+
+    cassette_group = cli.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record",
+        dest="record",
+        metavar="CASSETTE",
+        help="Record the OpenStack and Prometheus traffic to a cassette file",
+    )
+    cassette_group.add_argument(
+        "--replay",
+        dest="replay",
+        metavar="CASSETTE",
+        help="Answer OpenStack and Prometheus requests from a cassette file",
+    )
+
     args = cli.parse_args()
+
+    cassette = None
+    with contextlib.ExitStack() as stack:
+        if args.record:
+            cassette = stack.enter_context(Cassette().record())
+        elif args.replay:
+            cassette = stack.enter_context(Cassette.load(args.replay).replay())
+        status = run(args)
+
+    if args.record:
+        cassette.save(args.record)
+    sys.exit(status)
+
+
+def run(args):
     # TODO: this is ugly, try to remove later
     daemon_args = ["-d"] if args.debug else []
-
-    if args.view_report:
-        obj = prometheus.PrometheusStats()
-        data = obj.get_all_stats()
+    profile = bool(getattr(args, "profile.enabled"))
+    cprofile = bool(getattr(args, "profile.cprofile"))
+    if profile:
+        daemon_args.append("--profile")
+    if cprofile:
+        daemon_args.append("--cprofile")
+
+    if args.view_openstack:
+        registry = CollectorRegistry()
+        profiler = Profiler("exporter", enabled=profile, cprofile=cprofile)
+        with profiler.cycle():
+            OpenstackStats(registry=registry, profiler=profiler).get_all_stats()
+        print(generate_latest(registry).decode("utf8"))
+    elif args.view_report:
+        profiler = Profiler("reporter", enabled=profile, cprofile=cprofile)
+        obj = prometheus.PrometheusStats(profiler=profiler)
+        with profiler.cycle():
+            data = obj.get_all_stats()
         print_json(data)
+    elif args.stat_history:
+        print_json(stat_history(args.stat_history, args.days, args.cloud))
     elif args.build_dashboard:
         obj = prometheus.PrometheusStats()
         data = obj.build_dashboard()
         print_json(data)
     elif args.update_api:
         obj = StatsReporterDaemon(daemon_args)
-        obj.trigger()
+        # Failed uploads are left spooled, the caller is told by the status
+        return 0 if obj.update_api() else 1
     elif args.run_exporter:
         obj = StatsExporterDaemon(daemon_args)
         obj.run()
@@ -1,4 +1,5 @@
 """Config loader."""
+
 import confuse
 
 config = None
@@ -26,3 +27,14 @@ class Config:
             return self.config[section]
 
         return self.config
+
+    def cloud_config(self, cloud):
+        """Return the config of one of several clouds.
+
+        The settings of the cloud, e.g. its api and prometheus sections,
+        override the global ones.
+        """
+        overrides = {key: value for key, value in cloud.items() if key != "name"}
+        return confuse.RootView(
+            [confuse.ConfigSource.of(overrides)] + self.config.sources
+        )
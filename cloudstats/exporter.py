@@ -1,12 +1,23 @@
 """Main entrypoint for the cloudstats exporter daemon."""
+
+import argparse
+import os
 import sys
 import time
 
 from cloudstats.config import Config
+from cloudstats.exposition import ExpositionCache, SnapshotCache
+from cloudstats.http import ExporterApp, start_server
 from cloudstats.logging import get_logger
+from cloudstats.memory import MemoryAccounting
 from cloudstats.opensdk import OpenstackStats
+from cloudstats.profiling import Profiler, add_profile_arguments
+from cloudstats.scheduler import Scheduler
+from cloudstats.scrape import OnDemandCollector
+from cloudstats.snapshot import Snapshot, SnapshotError
+from cloudstats.workers import ShardedStats
 
-from prometheus_client import CollectorRegistry, start_http_server
+from prometheus_client import CollectorRegistry, Gauge
 
 
 class StatsExporterDaemon:
@@ -14,38 +25,197 @@ class StatsExporterDaemon:
 
     def __init__(self, args):
         """Create new daemon and configure runtime environment."""
-        self.setup_config()
-        self.logger = self.setup_logging()
-        self.logger.debug("Parsed config: {}".format(self.config.config_dir()))
+        self.args = self.parse_args(args)
+        self.setup_config(self.args)
+        self.profiler = self.setup_profiler()
         self._registry = CollectorRegistry()
+        self.snapshot_path = os.environ.get("CLOUDSTATSDIR", ".") + "/exporter.snap"
+        self.setup_snapshot_gauges()
         self.openstack = self.setup_openstack()
+        self.memory = self.setup_memory_accounting()
+        self.on_demand = self.setup_on_demand()
+        self.scheduler = self.setup_scheduler()
+        self.exposition = ExpositionCache(self._registry)
+        self.snapshot_cache = SnapshotCache()
+        # be careful, the OpenstackStats and Profiler loggers reset the level
+        self.logger = self.setup_logging()
+        self.logger.debug("Parsed config: {}".format(self.config.config_dir()))
+
+    def parse_args(self, args):
+        """Parse program arguments."""
+        parser = argparse.ArgumentParser(description="Export cloud statistics.")
+        parser.add_argument(
+            "-d", "--debug", help="Enable debug logging", action="store_true"
+        )
+        add_profile_arguments(parser)
+
+        return parser.parse_args(args)
 
-    def setup_config(self):
+    def setup_config(self, args=None):
         """Parse config file as dict."""
-        self.config = Config().get_config()
+        self.config = Config(args).get_config()
+
+    def setup_profiler(self):
+        """Return the Profiler timing each collection."""
+        return Profiler(
+            "exporter",
+            enabled=self.config["profile"]["enabled"].get(bool),
+            cprofile=self.config["profile"]["cprofile"].get(bool),
+        )
 
     def setup_logging(self):
         """Return the correct Logging instance based on debug option."""
         return get_logger(debug=self.config["debug"].get(bool))
 
     def setup_openstack(self):
-        """Return an instance of the OpenstackStats."""
-        return OpenstackStats(registry=self._registry)
+        """Return an instance of the OpenstackStats.
+
+        With exporter.workers set, the collectors are sharded across that many
+        worker processes instead, behind the same interface.
+        """
+        workers = self.config["exporter"]["workers"].get(int)
+        if workers > 0:
+            return ShardedStats(
+                self._registry,
+                workers,
+                args=self.args,
+                timeout=self.config["exporter"]["worker_timeout"].as_number(),
+            )
+        return OpenstackStats(registry=self._registry, profiler=self.profiler)
+
+    def setup_memory_accounting(self):
+        """Return the MemoryAccounting if diagnostics are enabled."""
+        if not self.config["exporter"]["diagnostics"].get(bool):
+            return None
+        return MemoryAccounting(
+            self.openstack,
+            self._registry,
+            top=self.config["exporter"]["diagnostics_top"].get(int),
+        )
+
+    def setup_scheduler(self):
+        """Return the Scheduler running the collections, None in scrape mode.
+
+        Its lag and skipped ticks are only exported when it runs, scrape mode
+        would otherwise serve them as zeros forever.
+        """
+        exporter = self.config["exporter"]
+        if exporter["collection_mode"].get(str) == "scrape":
+            return None
+        return Scheduler(
+            "exporter",
+            exporter["collect_interval"].as_number() * 60,
+            jitter=exporter["collect_jitter"].as_number(),
+            registry=self._registry,
+        )
+
+    def setup_on_demand(self):
+        """Return the OnDemandCollector if collections are triggered by scrapes."""
+        exporter = self.config["exporter"]
+        if exporter["collection_mode"].get(str) != "scrape":
+            return None
+        return OnDemandCollector(
+            self.trigger,
+            min_age=exporter["scrape_min_age"].as_number(),
+            deadline=exporter["scrape_deadline"].as_number(),
+        )
+
+    def setup_app(self):
+        """Return the WSGI application serving the metrics."""
+        app = ExporterApp(self._registry)
+        if self.memory:
+            app.add_route("/debug/memory", self.memory.handle)
+        app.add_route("/metrics", self.scrape)
+        app.add_route("/snapshot", self.snapshot_cache.handle)
+        return app
+
+    def scrape(self, environ):
+        """Serve /metrics from the rendering of the last collection.
+
+        In scrape mode a collection runs first if the data is too old. A scrape
+        never sees the gauges of a collection still in progress.
+        """
+        if self.on_demand and not self.on_demand.refresh():
+            self.logger.info(
+                "Collection still running after {}s, serving previous data.".format(
+                    self.on_demand.deadline
+                )
+            )
+        return self.exposition.handle(environ)
+
+    def setup_snapshot_gauges(self):
+        """Create the gauges describing the freshness of the exported data."""
+        self.snapshot_stale = Gauge(
+            "cloudstats_snapshot_stale",
+            "1 if the exported data was restored from disk at startup",
+            registry=self._registry,
+        )
+        self.snapshot_timestamp = Gauge(
+            "cloudstats_snapshot_timestamp_seconds",
+            "Time the exported data was collected",
+            registry=self._registry,
+        )
+
+    def load_snapshot(self):
+        """Export the snapshot of the last collection before a restart."""
+        max_age = self.config["exporter"]["snapshot_max_age"].get(int) * 60
+        try:
+            snapshot = Snapshot.load(self.snapshot_path)
+        except FileNotFoundError:
+            self.logger.debug("No snapshot found at {}".format(self.snapshot_path))
+            return
+        except (OSError, SnapshotError) as e:
+            self.logger.warning("Ignoring unreadable snapshot: {}".format(e))
+            return
+
+        if snapshot.age > max_age:
+            self.logger.info("Ignoring snapshot older than {}s.".format(max_age))
+            return
+
+        try:
+            self.openstack.restore_snapshot(snapshot)
+        except SnapshotError as e:
+            self.logger.warning("Ignoring snapshot: {}".format(e))
+            return
+        self.snapshot_stale.set(1)
+        self.snapshot_timestamp.set(snapshot.timestamp)
+        self.logger.info("Exporting stale snapshot until the first collection.")
+
+    def save_snapshot(self, snapshot):
+        """Persist the gauges of the last complete collection."""
+        try:
+            snapshot.save(self.snapshot_path)
+        except OSError as e:
+            self.logger.warning("Could not save snapshot: {}".format(e))
 
     def trigger(self):
         """Configure prometheus_client gauges from generated stats."""
         self.logger.debug("Collecting gauges...")
-        self.openstack.get_all_stats()
+        with self.profiler.cycle():
+            self.openstack.get_all_stats()
+        self.snapshot_stale.set(0)
+        self.snapshot_timestamp.set_to_current_time()
+        snapshot = self.openstack.snapshot()
+        if self.config["exporter"]["warm_start"].get(bool):
+            self.save_snapshot(snapshot)
+        if self.memory:
+            self.memory.report()
+        self.exposition.render()
+        self.snapshot_cache.render(snapshot)
         self.logger.info("Gauges collected and ready for exporting.")
 
     def run(self):
+        if self.config["exporter"]["warm_start"].get(bool):
+            self.load_snapshot()
+        # Rendered now so the restored snapshot is served until the first
+        # collection completes
+        self.exposition.render()
         self.logger.debug("Running prometheus client http server.")
-        start_http_server(
-            self.config["exporter"]["port"].get(), registry=self._registry
-        )
-        while True:
-            self.trigger()
-            time.sleep(self.config["exporter"]["collect_interval"].get(int) * 60)
+        start_server(self.setup_app(), self.config["exporter"]["port"].get())
+        if self.on_demand:
+            while True:
+                time.sleep(3600)
+        self.scheduler.run(self.trigger)
 
 
 def main():
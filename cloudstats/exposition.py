@@ -0,0 +1,118 @@
+"""Pre-rendered /metrics and /snapshot expositions of the cloudstats exporter."""
+
+import gzip
+import hashlib
+from urllib.parse import parse_qs
+
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.openmetrics import exposition as openmetrics
+
+# Compression level of the cached gzip renderings
+GZIP_LEVEL = 6
+
+# Content type and renderer of each exposition format
+FORMATS = {
+    "text": (CONTENT_TYPE_LATEST, generate_latest),
+    "openmetrics": (openmetrics.CONTENT_TYPE_LATEST, openmetrics.generate_latest),
+}
+
+
+def _accepts_gzip(header):
+    """Return whether an Accept-Encoding header prefers gzip to no coding."""
+    qualities = {}
+    for coding in header.split(","):
+        coding, *params = coding.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    gzip_quality = qualities.get("gzip", qualities.get("*", 0.0))
+    return gzip_quality > 0 and gzip_quality >= qualities.get("identity", 0.0)
+
+
+class ExpositionCache:
+    """Exposition of a registry rendered once per collection.
+
+    The text and OpenMetrics formats are both rendered and gzip compressed
+    when a collection completes, so scrapes are answered with the cached
+    bytes matching their Accept and Accept-Encoding headers without
+    serializing or compressing anything.
+    """
+
+    def __init__(self, registry):
+        """Create an empty cache of registry."""
+        self.registry = registry
+        self._renderings = None
+
+    def render(self):
+        """Render and compress the current state of the registry."""
+        renderings = {}
+        for name, (content_type, generate) in FORMATS.items():
+            body = generate(self.registry)
+            renderings[name] = (
+                content_type,
+                body,
+                gzip.compress(body, compresslevel=GZIP_LEVEL),
+            )
+        # Replaced at once so scrapes never mix two collections
+        self._renderings = renderings
+
+    def handle(self, environ):
+        """Serve the rendering negotiated by the scrape.
+
+        Scrapes selecting metrics with name[] parameters are rendered from the
+        registry on demand, as prometheus_client does.
+        """
+        accept = environ.get("HTTP_ACCEPT", "")
+        name = "openmetrics" if "application/openmetrics-text" in accept else "text"
+        gzipped = _accepts_gzip(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        names = parse_qs(environ.get("QUERY_STRING", "")).get("name[]")
+        if names:
+            content_type, generate = FORMATS[name]
+            body = generate(self.registry.restricted_registry(names))
+            compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        else:
+            if self._renderings is None:
+                self.render()
+            content_type, body, compressed = self._renderings[name]
+
+        if gzipped:
+            return 200, content_type, compressed, [("Content-Encoding", "gzip")]
+        return 200, content_type, body
+
+
+class SnapshotCache:
+    """Snapshot of the last collection, served with an ETag.
+
+    The reporter fetches it with a conditional GET and is answered 304 Not
+    Modified until another collection completes.
+    """
+
+    CONTENT_TYPE = "application/octet-stream"
+
+    def __init__(self):
+        """Create an empty cache."""
+        self._rendering = None
+
+    def render(self, snapshot):
+        """Serialize a snapshot once for all requests."""
+        body = snapshot.dumps()
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        self._rendering = (body, etag)
+
+    def handle(self, environ):
+        """Serve the snapshot unless the request already has it."""
+        if self._rendering is None:
+            return 503, "text/plain", b"No collection completed yet.\n"
+
+        body, etag = self._rendering
+        headers = [("ETag", etag)]
+        if environ.get("HTTP_IF_NONE_MATCH") == etag:
+            return 304, self.CONTENT_TYPE, b"", headers
+        return 200, self.CONTENT_TYPE, body, headers
@@ -0,0 +1,70 @@
+"""HTTP server of the cloudstats exporter."""
+
+import threading
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from prometheus_client import make_wsgi_app
+
+STATUS_LINES = {
+    200: "200 OK",
+    304: "304 Not Modified",
+    404: "404 Not Found",
+    503: "503 Service Unavailable",
+}
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """WSGI server handling each request in a thread."""
+
+    daemon_threads = True
+
+
+class _SilentHandler(WSGIRequestHandler):
+    """Request handler not logging every request to stderr."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ExporterApp:
+    """WSGI application serving /metrics and additional routes.
+
+    A route handler is called with the WSGI environ and returns the HTTP status
+    code, the content type, the body as bytes and optionally a list of extra
+    headers. Every other path is answered by prometheus_client from the
+    registry.
+    """
+
+    def __init__(self, registry):
+        """Create the application exporting registry."""
+        self.metrics_app = make_wsgi_app(registry)
+        self.routes = {}
+
+    def add_route(self, path, handler):
+        """Serve path with handler."""
+        self.routes[path] = handler
+
+    def __call__(self, environ, start_response):
+        handler = self.routes.get(environ.get("PATH_INFO"))
+        if handler is None:
+            return self.metrics_app(environ, start_response)
+
+        status, content_type, body, *headers = handler(environ)
+        headers = headers[0] if headers else []
+        start_response(
+            STATUS_LINES.get(status, str(status)),
+            [("Content-Type", content_type), ("Content-Length", str(len(body)))]
+            + headers,
+        )
+        return [body]
+
+
+def start_server(app, port, addr=""):
+    """Serve app from a daemon thread and return the server."""
+    server = make_server(
+        addr, port, app, _ThreadingWSGIServer, handler_class=_SilentHandler
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
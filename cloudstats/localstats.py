@@ -0,0 +1,242 @@
+"""Report stats computed from the snapshot served by the exporter.
+
+The stats derived from the OpenStack APIs are computed here from the gauges
+the exporter collected, with the same aggregations as their PromQL queries in
+prometheus_queries.yaml, so they don't depend on Prometheus. The stats using
+metrics of other exporters (libvirt, ceph, quotas...) are still queried.
+"""
+
+import math
+
+from cloudstats.logging import get_logger
+from cloudstats.snapshot import Snapshot, SnapshotError
+
+import requests
+
+
+def promql_round(value, to_nearest):
+    """Round like the PromQL round function."""
+    inverse = 1.0 / to_nearest
+    return math.floor(value * inverse + 0.5) / inverse
+
+
+def quantile(q, values):
+    """Return the q quantile of values, interpolated like PromQL."""
+    values = sorted(values)
+    rank = q * (len(values) - 1)
+    lower = math.floor(rank)
+    upper = min(lower + 1, len(values) - 1)
+    weight = rank - lower
+    return values[lower] * (1 - weight) + values[upper] * weight
+
+
+AGGREGATIONS = {
+    "sum": sum,
+    "max": max,
+    "min": min,
+    "avg": lambda values: sum(values) / len(values),
+    "median": lambda values: quantile(0.5, values),
+    "count": len,
+}
+
+
+class SnapshotSamples:
+    """Samples of the metrics of a snapshot."""
+
+    def __init__(self, snapshot):
+        """Read the samples of snapshot."""
+        self.snapshot = snapshot
+
+    def grouped(self, metric, by):
+        """Return the values of metric summed by the value of label by."""
+        groups = {}
+        for labels, value in self.snapshot.samples(metric):
+            groups[labels.get(by)] = groups.get(labels.get(by), 0) + value
+        return groups
+
+    def values(self, metric, by=None):
+        """Return the values of metric, summed by label by if given."""
+        if by is not None:
+            return list(self.grouped(metric, by).values())
+        return [value for _, value in self.snapshot.samples(metric)]
+
+
+def _number(value):
+    """Return value as an int if integral, as Prometheus formats it."""
+    if value is None or isinstance(value, int):
+        return value
+    return int(value) if float(value).is_integer() else value
+
+
+def aggregate(aggregation, metric, by=None, divisor=1, precision=None):
+    """Return a stat aggregating the values of metric."""
+
+    def stat(samples):
+        values = samples.values(metric, by=by)
+        if not values:
+            return None
+        value = AGGREGATIONS[aggregation](values) / divisor
+        if precision is not None:
+            value = promql_round(value, precision)
+        return _number(value)
+
+    return stat
+
+
+def _subnets_free(samples):
+    """Return the free IPs of each subnet."""
+    total = samples.grouped("neutron_subnet_ips_total", "subnet_id")
+    used = samples.grouped("neutron_subnet_ips_used", "subnet_id")
+    return {subnet: total[subnet] - used[subnet] for subnet in total if subnet in used}
+
+
+def _min_subnet_free(samples):
+    free = _subnets_free(samples)
+    return _number(min(free.values())) if free else None
+
+
+def _min_subnet_free_name(samples):
+    free = _subnets_free(samples)
+    return min(free, key=free.get) if free else None
+
+
+def _mean_ip_allocation_percent(samples):
+    total = samples.grouped("neutron_subnet_ips_total", "subnet_id")
+    used = samples.grouped("neutron_subnet_ips_used", "subnet_id")
+    percents = [
+        used[subnet] / total[subnet] * 100
+        for subnet in total
+        if subnet in used and total[subnet]
+    ]
+    if not percents:
+        return None
+    return _number(promql_round(sum(percents) / len(percents), 0.1))
+
+
+# Stats computed from the snapshot, per collector of prometheus_queries.yaml.
+# Each one is a function of the SnapshotSamples returning the stat or None.
+LOCAL_STATS = {
+    "hypervisor_stats": {
+        "max_cores": aggregate("max", "hypervisor_topology_n_cores"),
+        "median_cores": aggregate("median", "hypervisor_topology_n_cores"),
+        "mean_cores": aggregate("avg", "hypervisor_topology_n_cores", precision=0.1),
+        "min_cores": aggregate("min", "hypervisor_topology_n_cores"),
+        "total_cores": aggregate("max", "hypervisor_topology_n_cores"),
+    },
+    "virtual_server_stats": {
+        "total_ephemeral_servers": aggregate("sum", "hypervisor_servers"),
+        "max_ephemeral_size": aggregate(
+            "max", "server_ephemeral_size", by="server_uuid"
+        ),
+        "median_ephemeral_size": aggregate(
+            "median", "server_ephemeral_size", by="server_uuid"
+        ),
+        "mean_ephemeral_size": aggregate(
+            "avg", "server_ephemeral_size", by="server_uuid", precision=0.1
+        ),
+        "min_ephemeral_size": aggregate(
+            "min", "server_ephemeral_size", by="server_uuid"
+        ),
+        "total_ephemeral_size": aggregate("sum", "hypervisor_ephemeral_size"),
+    },
+    "object_storage_stats": {
+        "total_containers": aggregate("sum", "swift_account_containers"),
+        "total_object_count": aggregate("sum", "swift_account_objects"),
+        "max_object_count": aggregate("max", "container_objects"),
+        "median_object_count": aggregate(
+            "median", "container_objects", by="container_name"
+        ),
+        "mean_object_count": aggregate(
+            "avg", "container_objects", by="container_name", precision=0.1
+        ),
+        "min_object_count": aggregate("min", "container_objects", by="container_name"),
+        "total_object_bytes": aggregate("sum", "swift_account_bytes"),
+        "max_container_bytes": aggregate("max", "container_bytes"),
+        "median_container_bytes": aggregate("median", "container_bytes"),
+        "mean_container_bytes": aggregate("avg", "container_bytes", precision=0.1),
+        "min_container_bytes": aggregate("min", "container_bytes"),
+    },
+    "image_stats": {
+        "num_images": aggregate("sum", "glance_project_images"),
+        "mean_image_size": aggregate(
+            "avg", "glance_image_size", divisor=1000 * 1000, precision=0.1
+        ),
+        # avg as in its PromQL query, so both sources report the same
+        "max_image_size": aggregate(
+            "avg", "glance_image_size", divisor=1000 * 1000, precision=0.1
+        ),
+        "median_image_size": aggregate(
+            "median", "glance_image_size", divisor=1000 * 1000, precision=0.1
+        ),
+        "min_image_size": aggregate(
+            "min", "glance_image_size", divisor=1000 * 1000, precision=0.1
+        ),
+        "total_image_size": aggregate(
+            "sum", "glance_project_image_size", divisor=1000 * 1000, precision=0.1
+        ),
+    },
+    "volume_stats": {
+        "num_volumes": aggregate("sum", "cinder_total_volumes"),
+        "max_volume_size": aggregate("max", "cinder_volume_size"),
+        "median_volume_size": aggregate("median", "cinder_volume_size"),
+        "mean_volume_size": aggregate("avg", "cinder_volume_size", precision=0.1),
+        # max as in its PromQL query, so both sources report the same
+        "min_volume_size": aggregate("max", "cinder_volume_size"),
+        "total_volume_size": aggregate("sum", "cinder_total_volume_size"),
+    },
+    "ipaddress_stats": {
+        "min_subnet_free": _min_subnet_free,
+        "min_subnet_free_name": _min_subnet_free_name,
+        "mean_ip_allocation_percent": _mean_ip_allocation_percent,
+        "num_ip_allocated": aggregate("sum", "neutron_subnet_ips_used"),
+    },
+    "networking_stats": {
+        "num_routers": aggregate("sum", "neutron_total_routers"),
+        "num_subnets": aggregate("count", "neutron_subnet_ips_total", by="subnet_id"),
+        "num_networks": aggregate("sum", "neutron_total_networks"),
+        # networks as in its PromQL query, so both sources report the same
+        "num_load_balancers": aggregate("sum", "neutron_total_networks"),
+    },
+}
+
+
+class SnapshotSource:
+    """Snapshot of the exporter, fetched with conditional GETs.
+
+    The exporter answers 304 Not Modified while its last collection is the
+    one already fetched, so an unchanged snapshot is not downloaded again.
+    """
+
+    def __init__(self, url, max_age, timeout=10, session=None):
+        """Create a source fetching the snapshot served at url."""
+        self.logger = get_logger()
+        self.http = session if session is not None else requests
+        self.url = url
+        self.max_age = max_age
+        self.timeout = timeout
+        self.etag = None
+        self.snapshot = None
+
+    def fetch(self):
+        """Return the latest snapshot, or None if it isn't available."""
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        try:
+            response = self.http.get(self.url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and self.snapshot is not None:
+                self.logger.debug("Exporter snapshot not modified.")
+            else:
+                response.raise_for_status()
+                self.snapshot = Snapshot.loads(response.content)
+                self.etag = response.headers.get("ETag")
+        except (requests.exceptions.RequestException, SnapshotError) as e:
+            self.logger.warning("Can't fetch the exporter snapshot: {}".format(e))
+            return None
+
+        if self.snapshot.age > self.max_age:
+            self.logger.warning(
+                "Exporter snapshot is {:.0f}s old, ignoring it.".format(
+                    self.snapshot.age
+                )
+            )
+            return None
+        return self.snapshot
@@ -0,0 +1,130 @@
+"""Memory accounting of the cloudstats exporter."""
+
+import json
+import sys
+import threading
+import tracemalloc
+
+from prometheus_client import Gauge
+
+
+def _sample_size(sample):
+    """Return the approximate bytes held by one sample of a metric."""
+    size = sys.getsizeof(sample.value)
+    for name, value in sample.labels.items():
+        size += sys.getsizeof(name) + sys.getsizeof(value)
+    return size
+
+
+class MemoryAccounting:
+    """Account for the memory used by an exporter.
+
+    Reports the top allocators found by tracemalloc, the series count and
+    approximate size of every metric and the number of objects held by each
+    OpenstackStats cache, as JSON and as gauges.
+    """
+
+    def __init__(self, openstack, registry, top=10, frames=1):
+        """Start tracing the allocations of the exporter."""
+        self.openstack = openstack
+        self.registry = registry
+        self.top = top
+        self._lock = threading.Lock()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.setup_gauges()
+
+    def setup_gauges(self):
+        """Create the gauges exporting the accounting."""
+        self.traced_bytes = Gauge(
+            "cloudstats_memory_traced_bytes",
+            "Memory currently allocated by the exporter, traced by tracemalloc",
+            registry=self.registry,
+        )
+        self.top_allocation_bytes = Gauge(
+            "cloudstats_memory_top_allocation_bytes",
+            "Memory allocated by the source lines allocating the most",
+            ["location"],
+            registry=self.registry,
+        )
+        self.metric_series = Gauge(
+            "cloudstats_metric_series",
+            "Number of series of each exported metric",
+            ["metric"],
+            registry=self.registry,
+        )
+        self.metric_bytes = Gauge(
+            "cloudstats_metric_bytes",
+            "Approximate memory held by the series of each exported metric",
+            ["metric"],
+            registry=self.registry,
+        )
+        self.cache_objects = Gauge(
+            "cloudstats_cache_objects",
+            "Number of objects held by each cache of the exporter",
+            ["cache"],
+            registry=self.registry,
+        )
+
+    def top_allocations(self):
+        """Return the locations allocating the most memory."""
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        return [
+            {
+                "location": "{}:{}".format(
+                    stat.traceback[0].filename, stat.traceback[0].lineno
+                ),
+                "bytes": stat.size,
+                "blocks": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[: self.top]
+        ]
+
+    def metric_sizes(self):
+        """Return the series count and approximate bytes of every metric."""
+        sizes = {}
+        for metric in self.registry.collect():
+            samples = metric.samples
+            sizes[metric.name] = {
+                "series": len(samples),
+                "bytes": sum(_sample_size(sample) for sample in samples),
+            }
+        return sizes
+
+    def report(self):
+        """Return the memory accounting and update its gauges."""
+        with self._lock:
+            return self._report()
+
+    def _report(self):
+        traced, peak = tracemalloc.get_traced_memory()
+        report = {
+            "traced_bytes": traced,
+            "peak_traced_bytes": peak,
+            "top_allocations": self.top_allocations(),
+            "metrics": self.metric_sizes(),
+            "caches": self.openstack.cache_sizes(),
+        }
+
+        self.traced_bytes.set(traced)
+        self.top_allocation_bytes.clear()
+        for allocation in report["top_allocations"]:
+            self.top_allocation_bytes.labels(allocation["location"]).set(
+                allocation["bytes"]
+            )
+        self.metric_series.clear()
+        self.metric_bytes.clear()
+        for name, size in report["metrics"].items():
+            self.metric_series.labels(name).set(size["series"])
+            self.metric_bytes.labels(name).set(size["bytes"])
+        for name, count in report["caches"].items():
+            self.cache_objects.labels(name).set(count)
+
+        return report
+
+    def handle(self, environ):
+        """Serve the memory accounting as JSON."""
+        body = json.dumps(self.report(), indent=4, sort_keys=True)
+        return 200, "application/json", body.encode("utf8")
@@ -1,28 +1,77 @@
 """Openstack stats processing module."""
 
+import hashlib
 import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+import cloudstats.cassette
 from cloudstats.config import Config
 from cloudstats.logging import get_logger
+from cloudstats.profiling import Profiler
+from cloudstats.selfmetrics import CollectionMetrics
+from cloudstats.snapshot import Snapshot, SnapshotError
 
 from keystoneauth1 import exceptions as keystone_exceptions
 
 import openstack
 
-from prometheus_client import CollectorRegistry, Gauge
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+# Listing read by each collector, fetched ahead by the asyncio engine
+PREFETCHED_LISTINGS = {
+    "network": "networks",
+    "ipa": "ipas",
+    "router": "routers",
+    "volume": "volumes",
+    "floating_ip": "floating_ip",
+    "image": "images",
+    "server": "servers",
+    "hypervisor": "hypervisors",
+}
+
+# Caches of the listed resources, whose objects are counted by the self-metrics
+# and the memory accounting
+LISTING_CACHES = [
+    "projects",
+    "hypervisors",
+    "servers",
+    "networks",
+    "subnets",
+    "ipas",
+    "routers",
+    "load_balancers",
+    "floating_ip",
+    "volumes",
+    "images",
+    "object_accounts",
+]
 
 
 class OpenstackStats:
     """Class for interacting with Openstack."""
 
-    def __init__(self, registry=None):
-        """Create OpenStack client."""
+    def __init__(self, registry=None, connection=None, profiler=None, collectors=None):
+        """Create OpenStack client.
+
+        A connection can be passed in to replace the one built from the
+        config, e.g. a fake cloud for benchmarks. collectors restricts the
+        collection to a subset of the collectors, e.g. in a worker process.
+        """
         self.logger = get_logger()
+        self.enabled_collectors = collectors
+        self.profiler = profiler or Profiler("exporter")
         self.config = Config().get_config("openstack")
-        self.connection = self._get_connection()
+        self._registry = registry or CollectorRegistry()
+        self.metrics = CollectionMetrics(self._registry)
+        self.connection = connection or self._get_connection()
         self._clear_cache()
         self.gauge_dict = {}
-        self._registry = registry or CollectorRegistry()
+        self.counter_dict = {}
+        # Previous collection of each resource type, for the churn counters
+        self._inventories = {}
+        # Whether a Swift account denied to us was already warned about
+        self._object_access_warned = False
         self.logger.debug("OpenstackStats initialized")
 
     def _get_connection(self):
@@ -43,6 +92,7 @@ class OpenstackStats:
             auth_version=self.config["auth_version"].get(int),
             cacert=self.config["cacert"].get(str),
         )
+        self.metrics.instrument_session(connection.session)
 
         return connection
 
@@ -58,163 +108,344 @@ class OpenstackStats:
         self._load_balancers_cache = None
         self._floating_ip_cache = None
         self._volumes_cache = None
+        self._volume_summary_cache = None
+        self._hypervisor_statistics_cache = None
         self._images_cache = None
-        self._containers_cache = None
+        self._object_accounts_cache = None
 
     @property
     def _projects(self):
-        if not self._projects_cache:
-            self._projects_cache = []
-            projects_gen = self.connection.identity.projects()
+        if self._projects_cache is None:
+            with self.profiler.stage("list projects"):
+                self._projects_cache = []
+                projects_gen = self.connection.identity.projects()
 
-            for project in projects_gen:
-                self._projects_cache.append(project)
+                for project in projects_gen:
+                    self._projects_cache.append(project)
 
         return self._projects_cache
 
     @property
     def _hypervisors(self):
-        if not self._hypervisors_cache:
-            self._hypervisors_cache = []
-            hypervisor_gen = self.connection.compute.hypervisors(details=True)
+        if self._hypervisors_cache is None:
+            with self.profiler.stage("list hypervisors"):
+                self._hypervisors_cache = []
+                hypervisor_gen = self.connection.compute.hypervisors(details=True)
 
-            for hypervisor in hypervisor_gen:
-                self._hypervisors_cache.append(hypervisor)
+                for hypervisor in hypervisor_gen:
+                    self._hypervisors_cache.append(hypervisor)
 
         return self._hypervisors_cache
 
     @property
     def _servers(self):
-        if not self._servers_cache:
-            self._servers_cache = []
-            server_gen = self.connection.compute.servers(
-                details=True, all_projects=True
-            )
+        if self._servers_cache is None:
+            with self.profiler.stage("list servers"):
+                self._servers_cache = []
+                server_gen = self.connection.compute.servers(
+                    details=True, all_projects=True
+                )
 
-            for server in server_gen:
-                # For Ocata, pull flavor's details individually
-                try:
-                    if (
-                        "disk" not in server["flavor"]
-                        or "ephemeral" not in server["flavor"]
-                    ):
-                        server["flavor"] = self.connection.compute.get_flavor(
-                            server["flavor"]["id"]
-                        )
-                except KeyError:
-                    self.logger.debug(
-                        "Didn't find flavor for virtual server %s, "
-                        "server.flavor does not provide disk info",
-                        server["id"],
-                    )
-                    self.keyerrorcount += 1
-                self._servers_cache.append(server)
+                for server in server_gen:
+                    self._complete_flavor(server)
+                    self._servers_cache.append(server)
 
         return self._servers_cache
 
+    def _complete_flavor(self, server):
+        """For Ocata, pull the flavor's details of a server individually."""
+        try:
+            if "disk" not in server["flavor"] or "ephemeral" not in server["flavor"]:
+                server["flavor"] = self.connection.compute.get_flavor(
+                    server["flavor"]["id"]
+                )
+        except KeyError:
+            self.logger.debug(
+                "Didn't find flavor for virtual server %s, "
+                "server.flavor does not provide disk info",
+                server["id"],
+            )
+            self.keyerrorcount += 1
+            self.metrics.key_errors.labels("server").inc()
+
     @property
     def _networks(self):
-        if not self._networks_cache:
-            self._networks_cache = []
-            network_gen = self.connection.network.networks()
+        if self._networks_cache is None:
+            with self.profiler.stage("list networks"):
+                self._networks_cache = []
+                # Only the count is exported, so don't transfer the full objects
+                network_gen = self.connection.network.networks(fields="id")
 
-            for network in network_gen:
-                self._networks_cache.append(network)
+                for network in network_gen:
+                    self._networks_cache.append(network)
 
         return self._networks_cache
 
     @property
     def _subnets(self):
-        if not self._subnets_cache:
-            self._subnets_cache = []
-            subnets_gen = self.connection.network.subnets()
+        if self._subnets_cache is None:
+            with self.profiler.stage("list subnets"):
+                self._subnets_cache = []
+                subnets_gen = self.connection.network.subnets()
 
-            for subnet in subnets_gen:
-                self._subnets_cache.append(subnet)
+                for subnet in subnets_gen:
+                    self._subnets_cache.append(subnet)
 
         return self._subnets_cache
 
     @property
     def _ipas(self):
-        if not self._ipas_cache:
-            self._ipas_cache = []
-            ipas_gen = self.connection.network.network_ip_availabilities()
+        if self._ipas_cache is None:
+            with self.profiler.stage("list network_ip_availabilities"):
+                self._ipas_cache = []
+                ipas_gen = self.connection.network.network_ip_availabilities()
 
-            for ipa in ipas_gen:
-                self._ipas_cache.append(ipa)
+                for ipa in ipas_gen:
+                    self._ipas_cache.append(ipa)
 
         return self._ipas_cache
 
     @property
     def _routers(self):
-        if not self._routers_cache:
-            self._routers_cache = []
-            routers_gen = self.connection.network.routers()
+        if self._routers_cache is None:
+            with self.profiler.stage("list routers"):
+                self._routers_cache = []
+                routers_gen = self.connection.network.routers(fields="id")
 
-            for router in routers_gen:
-                self._routers_cache.append(router)
+                for router in routers_gen:
+                    self._routers_cache.append(router)
 
         return self._routers_cache
 
     @property
     def _load_balancers(self):
-        if not self._load_balancers_cache:
-            self._load_balancers_cache = []
-            try:
-                load_balancers_gen = self.connection.network.load_balancers()
-                for load_balancer in load_balancers_gen:
-                    self._load_balancers_cache.append(load_balancer)
-            except openstack.exceptions.ResourceNotFound:
-                pass
+        if self._load_balancers_cache is None:
+            with self.profiler.stage("list load_balancers"):
+                self._load_balancers_cache = []
+                try:
+                    # Only the count is exported, so don't transfer the full objects
+                    load_balancers_gen = self.connection.network.load_balancers(
+                        fields="id"
+                    )
+                    for load_balancer in load_balancers_gen:
+                        self._load_balancers_cache.append(load_balancer)
+                except openstack.exceptions.ResourceNotFound:
+                    pass
 
         return self._load_balancers_cache
 
     @property
     def _floating_ip(self):
-        if not self._floating_ip_cache:
-            self._floating_ip_cache = []
-            floating_ip_gen = self.connection.network.ips(all_projects=True)
+        if self._floating_ip_cache is None:
+            with self.profiler.stage("list floating_ips"):
+                self._floating_ip_cache = []
+                floating_ip_gen = self.connection.network.ips(all_projects=True)
 
-            for floating_ip in floating_ip_gen:
-                self._floating_ip_cache.append(floating_ip)
+                for floating_ip in floating_ip_gen:
+                    self._floating_ip_cache.append(floating_ip)
 
         return self._floating_ip_cache
 
     @property
     def _volumes(self):
-        if not self._volumes_cache:
-            self._volumes_cache = []
-            volumes_gen = self.connection.block_storage.volumes(all_projects=True)
+        if self._volumes_cache is None:
+            with self.profiler.stage("list volumes"):
+                self._volumes_cache = []
+                volumes_gen = self.connection.block_storage.volumes(all_projects=True)
 
-            for volume in volumes_gen:
-                self._volumes_cache.append(volume)
+                for volume in volumes_gen:
+                    self._volumes_cache.append(volume)
 
         return self._volumes_cache
 
+    @property
+    def _volume_summary(self):
+        """Return the count and total size of all volumes.
+
+        Uses the Cinder summary API (microversion 3.12) so no volumes need to
+        be listed, falling back to counting the full listing on older clouds.
+        """
+        if self._volume_summary_cache is None:
+            with self.profiler.stage("list volume_summary"):
+                response = self.connection.block_storage.get(
+                    "/volumes/summary",
+                    params={"all_tenants": True},
+                    headers={"OpenStack-API-Version": "volume 3.12"},
+                )
+                if response.status_code == 200:
+                    summary = response.json()["volume-summary"]
+                    self._volume_summary_cache = {
+                        "count": summary["total_count"],
+                        "size": summary["total_size"],
+                    }
+                else:
+                    self.logger.debug(
+                        "Volume summary unavailable (%s), counting volume listing",
+                        response.status_code,
+                    )
+                    self._volume_summary_cache = {
+                        "count": len(self._volumes),
+                        "size": sum(volume["size"] or 0 for volume in self._volumes),
+                    }
+
+        return self._volume_summary_cache
+
+    @property
+    def _hypervisor_statistics(self):
+        """Return the Nova totals aggregated over all hypervisors."""
+        if self._hypervisor_statistics_cache is None:
+            with self.profiler.stage("list hypervisor_statistics"):
+                self._hypervisor_statistics_cache = {}
+                response = self.connection.compute.get("/os-hypervisors/statistics")
+                if response.status_code == 200:
+                    self._hypervisor_statistics_cache = response.json()[
+                        "hypervisor_statistics"
+                    ]
+                else:
+                    self.logger.debug(
+                        "Hypervisor statistics unavailable (%s)", response.status_code
+                    )
+
+        return self._hypervisor_statistics_cache
+
     @property
     def _images(self):
-        if not self._images_cache:
-            self._images_cache = []
-            images_gen = self.connection.image.images()
+        if self._images_cache is None:
+            with self.profiler.stage("list images"):
+                self._images_cache = []
+                images_gen = self.connection.image.images()
 
-            for image in images_gen:
-                self._images_cache.append(image)
+                for image in images_gen:
+                    self._images_cache.append(image)
 
         return self._images_cache
 
     @property
-    def _containers(self):
-        if not self._containers_cache:
-            self._containers_cache = []
-            try:
-                containers_gen = self.connection.object_store.containers()
+    def _object_accounts(self):
+        if self._object_accounts_cache is None:
+            with self.profiler.stage("list object_store_accounts"):
+                self._object_accounts_cache = []
+                max_workers = self.config["object_store"]["max_workers"].get(int)
+
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    accounts_gen = executor.map(
+                        lambda args: self._try_object_account(*args),
+                        self._object_account_urls(self._object_store_endpoint()),
+                    )
+
+                    for account in accounts_gen:
+                        if account is not None:
+                            self._object_accounts_cache.append(account)
+
+        return self._object_accounts_cache
+
+    def _object_store_endpoint(self):
+        """Return the Swift endpoint of our own account, None if there is none."""
+        try:
+            return self.connection.object_store.get_endpoint() or None
+        except keystone_exceptions.catalog.EndpointNotFound:
+            return None
+
+    def _object_account_urls(self, endpoint, projects=None):
+        """Return (project_id, project_name, url) for each Swift account to query.
+
+        Swift accounts are addressed by the project id in the endpoint URL, so
+        the accounts of other projects are reached by swapping our own project
+        id for theirs. This requires the exporter user to be a reseller admin.
+        The projects are listed unless given.
+        """
+        if endpoint is None:
+            return []
+
+        own_project_id = self.connection.current_project_id
+        if (
+            not self.config["object_store"]["all_projects"].get(bool)
+            or own_project_id not in endpoint
+        ):
+            return [(own_project_id, self.config["project_name"].get(str), endpoint)]
+
+        return [
+            (
+                project.id,
+                project.name,
+                endpoint.replace(own_project_id, project.id),
+            )
+            for project in (self._projects if projects is None else projects)
+        ]
+
+    def _try_object_account(self, project_id, project_name, url):
+        """Get a Swift account, None if it fails without failing the others."""
+        try:
+            return self._get_object_account(project_id, project_name, url)
+        except Exception as e:
+            self.logger.warning(
+                "Failed to get the Swift account of project %s: %r", project_id, e
+            )
+            return None
 
-                for container in containers_gen:
-                    self._containers_cache.append(container)
-            except keystone_exceptions.catalog.EndpointNotFound:
-                pass
+    def _skip_object_account(self, project_id, status):
+        """Log a Swift account that can't be read, warning once if denied."""
+        if status in (401, 403) and not self._object_access_warned:
+            self._object_access_warned = True
+            self.logger.warning(
+                "Swift account of project %s denied with %s, the object storage "
+                "totals miss it. Reading other projects' accounts requires the "
+                "reseller admin role, or set object_store.all_projects to False.",
+                project_id,
+                status,
+            )
+        else:
+            self.logger.debug(
+                "Skipping Swift account of project %s, HEAD returned %s",
+                project_id,
+                status,
+            )
 
-        return self._containers_cache
+    def _get_object_account(self, project_id, project_name, url):
+        """Get the totals, and optionally the containers, of a Swift account."""
+        response = self.connection.object_store.head(url)
+        if response.status_code not in (200, 204):
+            self._skip_object_account(project_id, response.status_code)
+            return None
+
+        account = self._object_account(project_id, project_name, response.headers)
+        if self.config["object_store"]["container_details"].get(bool):
+            account["container_list"] = self._list_account_containers(url)
+
+        return account
+
+    @staticmethod
+    def _object_account(project_id, project_name, headers):
+        """Return the totals of a Swift account from its HEAD response headers."""
+        return {
+            "project_id": project_id,
+            "project_name": project_name,
+            "containers": int(headers.get("X-Account-Container-Count", 0)),
+            "objects": int(headers.get("X-Account-Object-Count", 0)),
+            "bytes": int(headers.get("X-Account-Bytes-Used", 0)),
+            "container_list": [],
+        }
+
+    def _list_account_containers(self, url):
+        """Page through the containers of a Swift account."""
+        containers = []
+        marker = None
+
+        while True:
+            params = {"format": "json"}
+            if marker:
+                params["marker"] = marker
+            response = self.connection.object_store.get(url, params=params)
+            if response.status_code != 200:
+                break
+
+            page = response.json()
+            if not page:
+                break
+            containers.extend(page)
+            marker = page[-1]["name"]
+
+        return containers
 
     def get_all_stats(self):
         """Get all stats."""
@@ -222,15 +453,20 @@ class OpenstackStats:
         # The gauges now act as the cache
         self.keyerrorcount = 0
         self._clear_cache()
-        self._get_network_stats()
-        self._get_ipa_stats()
-        self._get_router_stats()
-        self._get_load_balancer_stats()
-        self._get_volume_stats()
-        self._get_image_stats()
-        self._get_object_stats()
-        self._get_server_stats()
-        self._get_hypervisor_stats()
+        with self.profiler.stage("auth"):
+            self.connection.authorize()
+        if self.config["collection_engine"].get(str) == "asyncio":
+            if cloudstats.cassette.active():
+                # Its aiohttp traffic would be neither recorded nor replayed
+                self.logger.debug("Cassette active, collecting synchronously.")
+            else:
+                with self.profiler.stage("prefetch"):
+                    self._prefetch()
+        for collector in self._collectors():
+            with self.profiler.stage("{}_stats".format(collector)):
+                with self.metrics.collector(collector):
+                    getattr(self, "_get_{}_stats".format(collector))()
+        self._count_objects_processed()
         if self.keyerrorcount > 0:
             self.logger.warning(
                 "Experienced %s KeyErrors from opensdk that may affect metrics. "
@@ -238,6 +474,93 @@ class OpenstackStats:
                 self.keyerrorcount,
             )
 
+    def _prefetch(self):
+        """Fetch the listings the collectors need concurrently with asyncio."""
+        # Imported here so aiohttp is only loaded when the engine is used
+        from cloudstats.aio import AsyncEngine
+
+        collectors = self._collectors()
+        listings = ["projects"] + [
+            listing
+            for collector, listing in PREFETCHED_LISTINGS.items()
+            if collector in collectors
+        ]
+        # Floating IPs only feed the churn counters, volumes are only listed for
+        # the per-object and aggregated gauges
+        if not self.config["churn_counters"].get(bool) and "floating_ip" in listings:
+            listings.remove("floating_ip")
+        if not self._list_objects and "volumes" in listings:
+            listings.remove("volumes")
+
+        engine = AsyncEngine(
+            self, max_concurrency=self.config["async_max_concurrency"].get(int)
+        )
+        engine.prefetch(listings, object_accounts="object" in collectors)
+
+    def _count_objects_processed(self):
+        """Count the objects listed during the collection."""
+        for resource, cache in self._caches():
+            self.metrics.objects_processed.labels(resource).inc(len(cache))
+
+    def _collectors(self):
+        """Return the names of the collectors to run, in order."""
+        collectors = [
+            "network",
+            "ipa",
+            "router",
+            "load_balancer",
+            "volume",
+            "object",
+            "floating_ip",
+            "nova",
+        ]
+        if self._list_objects:
+            collectors += ["image", "server"]
+        collectors.append("hypervisor")
+        if self.enabled_collectors is not None:
+            collectors = [c for c in collectors if c in self.enabled_collectors]
+        return collectors
+
+    @property
+    def _list_objects(self):
+        """Return True if volumes, images and servers need to be listed."""
+        per_object = self.config["per_object_gauges"].get(bool)
+        return per_object or self.config["aggregated_gauges"].get(bool)
+
+    def _caches(self):
+        """Yield the name and content of every filled listing cache."""
+        for resource in LISTING_CACHES:
+            cache = getattr(self, "_{}_cache".format(resource))
+            if cache is not None:
+                yield resource, cache
+
+    def cache_sizes(self):
+        """Return the number of objects held by each listing cache."""
+        sizes = {resource: len(cache) for resource, cache in self._caches()}
+        for resource, inventory in self._inventories.items():
+            sizes["{}_inventory".format(resource)] = len(inventory)
+        sizes["gauges"] = len(self.gauge_dict)
+        sizes["counters"] = len(self.counter_dict)
+        return sizes
+
+    def snapshot(self):
+        """Return a Snapshot of all gauges."""
+        return Snapshot.from_gauges(self.gauge_dict)
+
+    def restore_snapshot(self, snapshot):
+        """Set all gauges to the values stored in a Snapshot."""
+        if any("labelnames" not in metric for metric in snapshot.metrics.values()):
+            raise SnapshotError("Not a snapshot of OpenstackStats gauges.")
+        for name, metric in snapshot.metrics.items():
+            labelnames = metric["labelnames"]
+            for sample in metric["samples"]:
+                self._create_or_update_gauge(
+                    name,
+                    metric["documentation"],
+                    labels=dict(zip(labelnames, sample[:-1])),
+                    value=sample[-1],
+                )
+
     def _project_id_to_name(self, id):
         """Get project name from id."""
         for project in self._projects:
@@ -258,6 +581,7 @@ class OpenstackStats:
                 json.dumps(object_dict),
             )
             self.keyerrorcount += 1
+            self.metrics.key_errors.labels("project").inc()
             return "unknown"
 
     def _create_or_update_gauge(self, gauge_name, gauge_desc, labels={}, value=0.0):
@@ -288,6 +612,82 @@ class OpenstackStats:
             self.logger.debug("Updating Gauge {}: {}".format(gauge_name, value))
             self.gauge_dict[gauge_name].set(value)
 
+    def _increment_counter(self, counter_name, counter_desc, labels):
+        if counter_name not in self.counter_dict:
+            self.logger.debug("Creating Counter {}".format(counter_name))
+            self.counter_dict[counter_name] = Counter(
+                counter_name,
+                counter_desc,
+                labelnames=list(labels.keys()),
+                registry=self._registry,
+            )
+
+        self.counter_dict[counter_name].labels(**labels).inc()
+
+    @staticmethod
+    def _hash_id(id):
+        """Return a compact, stable 64 bit hash of a resource id."""
+        digest = hashlib.blake2b(str(id).encode("utf8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def _update_churn(self, resource, inventory):
+        """Count resources created, deleted and resized since the last collection.
+
+        The inventory maps the hashed id of every resource of a type to its
+        project name and size, anything that changes on resize.
+        """
+        if not self.config["churn_counters"].get(bool):
+            return
+
+        previous = self._inventories.get(resource)
+        self._inventories[resource] = inventory
+        if previous is None:
+            # Nothing to compare the first collection against
+            return
+
+        for key, (project_name, size) in inventory.items():
+            labels = {"resource": resource, "project_name": project_name}
+            if key not in previous:
+                self._increment_counter(
+                    "openstack_resources_created",
+                    "Resources created between collections",
+                    labels,
+                )
+            elif previous[key][1] != size:
+                self._increment_counter(
+                    "openstack_resources_resized",
+                    "Resources resized between collections",
+                    labels,
+                )
+
+        for key, (project_name, _) in previous.items():
+            if key not in inventory:
+                self._increment_counter(
+                    "openstack_resources_deleted",
+                    "Resources deleted between collections",
+                    {"resource": resource, "project_name": project_name},
+                )
+
+    def _set_aggregated_gauges(self, gauge_name, gauge_desc, labelnames, totals):
+        """Replace all series of a gauge with totals keyed by label values.
+
+        Series of groups that no longer exist (e.g. a deleted project) are
+        dropped rather than left at their last value.
+        """
+        if not self.config["aggregated_gauges"].get(bool):
+            return
+
+        if gauge_name in self.gauge_dict:
+            self.gauge_dict[gauge_name].clear()
+
+        for labelvalues, value in totals.items():
+            self._create_or_update_gauge(
+                gauge_name,
+                gauge_desc,
+                labels=dict(zip(labelnames, labelvalues)),
+                value=value,
+            )
+
     def _get_network_stats(self):
         """Get network stats."""
         self._create_or_update_gauge(
@@ -338,9 +738,24 @@ class OpenstackStats:
         self._create_or_update_gauge(
             "cinder_total_volumes",
             "Total number of volumes in cinder",
-            value=len(self._volumes),
+            value=self._volume_summary["count"],
+        )
+        self._create_or_update_gauge(
+            "cinder_total_volume_size",
+            "Total size of volumes in cinder",
+            value=self._volume_summary["size"],
         )
 
+        if not self._list_objects:
+            return
+
+        per_object = self.config["per_object_gauges"].get(bool)
+        project_count = defaultdict(int)
+        project_size = defaultdict(int)
+        backend_count = defaultdict(int)
+        backend_size = defaultdict(int)
+        inventory = {}
+
         for volume in self._volumes:
             try:
                 labels = {
@@ -349,17 +764,99 @@ class OpenstackStats:
                     "domain_name": volume["location"]["project"]["domain_name"],
                     "project_name": self._get_object_project_name(volume),
                 }
-                self._create_or_update_gauge(
-                    "cinder_volume_size",
-                    "Size of volume in cinder",
-                    labels=labels,
-                    value=volume["size"],
-                )
+                if per_object:
+                    self._create_or_update_gauge(
+                        "cinder_volume_size",
+                        "Size of volume in cinder",
+                        labels=labels,
+                        value=volume["size"],
+                    )
             except KeyError as e:
                 self._log_and_count_key_errors("volume", volume, e)
+                continue
+
+            project = (labels["domain_name"], labels["project_name"])
+            project_count[project] += 1
+            project_size[project] += volume["size"] or 0
+            backend_count[(labels["volume_backend"],)] += 1
+            backend_size[(labels["volume_backend"],)] += volume["size"] or 0
+            inventory[self._hash_id(volume["id"])] = (
+                labels["project_name"],
+                volume["size"],
+            )
+
+        self._update_churn("volume", inventory)
+
+        project_labelnames = ("domain_name", "project_name")
+        self._set_aggregated_gauges(
+            "cinder_project_volumes",
+            "Number of volumes in cinder per project",
+            project_labelnames,
+            project_count,
+        )
+        self._set_aggregated_gauges(
+            "cinder_project_volume_size",
+            "Size of volumes in cinder per project",
+            project_labelnames,
+            project_size,
+        )
+        self._set_aggregated_gauges(
+            "cinder_backend_volumes",
+            "Number of volumes in cinder per backend",
+            ("volume_backend",),
+            backend_count,
+        )
+        self._set_aggregated_gauges(
+            "cinder_backend_volume_size",
+            "Size of volumes in cinder per backend",
+            ("volume_backend",),
+            backend_size,
+        )
+
+    def _get_nova_stats(self):
+        """Get nova totals from the hypervisor statistics."""
+        statistics = self._hypervisor_statistics
+        if not statistics:
+            return
+
+        try:
+            self._create_or_update_gauge(
+                "nova_total_hypervisors",
+                "Total number of hypervisors",
+                value=statistics["count"],
+            )
+            self._create_or_update_gauge(
+                "nova_total_running_vms",
+                "Total number of servers running on hypervisors",
+                value=statistics["running_vms"],
+            )
+        except KeyError as e:
+            self._log_and_count_key_errors("hypervisor statistics", statistics, e)
+
+    def _get_floating_ip_stats(self):
+        """Get floating IP stats."""
+        if not self.config["churn_counters"].get(bool):
+            return
+
+        inventory = {}
+        for floating_ip in self._floating_ip:
+            try:
+                inventory[self._hash_id(floating_ip["id"])] = (
+                    self._get_object_project_name(floating_ip),
+                    None,
+                )
+            except KeyError as e:
+                self._log_and_count_key_errors("floating ip", floating_ip, e)
+
+        self._update_churn("floating_ip", inventory)
 
     def _get_image_stats(self):
         """Get image stats."""
+        per_object = self.config["per_object_gauges"].get(bool)
+        project_count = defaultdict(int)
+        project_size = defaultdict(int)
+        inventory = {}
+
         for image in self._images:
             # bypass images in pending/upload/error state with no size
             if image["size"] is None:
@@ -371,34 +868,87 @@ class OpenstackStats:
                     "domain_name": image["location"]["project"]["domain_name"],
                     "project_name": self._get_object_project_name(image),
                 }
-                self._create_or_update_gauge(
-                    "glance_image_size",
-                    "Size of image in glance",
-                    labels=labels,
-                    value=image["size"],
-                )
+                if per_object:
+                    self._create_or_update_gauge(
+                        "glance_image_size",
+                        "Size of image in glance",
+                        labels=labels,
+                        value=image["size"],
+                    )
             except KeyError as e:
                 self._log_and_count_key_errors("image", image, e)
+                continue
+
+            project = (labels["domain_name"], labels["project_name"])
+            project_count[project] += 1
+            project_size[project] += image["size"]
+            inventory[self._hash_id(image["id"])] = (
+                labels["project_name"],
+                image["size"],
+            )
+
+        self._update_churn("image", inventory)
+
+        project_labelnames = ("domain_name", "project_name")
+        self._set_aggregated_gauges(
+            "glance_project_images",
+            "Number of images in glance per project",
+            project_labelnames,
+            project_count,
+        )
+        self._set_aggregated_gauges(
+            "glance_project_image_size",
+            "Size of images in glance per project",
+            project_labelnames,
+            project_size,
+        )
 
     def _get_object_stats(self):
         """Get object storage stats."""
-        for container in self._containers:
-            labels = {"container_name": container["name"]}
-            try:
-                self._create_or_update_gauge(
-                    "container_objects",
-                    "Number of objects in container",
-                    labels=labels,
-                    value=container["count"],
-                )
-                self._create_or_update_gauge(
-                    "container_bytes",
-                    "Size of objects in container",
-                    labels=labels,
-                    value=container["bytes"],
-                )
-            except KeyError as e:
-                self._log_and_count_key_errors("container", container, e)
+        for account in self._object_accounts:
+            labels = {
+                "project_id": account["project_id"],
+                "project_name": account["project_name"],
+            }
+            self._create_or_update_gauge(
+                "swift_account_containers",
+                "Number of containers in Swift account",
+                labels=labels,
+                value=account["containers"],
+            )
+            self._create_or_update_gauge(
+                "swift_account_objects",
+                "Number of objects in Swift account",
+                labels=labels,
+                value=account["objects"],
+            )
+            self._create_or_update_gauge(
+                "swift_account_bytes",
+                "Size of objects in Swift account",
+                labels=labels,
+                value=account["bytes"],
+            )
+
+            for container in account["container_list"]:
+                try:
+                    labels = {
+                        "container_name": container["name"],
+                        "project_name": account["project_name"],
+                    }
+                    self._create_or_update_gauge(
+                        "container_objects",
+                        "Number of objects in container",
+                        labels=labels,
+                        value=container["count"],
+                    )
+                    self._create_or_update_gauge(
+                        "container_bytes",
+                        "Size of objects in container",
+                        labels=labels,
+                        value=container["bytes"],
+                    )
+                except KeyError as e:
+                    self._log_and_count_key_errors("container", container, e)
 
     def _get_server_stats(self):
         """Get server stats."""
@@ -411,8 +961,16 @@ class OpenstackStats:
                     "Could not find disk size for server %s", server["id"]
                 )
                 self.keyerrorcount += 1
+                self.metrics.key_errors.labels("server").inc()
                 return 0
 
+        per_object = self.config["per_object_gauges"].get(bool)
+        project_count = defaultdict(int)
+        project_ephemeral = defaultdict(int)
+        hypervisor_count = defaultdict(int)
+        hypervisor_ephemeral = defaultdict(int)
+        inventory = {}
+
         for server in self._servers:
             try:
                 labels = {
@@ -421,14 +979,56 @@ class OpenstackStats:
                     "domain_name": server["location"]["project"]["domain_name"],
                     "project_name": self._get_object_project_name(server),
                 }
-                self._create_or_update_gauge(
-                    "server_ephemeral_size",
-                    "Size of local storage used by server based on flavor",
-                    labels=labels,
-                    value=calc_local_ephemeral(server),
-                )
+                ephemeral = calc_local_ephemeral(server)
+                if per_object:
+                    self._create_or_update_gauge(
+                        "server_ephemeral_size",
+                        "Size of local storage used by server based on flavor",
+                        labels=labels,
+                        value=ephemeral,
+                    )
             except KeyError as e:
                 self._log_and_count_key_errors("server", server, e)
+                continue
+
+            project = (labels["domain_name"], labels["project_name"])
+            project_count[project] += 1
+            project_ephemeral[project] += ephemeral
+            hypervisor_count[(labels["hypervisor_hostname"],)] += 1
+            hypervisor_ephemeral[(labels["hypervisor_hostname"],)] += ephemeral
+            flavor = server.get("flavor") or {}
+            inventory[self._hash_id(server["id"])] = (
+                labels["project_name"],
+                flavor.get("original_name") or flavor.get("id"),
+            )
+
+        self._update_churn("server", inventory)
+
+        project_labelnames = ("domain_name", "project_name")
+        self._set_aggregated_gauges(
+            "nova_project_servers",
+            "Number of servers per project",
+            project_labelnames,
+            project_count,
+        )
+        self._set_aggregated_gauges(
+            "nova_project_ephemeral_size",
+            "Size of local storage used by servers per project based on flavor",
+            project_labelnames,
+            project_ephemeral,
+        )
+        self._set_aggregated_gauges(
+            "hypervisor_servers",
+            "Number of servers per hypervisor",
+            ("hypervisor_hostname",),
+            hypervisor_count,
+        )
+        self._set_aggregated_gauges(
+            "hypervisor_ephemeral_size",
+            "Size of local storage used by servers per hypervisor based on flavor",
+            ("hypervisor_hostname",),
+            hypervisor_ephemeral,
+        )
 
     def _get_hypervisor_stats(self):
         """Get hypervisor stats."""
@@ -462,3 +1062,4 @@ class OpenstackStats:
             key_error,
         )
         self.keyerrorcount += 1
+        self.metrics.key_errors.labels(object_type).inc()
@@ -0,0 +1,145 @@
+"""Per-cycle profiling of the cloudstats daemons."""
+
+import cProfile
+import contextlib
+import glob
+import os
+import threading
+import time
+
+from cloudstats.logging import get_logger
+
+
+class Profiler:
+    """Time the stages of each cycle and optionally run cProfile over it.
+
+    Stage timings are written per cycle in the collapsed stack format
+    ("cycle;stage;substage microseconds" per line) read directly by flamegraph
+    viewers such as speedscope or flamegraph.pl. With cprofile enabled the
+    cProfile stats of the cycle are dumped next to it as a .prof file.
+    A disabled profiler does nothing.
+    """
+
+    def __init__(self, name, enabled=False, cprofile=False, directory=None, keep=100):
+        """Create a profiler writing its profiles to directory."""
+        self.logger = get_logger()
+        self.name = name
+        self.enabled = enabled or cprofile
+        self.cprofile = cprofile
+        self.directory = directory or os.path.join(
+            os.environ.get("CLOUDSTATSDIR", "."), "profiles"
+        )
+        self.keep = keep
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = [self.name]
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage of the cycle, stages can be nested."""
+        if not self.enabled:
+            yield
+            return
+
+        stack = self._stack()
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            key = ";".join(stack)
+            stack.pop()
+            with self._lock:
+                self.timings[key] = self.timings.get(key, 0) + elapsed
+
+    @contextlib.contextmanager
+    def cycle(self):
+        """Profile one cycle and write its profile when it ends."""
+        if not self.enabled:
+            yield
+            return
+
+        self.timings = {}
+        profile = cProfile.Profile() if self.cprofile else None
+        if profile:
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[self.name] = time.perf_counter() - start
+            if profile:
+                profile.disable()
+            self._write(profile)
+
+    def self_times(self):
+        """Return the time spent in each stack excluding its sub-stages."""
+        self_times = dict(self.timings)
+        for key, elapsed in self.timings.items():
+            parent = key.rpartition(";")[0]
+            if parent in self_times:
+                self_times[parent] -= elapsed
+        return self_times
+
+    def _write(self, profile):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            now = time.time()
+            base = os.path.join(
+                self.directory,
+                "{}-{}.{:03d}".format(
+                    self.name,
+                    time.strftime("%Y%m%dT%H%M%S", time.localtime(now)),
+                    int(now * 1000) % 1000,
+                ),
+            )
+            with open(base + ".folded", "w") as f:
+                for key, elapsed in sorted(self.self_times().items()):
+                    microseconds = int(elapsed * 1000000)
+                    if microseconds > 0:
+                        f.write("{} {}\n".format(key, microseconds))
+            if profile:
+                profile.dump_stats(base + ".prof")
+            self._prune()
+        except OSError as e:
+            self.logger.warning("Could not write profile: {}".format(e))
+            return
+
+        self.logger.info(
+            "Profiled {} cycle in {:.2f}s, written to {}.folded".format(
+                self.name, self.timings[self.name], base
+            )
+        )
+
+    def _prune(self):
+        """Remove the oldest profiles beyond the number to keep."""
+        for extension in ("folded", "prof"):
+            pattern = os.path.join(
+                self.directory, "{}-*.{}".format(self.name, extension)
+            )
+            for filename in sorted(glob.glob(pattern))[: -self.keep]:
+                os.remove(filename)
+
+
+def add_profile_arguments(parser):
+    """Add the options enabling the profiler of a daemon."""
+    parser.add_argument(
+        "--profile",
+        dest="profile.enabled",
+        action="store_true",
+        default=None,
+        help="Write the time spent in each stage of every cycle to $CLOUDSTATSDIR",
+    )
+    parser.add_argument(
+        "--cprofile",
+        dest="profile.cprofile",
+        action="store_true",
+        default=None,
+        help="Also write the cProfile stats of every cycle, implies --profile",
+    )
@@ -3,7 +3,9 @@
 from os.path import abspath, dirname, join
 
 from cloudstats.config import Config
+from cloudstats.localstats import LOCAL_STATS, SnapshotSamples, SnapshotSource
 from cloudstats.logging import get_logger
+from cloudstats.profiling import Profiler
 
 import requests
 
@@ -15,23 +17,42 @@ class PrometheusStats:
 
     DATASOURCE = "prometheus - Juju generated source"
 
-    def __init__(self, skip_collectors=[]):
-        """Create Prometheus query interface."""
+    def __init__(self, skip_collectors=[], profiler=None, config=None, session=None):
+        """Create Prometheus query interface.
+
+        config is the prometheus config section, by default the global one,
+        and session the requests Session to query with.
+        """
         self.logger = get_logger()
-        self.config = Config().get_config("prometheus")
+        self.profiler = profiler or Profiler("reporter")
+        self.config = (
+            config if config is not None else Config().get_config("prometheus")
+        )
+        self.session = session if session is not None else requests.Session()
         self.promurl = requests.compat.urljoin(
             self.config["url"].get(str), "/api/v1/query"
         )
         self.skip_collectors = skip_collectors
+        self.snapshot_source = self._setup_snapshot_source()
         self._read_prom_query_file()
         self.dashboard_panels = []
         self.logger.debug("Configured Prometheus query interface")
 
+    def _setup_snapshot_source(self):
+        """Return the SnapshotSource of the exporter in the snapshot source mode."""
+        if self.config["source"].as_choice(["promql", "snapshot"]) != "snapshot":
+            return None
+        return SnapshotSource(
+            self.config["snapshot_url"].get(str),
+            self.config["snapshot_max_age"].as_number() * 60,
+            session=self.session,
+        )
+
     def _query_prometheus(self, query):
         """Query prometheus and catch and log errors."""
         self.logger.debug("Querying Prometheus: {}".format(query))
         try:
-            response = requests.get(self.promurl, params={"query": query})
+            response = self.session.get(self.promurl, params={"query": query})
         except requests.HTTPError as e:
             self.logger.error("Prometheus returned non-200 response: {}".format(e))
             return None
@@ -162,19 +183,39 @@ class PrometheusStats:
             return value
 
     def get_all_stats(self):
-        """Get all stats."""
+        """Get all stats.
+
+        In the snapshot source mode, the stats derived from OpenStack are
+        computed from the snapshot of the exporter and only the others are
+        queried, unless the snapshot isn't available.
+        """
+        local_stats = {}
+        samples = None
+        if self.snapshot_source is not None:
+            snapshot = self.snapshot_source.fetch()
+            if snapshot is not None:
+                local_stats = LOCAL_STATS
+                samples = SnapshotSamples(snapshot)
+            else:
+                self.logger.warning("Querying Prometheus for all stats.")
+
         stats = {}
         for collector in self.stats_queries.keys():
             if collector in self.skip_collectors:
                 continue
-            for stat in self.stats_queries[collector].keys():
-                result = self._get_stat(collector, stat)
-                if result is None:
-                    self.logger.debug(
-                        "Skipping stat {}, no results retrieved.".format(stat)
-                    )
-                else:
-                    stats[stat] = result
+            with self.profiler.stage(collector):
+                for stat in self.stats_queries[collector].keys():
+                    local_stat = local_stats.get(collector, {}).get(stat)
+                    if local_stat is not None:
+                        result = local_stat(samples)
+                    else:
+                        result = self._get_stat(collector, stat)
+                    if result is None:
+                        self.logger.debug(
+                            "Skipping stat {}, no results retrieved.".format(stat)
+                        )
+                    else:
+                        stats[stat] = result
 
         return stats
 
@@ -1,12 +1,337 @@
 """Main entrypoint for the cloudstats reporter daemon."""
+
 import argparse
+import os
 import sys
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-from cloudstats.api import RestClient
+from cloudstats.api import (
+    ApiError,
+    AuthenticationError,
+    RestClient,
+    UpdateFailed,
+    pooled_adapter,
+)
 from cloudstats.config import Config
 from cloudstats.logging import get_logger
+from cloudstats.profiling import Profiler, add_profile_arguments
 from cloudstats.prometheus import PrometheusStats
+from cloudstats.scheduler import Scheduler
+from cloudstats.spool import Backoff, Spool
+from cloudstats.storage import DAILY, HOURLY, RAW, Storage
+
+import requests
+
+# Errors after which a report is spooled to be uploaded later
+UPLOAD_ERRORS = (ApiError, requests.exceptions.RequestException)
+
+
+def rejected(error):
+    """Return whether error is the API rejecting a report for good.
+
+    Such a report is dropped rather than spooled, as retrying it would only
+    hold back the reports behind it.
+    """
+    return isinstance(error, UpdateFailed) and not error.retryable
+
+
+class CloudReporter:
+    """Collect and upload the stats of one cloud.
+
+    Each cloud has its own Prometheus, API client, tokens, spool and backoff,
+    so the failures of one don't affect the others.
+    """
+
+    def __init__(self, name, config, storage, profiler, adapter=None, token_key=""):
+        """Create the reporter of a cloud from its config.
+
+        token_key is the key of the tokens of the cloud in the storage.
+        """
+        self.name = name
+        self.config = config
+        self.storage = storage
+        self.profiler = profiler
+        self.adapter = adapter
+        self.token_key = token_key
+        self.logger = get_logger()
+        self.spool = self.setup_spool()
+        self.backoff = self.setup_backoff()
+        self.prometheus = self.setup_prometheus()
+        self.rest_client = None
+        self._rest_client_config = None
+        # Set by the daemon, which drains the spool between its cycles
+        self.drain_between_cycles = False
+        self._drain_timer = None
+        # Serializes the uploads of the cycles and of the scheduled drains
+        self._lock = threading.RLock()
+
+    def setup_session(self):
+        """Return a requests Session using the shared connection pool."""
+        session = requests.Session()
+        if self.adapter is not None:
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+        return session
+
+    def setup_prometheus(self):
+        """Return an instance of the PrometheusStats."""
+        return PrometheusStats(
+            profiler=self.profiler,
+            config=self.config["prometheus"],
+            session=self.setup_session(),
+        )
+
+    def setup_rest_client(self):
+        """Return an instance of the RestClient."""
+        return RestClient(
+            config=self.config["api"],
+            cloud=self.token_key,
+            storage=self.storage,
+            adapter=self.adapter,
+        )
+
+    def setup_spool(self):
+        """Return the Spool of the reports that failed to upload."""
+        directory = None
+        if self.name:
+            directory = os.path.join(
+                os.environ.get("CLOUDSTATSDIR", "."), "spool", self.name
+            )
+        return Spool(
+            directory, max_reports=self.config["api"]["spool_max_reports"].get(int)
+        )
+
+    def setup_backoff(self):
+        """Return the Backoff between upload attempts."""
+        api = self.config["api"]
+        return Backoff(
+            api["retry_backoff"].as_number(), api["retry_backoff_max"].as_number()
+        )
+
+    def get_rest_client(self):
+        """Return the RestClient, rebuilt only when the api config changed."""
+        api_config = self.config["api"].flatten()
+        if self.rest_client is None or api_config != self._rest_client_config:
+            if self.rest_client is not None:
+                self.logger.info("API configuration changed, reconnecting.")
+                self.rest_client.close()
+            self.rest_client = self.setup_rest_client()
+            self._rest_client_config = api_config
+        return self.rest_client
+
+    def collect_prometheus_data(self):
+        """Get stats from prometheus."""
+        stats = self.prometheus.get_all_stats()
+
+        return stats
+
+    def changed_stats(self, data):
+        """Return the stats to send and whether they are the whole report.
+
+        The whole report is sent when delta uploads are disabled, nothing was
+        acknowledged yet or the last full sync is older than the interval.
+        """
+        api = self.config["api"]
+        if not api["delta_uploads"].get(bool):
+            return data, True
+
+        last, synced = self.storage.get_report(api["cloud_uuid"].get(str))
+        full_sync = timedelta(minutes=api["full_sync_interval"].as_number())
+        if last is None or synced is None or datetime.utcnow() - synced > full_sync:
+            return data, True
+
+        changed = {key: value for key, value in data.items() if last.get(key) != value}
+        return changed, False
+
+    def upload_data(self, data):
+        """Upload collected data to api."""
+        rest_client = self.get_rest_client()
+        cloud = self.config["api"]["cloud_uuid"].get(str)
+        payload, full = self.changed_stats(data)
+        if not payload:
+            self.logger.debug("No stats changed since the last upload.")
+            return
+
+        self.logger.debug("Uploading data: {}".format(payload))
+        try:
+            response = rest_client.update_cloud_info(cloud, payload)
+        except UpdateFailed as e:
+            # Only a rejection, e.g. of a stale base, is worth a full upload,
+            # the spool and backoff handle an API that is down
+            if full or e.retryable:
+                raise
+            self.logger.warning("Partial update rejected, sending all stats.")
+            full = True
+            response = rest_client.update_cloud_info(cloud, data)
+        self.storage.store_report(cloud, data, full=full)
+        self.logger.debug("Upload Response: {}".format(response))
+
+    def upload_failed(self, error):
+        """Log a failed upload and back off."""
+        if isinstance(error, AuthenticationError):
+            # Start over from the stored and configured tokens next time
+            if self.rest_client is not None:
+                self.rest_client.close()
+            self.rest_client = None
+        retry = self.backoff.failure()
+        self.logger.error(
+            "Upload of {} failed ({}), {} report(s) spooled, "
+            "next attempt in {:.0f}s".format(
+                self.name or "the cloud",
+                error,
+                len(self.spool),
+                retry - self.backoff.clock(),
+            )
+        )
+        self.schedule_drain()
+
+    def schedule_drain(self):
+        """Drain the spool once the backoff passed, without waiting for a cycle."""
+        if not self.drain_between_cycles or len(self.spool) == 0:
+            return
+        if self._drain_timer is not None:
+            self._drain_timer.cancel()
+        delay = max(self.backoff.next_attempt - self.backoff.clock(), 0)
+        self._drain_timer = threading.Timer(delay, self._scheduled_drain)
+        self._drain_timer.daemon = True
+        self._drain_timer.start()
+
+    def _scheduled_drain(self):
+        with self._lock:
+            try:
+                if len(self.spool) > 0:
+                    self.drain_spool()
+            except Exception:
+                self.logger.exception(
+                    "Draining the spool of {} failed".format(self.name or "the cloud")
+                )
+
+    def report(self, data):
+        """Upload a report, or spool it behind the ones waiting for upload.
+
+        Return whether the report was uploaded.
+        """
+        with self._lock:
+            return self._report(data)
+
+    def _report(self, data):
+        cloud = self.config["api"]["cloud_uuid"].get(str)
+        if len(self.spool) == 0:
+            try:
+                self.upload_data(data)
+                self.backoff.success()
+            except UPLOAD_ERRORS as e:
+                if rejected(e):
+                    self.logger.warning(
+                        "API rejected the report of {}, dropping it: {}".format(
+                            self.name or "the cloud", e
+                        )
+                    )
+                    self.backoff.success()
+                    return False
+                self.spool.put(cloud, data)
+                self.upload_failed(e)
+                return False
+            return True
+
+        self.spool.put(cloud, data)
+        self.drain_spool()
+        return len(self.spool) == 0
+
+    def upload_spooled(self, name):
+        """Upload a spooled report whole and remove it from the spool."""
+        try:
+            cloud, data = self.spool.get(name)
+        except (ValueError, KeyError) as e:
+            self.logger.warning(
+                "Dropping corrupt spooled report {}: {}".format(name, e)
+            )
+            self.spool.remove(name)
+            return None, None
+        try:
+            self.get_rest_client().update_cloud_info(cloud, data)
+        except UpdateFailed as e:
+            if not rejected(e):
+                raise
+            self.logger.warning(
+                "API rejected spooled report {}, dropping it: {}".format(name, e)
+            )
+            self.spool.remove(name)
+            return None, None
+        self.spool.remove(name)
+        return cloud, data
+
+    def drain_spool(self):
+        """Upload a batch of the oldest spooled reports once the backoff passed.
+
+        The oldest report goes first on its own to check the API is back, the
+        rest of the batch concurrently, and the newest report of the spool
+        last so it is the one the API ends up with.
+        """
+        if not self.backoff.ready():
+            self.logger.info(
+                "{} report(s) spooled, waiting for the backoff.".format(len(self.spool))
+            )
+            return
+
+        api = self.config["api"]
+        names = self.spool.names()
+        batch = names[: api["spool_batch_size"].get(int)]
+        newest = names[-1] if batch[-1] == names[-1] else None
+        concurrent = [name for name in batch[1:] if name != newest]
+        try:
+            last = self.upload_spooled(batch[0])
+            with ThreadPoolExecutor(api["spool_concurrency"].get(int)) as executor:
+                for _ in executor.map(self.upload_spooled, concurrent):
+                    pass
+            if newest is not None and newest != batch[0]:
+                last = self.upload_spooled(newest)
+        except UPLOAD_ERRORS as e:
+            self.upload_failed(e)
+            return
+
+        if newest is not None and last[0] is not None:
+            self.storage.store_report(*last, full=True)
+        self.backoff.success()
+        self.logger.info(
+            "Uploaded {} spooled report(s), {} left.".format(
+                len(batch), len(self.spool)
+            )
+        )
+        self.schedule_drain()
+
+    def record_history(self, data):
+        """Add a report to the local stats history and downsample it."""
+        history = self.config["history"]
+        # Retentions are in days, DAILY seconds each
+        with self.storage.transaction():
+            self.storage.store_stats(self.config["api"]["cloud_uuid"].get(str), data)
+            self.storage.downsample_history(
+                {
+                    RAW: history["raw_retention"].as_number() * DAILY,
+                    HOURLY: history["hourly_retention"].as_number() * DAILY,
+                    DAILY: history["daily_retention"].as_number() * DAILY,
+                }
+            )
+
+    def trigger(self):
+        """Collect the stats of the cloud and upload them.
+
+        Return whether the stats were uploaded.
+        """
+        with self.profiler.stage("collect"):
+            data = self.collect_prometheus_data()
+        self.logger.debug("Collected stats from Prometheus: {}".format(data))
+        if self.config["history"]["enabled"].get(bool):
+            with self.profiler.stage("history"):
+                self.record_history(data)
+        if self.config["api"]["url"].get(str):
+            with self.profiler.stage("upload"):
+                return self.report(data)
+        self.logger.warning("There is no API URL defined.  Exiting.")
+        return False
 
 
 class StatsReporterDaemon:
@@ -14,10 +339,12 @@ class StatsReporterDaemon:
 
     def __init__(self, args):
         """Create new daemon and configure runtime environment."""
-        # be careful, this will change logger level
-        self.prometheus = self.setup_prometheus()
         args = self.parse_args(args)
         self.config = self.parse_config(args)
+        self.profiler = self.setup_profiler()
+        self.storage = Storage()
+        # be careful, this will change logger level
+        self.clouds = self.setup_clouds()
         self.logger = self.setup_logging()
         self.logger.debug("Parsed config: {}".format(self.config.config_dir()))
 
@@ -25,13 +352,44 @@ class StatsReporterDaemon:
         """Return the correct Logging instance based on debug option."""
         return get_logger(debug=self.config["debug"].get(bool))
 
-    def setup_prometheus(self):
-        """Return an instance of the PrometheusStats."""
-        return PrometheusStats()
+    def setup_profiler(self):
+        """Return the Profiler timing each report."""
+        return Profiler(
+            "reporter",
+            enabled=self.config["profile"]["enabled"].get(bool),
+            cprofile=self.config["profile"]["cprofile"].get(bool),
+        )
 
-    def setup_rest_client(self):
-        """Return an instance of the RestClient."""
-        return RestClient()
+    def setup_clouds(self):
+        """Return the CloudReporter of each configured cloud.
+
+        Without a clouds list the api and prometheus sections describe the
+        only cloud, whose tokens are stored unkeyed as before.
+        """
+        clouds = self.config["clouds"].get(list)
+        concurrency = self.config["cloud_concurrency"].get(int)
+        adapter = pooled_adapter(hosts=len(clouds) + 1, maxsize=concurrency)
+        if not clouds:
+            return [
+                CloudReporter("", self.config, self.storage, self.profiler, adapter)
+            ]
+
+        config = Config()
+        reporters = []
+        for cloud in clouds:
+            cloud_config = config.cloud_config(cloud)
+            uuid = cloud_config["api"]["cloud_uuid"].get(str)
+            reporters.append(
+                CloudReporter(
+                    cloud.get("name") or uuid,
+                    cloud_config,
+                    self.storage,
+                    self.profiler,
+                    adapter,
+                    token_key=uuid,
+                )
+            )
+        return reporters
 
     def parse_args(self, args):
         """Parse program arguments."""
@@ -44,10 +402,11 @@ class StatsReporterDaemon:
         parser.add_argument(
             "-i",
             "--interval",
-            type=int,
+            type=float,
             dest="exporter.collect_interval",
             help="How long to wait, in minutes, between syncronisations",
         )
+        add_profile_arguments(parser)
 
         return parser.parse_args(args)
 
@@ -55,35 +414,75 @@ class StatsReporterDaemon:
         """Parse configuration file."""
         return Config(args).get_config()
 
-    def collect_prometheus_data(self):
-        """Get stats from prometheus."""
-        stats = self.prometheus.get_all_stats()
+    def report_cloud(self, cloud):
+        """Report a cloud, logging its failures instead of raising them.
 
-        return stats
-
-    def upload_data(self, data):
-        """Upload collected data to api."""
-        self.rest_client = self.setup_rest_client()
-        self.logger.debug("Uploading data: {}".format(data))
-        response = self.rest_client.update_cloud_info(
-            self.config["api"]["cloud_uuid"], data
-        )
-        self.logger.debug("Upload Response: {}".format(response))
+        Return whether its stats were uploaded.
+        """
+        try:
+            if len(self.clouds) > 1:
+                with self.profiler.stage(cloud.name):
+                    return cloud.trigger()
+            return cloud.trigger()
+        except Exception:
+            self.logger.exception(
+                "Reporting {} failed".format(cloud.name or "the cloud")
+            )
+            return False
 
     def trigger(self):
-        """collect data from prometheus and send to api."""
+        """collect data from prometheus and send to api.
+
+        Return whether the stats of every cloud were uploaded.
+        """
         self.logger.debug("Running reporter")
-        data = self.collect_prometheus_data()
-        self.logger.debug("Collected stats from Prometheus: {}".format(data))
-        if self.config["api"]["url"]:
-            self.upload_data(data)
-        else:
-            self.logger.warning("There is no API URL defined.  Exiting.")
+        with self.profiler.cycle():
+            concurrency = min(
+                len(self.clouds), self.config["cloud_concurrency"].get(int)
+            )
+            if concurrency > 1:
+                with ThreadPoolExecutor(concurrency) as executor:
+                    uploaded = list(executor.map(self.report_cloud, self.clouds))
+            else:
+                uploaded = [self.report_cloud(cloud) for cloud in self.clouds]
+        return all(uploaded)
+
+    def update_api(self):
+        """Report every cloud once, return whether all the stats were uploaded.
+
+        Nothing drains the spool once this returns, so the reports left in it
+        wait for a reporter daemon.
+        """
+        uploaded = self.trigger()
+        for cloud in self.clouds:
+            if len(cloud.spool) > 0:
+                self.logger.warning(
+                    "{} report(s) of {} left in {} until a reporter daemon "
+                    "uploads them.".format(
+                        len(cloud.spool),
+                        cloud.name or "the cloud",
+                        cloud.spool.directory,
+                    )
+                )
+        return uploaded
+
+    def setup_scheduler(self):
+        """Return the Scheduler running the reports.
+
+        The reporter serves no metrics, so its lag and skipped ticks are only
+        logged.
+        """
+        exporter = self.config["exporter"]
+        return Scheduler(
+            "reporter",
+            exporter["collect_interval"].as_number() * 60,
+            jitter=exporter["collect_jitter"].as_number(),
+        )
 
     def run(self):
-        while True:
-            self.trigger()
-            time.sleep(self.config["exporter"]["collect_interval"].get(int) * 60)
+        for cloud in self.clouds:
+            cloud.drain_between_cycles = True
+        self.setup_scheduler().run(self.trigger)
 
 
 def main():
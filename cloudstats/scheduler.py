@@ -0,0 +1,87 @@
+"""Drift-free periodic scheduler shared by the cloudstats daemons."""
+
+import math
+import random
+import socket
+import threading
+import time
+
+from cloudstats.logging import get_logger
+
+from prometheus_client import Counter, Gauge
+
+
+class Scheduler:
+    """Run a task on fixed wall-clock boundaries.
+
+    Ticks fall on multiples of the interval since the epoch, shifted by an
+    offset of up to jitter seconds that is fixed per host and daemon, so the
+    period doesn't drift by the duration of the task and a fleet restarted
+    together doesn't query its services in lockstep. A task overrunning the
+    next tick skips the ticks it missed instead of running back to back.
+    """
+
+    def __init__(self, name, interval, jitter=0, registry=None, clock=time.time):
+        """Create a scheduler ticking every interval seconds."""
+        self.logger = get_logger()
+        self.name = name
+        self.interval = interval
+        self.clock = clock
+        seed = "{}-{}".format(socket.gethostname(), name)
+        self.offset = random.Random(seed).uniform(0, min(jitter, interval))
+        self._stop = threading.Event()
+        self.lag = None
+        self.skipped = None
+        if registry is not None:
+            self.lag = Gauge(
+                "cloudstats_cycle_lag_seconds",
+                "Delay between the scheduled and actual start of the last cycle",
+                ["daemon"],
+                registry=registry,
+            ).labels(name)
+            self.skipped = Counter(
+                "cloudstats_cycles_skipped",
+                "Scheduled cycles skipped because the previous one overran",
+                ["daemon"],
+                registry=registry,
+            ).labels(name)
+
+    def next_tick(self, now):
+        """Return the first tick strictly after now."""
+        ticks = math.floor((now - self.offset) / self.interval) + 1
+        return ticks * self.interval + self.offset
+
+    def stop(self):
+        """Stop running after the current cycle."""
+        self._stop.set()
+
+    def wait(self, seconds):
+        """Sleep until the next tick, returning early when stopped."""
+        self._stop.wait(max(seconds, 0))
+
+    def run(self, task):
+        """Run task once now, then on every tick until stopped."""
+        scheduled = self.clock()
+        while not self._stop.is_set():
+            lag = self.clock() - scheduled
+            if self.lag is not None:
+                self.lag.set(lag)
+            self.logger.debug("{} cycle started {:.3f}s late".format(self.name, lag))
+
+            task()
+
+            now = self.clock()
+            following = self.next_tick(scheduled)
+            if now > following:
+                missed = math.floor((now - following) / self.interval) + 1
+                self.logger.warning(
+                    "{} cycle overran by {:.1f}s, skipping {} tick(s)".format(
+                        self.name, now - following, missed
+                    )
+                )
+                if self.skipped is not None:
+                    self.skipped.inc(missed)
+                following = self.next_tick(now)
+
+            scheduled = following
+            self.wait(scheduled - self.clock())
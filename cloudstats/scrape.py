@@ -0,0 +1,64 @@
+"""Scrape-triggered collection for the cloudstats exporter."""
+
+import threading
+import time
+
+from cloudstats.logging import get_logger
+
+
+class OnDemandCollector:
+    """Run a collection when scraped data is older than a minimum age.
+
+    Concurrent scrapes, e.g. from an HA Prometheus pair, wait for the same
+    in-flight collection instead of starting their own. A scrape waits at
+    most deadline seconds for it, after which the previous data is served
+    while the collection carries on in the background.
+    """
+
+    def __init__(self, collect, min_age, deadline):
+        """Create a collector calling collect at most every min_age seconds."""
+        self.logger = get_logger()
+        self._collect = collect
+        self.min_age = min_age
+        self.deadline = deadline
+        self.last_collection = None
+        self._in_flight = None
+        self._lock = threading.Lock()
+
+    @property
+    def age(self):
+        """Return the seconds since the last collection ended."""
+        if self.last_collection is None:
+            return float("inf")
+        return time.monotonic() - self.last_collection
+
+    def refresh(self):
+        """Bring the data up to date for a scrape.
+
+        Returns True if the data is no older than min_age, False if the
+        deadline passed first.
+        """
+        with self._lock:
+            if self.age < self.min_age:
+                return True
+            if self._in_flight is None:
+                self._in_flight = threading.Event()
+                thread = threading.Thread(
+                    target=self._run, args=(self._in_flight,), daemon=True
+                )
+                thread.start()
+            in_flight = self._in_flight
+
+        return in_flight.wait(self.deadline)
+
+    def _run(self, done):
+        try:
+            self._collect()
+        except Exception:
+            # The next scrape retries once min_age has passed
+            self.logger.exception("Scrape-triggered collection failed")
+        finally:
+            with self._lock:
+                self.last_collection = time.monotonic()
+                self._in_flight = None
+            done.set()
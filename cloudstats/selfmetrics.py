@@ -0,0 +1,117 @@
+"""Operational metrics of the cloudstats exporter itself."""
+import contextlib
+import re
+import time
+from urllib.parse import urlparse
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Path segments identifying a single object (uuids, hex ids, Swift accounts,
+# numeric ids), replaced so the endpoint label has a bounded cardinality
+ID_SEGMENT = re.compile(r"^(AUTH_)?([0-9a-fA-F-]{16,}|[0-9]+)$")
+
+COLLECTOR_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+REQUEST_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def endpoint_label(url):
+    """Return the path of a request with the object ids replaced by {id}."""
+    segments = urlparse(url).path.split("/")
+    return "/".join(
+        "{id}" if ID_SEGMENT.match(segment) else segment for segment in segments
+    )
+
+
+class CollectionMetrics:
+    """Durations, API requests and errors of the OpenStack collection."""
+
+    def __init__(self, registry):
+        """Create the metrics in registry."""
+        self.collector_duration = Histogram(
+            "cloudstats_collector_duration_seconds",
+            "Time taken by each collector to update its gauges",
+            ["collector"],
+            buckets=COLLECTOR_BUCKETS,
+            registry=registry,
+        )
+        self.collector_last_success = Gauge(
+            "cloudstats_collector_last_success_timestamp_seconds",
+            "Time each collector last completed without an exception",
+            ["collector"],
+            registry=registry,
+        )
+        self.collector_failures = Counter(
+            "cloudstats_collector_failures",
+            "Collections each collector failed with an exception",
+            ["collector"],
+            registry=registry,
+        )
+        self.request_duration = Histogram(
+            "cloudstats_openstack_request_duration_seconds",
+            "Latency of the OpenStack API requests by service and endpoint",
+            ["service", "endpoint"],
+            buckets=REQUEST_BUCKETS,
+            registry=registry,
+        )
+        self.requests = Counter(
+            "cloudstats_openstack_requests",
+            "OpenStack API requests by service, endpoint and status code",
+            ["service", "endpoint", "status"],
+            registry=registry,
+        )
+        self.objects_processed = Counter(
+            "cloudstats_objects_processed",
+            "OpenStack objects listed, by resource type",
+            ["resource"],
+            registry=registry,
+        )
+        self.key_errors = Counter(
+            "cloudstats_key_errors",
+            "Objects skipped because of missing keys, by resource type",
+            ["resource"],
+            registry=registry,
+        )
+
+    @contextlib.contextmanager
+    def collector(self, name):
+        """Time a collector and record whether it succeeded."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.collector_failures.labels(name).inc()
+            raise
+        else:
+            self.collector_last_success.labels(name).set_to_current_time()
+        finally:
+            self.collector_duration.labels(name).observe(time.perf_counter() - start)
+
+    def instrument_session(self, session):
+        """Count and time every request sent through a keystoneauth Session.
+
+        Both openstacksdk proxies and keystoneauth itself go through
+        Session.request, which is replaced on this instance only.
+        """
+        request = session.request
+        metrics = self
+
+        def timed_request(url, method, **kwargs):
+            service = (kwargs.get("endpoint_filter") or {}).get("service_type")
+            labels = (service or "identity", endpoint_label(url))
+            status = "error"
+            start = time.perf_counter()
+            try:
+                response = request(url, method, **kwargs)
+                status = str(response.status_code)
+                return response
+            except Exception as e:
+                response = getattr(e, "response", None)
+                status = str(getattr(response, "status_code", None) or "error")
+                raise
+            finally:
+                metrics.request_duration.labels(*labels).observe(
+                    time.perf_counter() - start
+                )
+                metrics.requests.labels(*labels, status).inc()
+
+        session.request = timed_request
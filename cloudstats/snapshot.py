@@ -0,0 +1,118 @@
+"""Snapshots of the metrics collected by the exporter."""
+
+import json
+import os
+import time
+import zlib
+
+
+class SnapshotError(Exception):
+    """Raised if a snapshot can't be read."""
+
+    pass
+
+
+class Snapshot:
+    """A point-in-time copy of the gauges exported by OpenstackStats.
+
+    Metrics are stored as a dict of metric name to its documentation, label
+    names and samples, where each sample is a list of the label values
+    followed by the value. Snapshots of a whole registry instead store the
+    type of each metric family and samples of [sample name, labels, value],
+    so counters and histograms can be carried too.
+    """
+
+    MAGIC = b"CSS1"
+
+    def __init__(self, metrics, timestamp=None):
+        """Create a snapshot from metrics data."""
+        self.metrics = metrics
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    @classmethod
+    def from_gauges(cls, gauge_dict):
+        """Create a snapshot of the current values of a dict of Gauges."""
+        metrics = {}
+        for name, gauge in gauge_dict.items():
+            for metric in gauge.collect():
+                labelnames = []
+                samples = []
+                for sample in metric.samples:
+                    labelnames = list(sample.labels.keys())
+                    samples.append(list(sample.labels.values()) + [sample.value])
+                metrics[name] = {
+                    "documentation": metric.documentation,
+                    "labelnames": labelnames,
+                    "samples": samples,
+                }
+
+        return cls(metrics)
+
+    @classmethod
+    def from_registry(cls, registry):
+        """Create a snapshot of every metric family of a registry."""
+        metrics = {}
+        for metric in registry.collect():
+            metrics[metric.name] = {
+                "documentation": metric.documentation,
+                "type": metric.type,
+                "samples": [
+                    [sample.name, sample.labels, sample.value]
+                    for sample in metric.samples
+                ],
+            }
+
+        return cls(metrics)
+
+    def samples(self, name):
+        """Return the (labels, value) samples of a metric, in either layout."""
+        metric = self.metrics.get(name)
+        if metric is None:
+            return []
+        if "labelnames" in metric:
+            return [
+                (dict(zip(metric["labelnames"], sample[:-1])), sample[-1])
+                for sample in metric["samples"]
+            ]
+        return [
+            (labels, value)
+            for sample_name, labels, value in metric["samples"]
+            if sample_name == name
+        ]
+
+    @property
+    def age(self):
+        """Seconds since the snapshot was taken."""
+        return time.time() - self.timestamp
+
+    def dumps(self):
+        """Return the snapshot as compressed bytes."""
+        data = {"timestamp": self.timestamp, "metrics": self.metrics}
+        encoded = json.dumps(data, separators=(",", ":")).encode("utf8")
+        return self.MAGIC + zlib.compress(encoded)
+
+    @classmethod
+    def loads(cls, data):
+        """Return a snapshot from bytes created by dumps."""
+        if not data.startswith(cls.MAGIC):
+            raise SnapshotError("Not a cloudstats snapshot.")
+
+        offset = len(cls.MAGIC)
+        try:
+            decoded = json.loads(zlib.decompress(data[offset:]))
+            return cls(decoded["metrics"], timestamp=decoded["timestamp"])
+        except (zlib.error, ValueError, KeyError) as e:
+            raise SnapshotError("Corrupt snapshot: {}".format(e))
+
+    def save(self, filename):
+        """Atomically write the snapshot to a file."""
+        tmp_filename = "{}.tmp".format(filename)
+        with open(tmp_filename, "wb") as f:
+            f.write(self.dumps())
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a snapshot from a file."""
+        with open(filename, "rb") as f:
+            return cls.loads(f.read())
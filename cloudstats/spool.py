@@ -0,0 +1,104 @@
+"""Durable spool of the reports the reporter failed to upload."""
+
+import json
+import os
+import random
+import time
+
+from cloudstats.logging import get_logger
+
+
+class Spool:
+    """Reports waiting for upload, one JSON file each in a directory.
+
+    Files are named after the time the report was spooled so listing the
+    directory returns them oldest first, and written atomically so a crash
+    never leaves a partial report behind. The spool is bounded, the oldest
+    reports are dropped once it holds max_reports.
+    """
+
+    SUFFIX = ".json"
+
+    def __init__(self, directory=None, max_reports=1000):
+        """Create a spool in directory, by default $CLOUDSTATSDIR/spool."""
+        self.logger = get_logger()
+        if directory is None:
+            directory = os.path.join(os.environ.get("CLOUDSTATSDIR", "."), "spool")
+        self.directory = directory
+        self.max_reports = max_reports
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self.names())
+
+    def names(self):
+        """Return the names of the spooled reports, oldest first."""
+        try:
+            filenames = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in filenames if name.endswith(self.SUFFIX))
+
+    def put(self, cloud, data):
+        """Spool the report of a cloud."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = "{:.6f}-{:06d}{}".format(time.time(), self._sequence, self.SUFFIX)
+        filename = os.path.join(self.directory, name)
+        tmp_filename = "{}.tmp".format(filename)
+        with open(tmp_filename, "w") as f:
+            json.dump({"cloud": cloud, "data": data}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+
+        names = self.names()
+        for dropped in names[: max(len(names) - self.max_reports, 0)]:
+            self.logger.warning("Spool full, dropping report {}".format(dropped))
+            self.remove(dropped)
+
+    def get(self, name):
+        """Return the cloud and data of a spooled report."""
+        with open(os.path.join(self.directory, name)) as f:
+            report = json.load(f)
+        return report["cloud"], report["data"]
+
+    def remove(self, name):
+        """Remove a report, once uploaded."""
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class Backoff:
+    """Exponential backoff with jitter between upload attempts.
+
+    After n consecutive failures the next attempt waits between half and
+    all of min(base * 2 ** (n - 1), maximum) seconds, so reporters that
+    failed together don't retry together.
+    """
+
+    def __init__(self, base, maximum, clock=time.time):
+        """Create a backoff allowing the first attempt immediately."""
+        self.base = base
+        self.maximum = maximum
+        self.clock = clock
+        self.failures = 0
+        self.next_attempt = 0
+
+    def ready(self):
+        """Return whether the backoff delay passed."""
+        return self.clock() >= self.next_attempt
+
+    def failure(self):
+        """Record a failed attempt and schedule the next one."""
+        self.failures += 1
+        delay = min(self.base * 2 ** (self.failures - 1), self.maximum)
+        self.next_attempt = self.clock() + delay / 2 + random.uniform(0, delay / 2)
+        return self.next_attempt
+
+    def success(self):
+        """Record a successful attempt."""
+        self.failures = 0
+        self.next_attempt = 0
@@ -1,9 +1,30 @@
 """Cloudstats Persistant Storage."""
+
+import contextlib
+import json
 import os
 import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
 
 import cloudstats.api
 
+# Resolutions of the stats history in seconds, 0 for the reported samples
+RAW = 0
+HOURLY = 3600
+DAILY = 86400
+
+# Each resolution is rolled up from the finer one as its buckets complete
+ROLLUPS = ((RAW, HOURLY), (HOURLY, DAILY))
+
+# Newest tokens kept per type and cloud, only the newest one is used
+TOKEN_RETENTION = {"access": 2, "refresh": 10}
+
+# Seconds a statement waits for another process to release the database
+BUSY_TIMEOUT = 30
+
 
 class StorageError(Exception):
     """Base class for storage errors."""
@@ -17,63 +38,324 @@ class TokenError(StorageError):
     pass
 
 
+def _migrate_tables(db):
+    """Create the tables, or complete those of releases before versioning."""
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS tokens (type TEXT, encoded TEXT, "
+        "expires TIMESTAMP, cloud TEXT DEFAULT '')"
+    )
+    if "cloud" not in [column[1] for column in db.execute("PRAGMA table_info(tokens)")]:
+        # Tokens stored before they were keyed per cloud
+        db.execute("ALTER TABLE tokens ADD COLUMN cloud TEXT DEFAULT ''")
+
+    # Last report acknowledged by the API, per cloud
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS reports (cloud TEXT PRIMARY KEY, report TEXT, "
+        "synced TIMESTAMP)"
+    )
+
+    # Stats history, samples keyed by the integer id of their stat and
+    # clustered by resolution, stat and time
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY, cloud TEXT, "
+        "name TEXT, UNIQUE (cloud, name))"
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS history (resolution INTEGER, stat INTEGER, "
+        "time INTEGER, count INTEGER, sum REAL, min REAL, max REAL, "
+        "PRIMARY KEY (resolution, stat, time)) WITHOUT ROWID"
+    )
+    # Time up to which each resolution was rolled up
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS rollups (resolution INTEGER PRIMARY KEY, "
+        "until INTEGER)"
+    )
+
+
+def _migrate_token_index(db):
+    """Index the tokens by type and cloud, for lookups and pruning."""
+    db.execute("CREATE INDEX IF NOT EXISTS tokens_type_cloud ON tokens (type, cloud)")
+
+
+# Schema migrations, the schema version is the number of those applied
+MIGRATIONS = [_migrate_tables, _migrate_token_index]
+
+
 class Storage:
-    """Storage for cloudstats."""
+    """Storage for cloudstats.
+
+    The database is shared by the exporter, the reporter and the CLI, so it
+    is kept in WAL mode where readers don't block the writer. Each thread
+    has its own connection, except for in-memory databases which only exist
+    in the connection that created them. Writes take the write lock up front
+    and wait up to BUSY_TIMEOUT seconds for other processes to release it.
+    """
 
     def __init__(self, filename=None):
         if not filename:
             filename = os.environ.get("CLOUDSTATSDIR", ".") + "/state.db"
 
-        self._db = sqlite3.connect(str(filename), detect_types=sqlite3.PARSE_DECLTYPES)
+        self.filename = str(filename)
+        # Serializes the write transactions of this process, and every
+        # statement on a shared in-memory connection
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._connections = []
+        self._shared = None
+        if self.filename == ":memory:":
+            self._shared = self._open()
+        self._stat_ids = {}
         self._setup()
 
-    def _setup(self):
-        """Setup database"""
-        # Token table
-        c = self._db.execute(
-            "SELECT count(name) FROM sqlite_master WHERE type='table' AND name='tokens'"
+    def _open(self):
+        """Open a connection, closing those of the threads that exited."""
+        db = sqlite3.connect(
+            self.filename,
+            timeout=BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            # Transactions are begun explicitly by transaction()
+            isolation_level=None,
+            check_same_thread=False,
         )
+        if self.filename != ":memory:":
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
 
-        if c.fetchone()[0] == 0:
-            # No table yet
-            self._db.execute(
-                "CREATE TABLE tokens (type TEXT, encoded TEXT, expires TIMESTAMP)"
-            )
+        with self._lock:
+            for thread, connection in list(self._connections):
+                if not thread.is_alive():
+                    connection.close()
+                    self._connections.remove((thread, connection))
+            self._connections.append((threading.current_thread(), db))
+        return db
+
+    def _connect(self):
+        """Return the connection of this thread."""
+        if self._shared is not None:
+            return self._shared
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._open()
+        return db
+
+    def close(self):
+        """Close the connections of every thread."""
+        with self._lock:
+            for _, connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._local = threading.local()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the statements of the block in one write transaction.
+
+        Nested blocks join the outer transaction, so several writes can be
+        batched into one commit.
+        """
+        db = self._connect()
+        if getattr(self._local, "depth", 0):
+            self._local.depth += 1
+            try:
+                yield db
+            finally:
+                self._local.depth -= 1
+            return
+
+        with self._lock:
+            db.execute("BEGIN IMMEDIATE")
+            self._local.depth = 1
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                # Ids of the stats created by the transaction are gone
+                self._stat_ids = {}
+                raise
+            else:
+                db.execute("COMMIT")
+            finally:
+                self._local.depth = 0
+
+    def _select(self, sql, params=()):
+        """Return the rows of a query."""
+        if self._shared is not None:
+            with self._lock:
+                return self._shared.execute(sql, params).fetchall()
+        return self._connect().execute(sql, params).fetchall()
+
+    def _setup(self):
+        """Migrate the database to the current schema version."""
+        if self._select("PRAGMA user_version")[0][0] == len(MIGRATIONS):
+            return
 
-    def get_token(self, type):
-        """Return the most recent tokens of the given type."""
+        with self.transaction() as db:
+            # Checked again once locked, another process may have migrated
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version > len(MIGRATIONS):
+                raise StorageError(
+                    "{} has schema version {}, newer than the supported {}.".format(
+                        self.filename, version, len(MIGRATIONS)
+                    )
+                )
+            for migration in MIGRATIONS[version:]:
+                migration(db)
+            db.execute("PRAGMA user_version={:d}".format(len(MIGRATIONS)))
 
-        if type not in ("access", "refresh"):
+    def get_token(self, type, cloud=""):
+        """Return the most recent tokens of the given type for a cloud."""
+
+        if type not in TOKEN_RETENTION:
             raise TokenError("Unknown token type: {}".format(type))
 
-        c = self._db.execute(
-            "SELECT * FROM tokens WHERE type=? ORDER BY rowid DESC LIMIT 1",
-            [type],
+        rows = self._select(
+            "SELECT * FROM tokens WHERE type=? AND cloud=? ORDER BY rowid DESC LIMIT 1",
+            [type, cloud],
         )
-        row = c.fetchone()
         token = None
 
-        if row:
-            token = cloudstats.api.Token(row[1])
+        if rows:
+            token = cloudstats.api.Token(rows[0][1])
 
         return token
 
-    def store_token(self, token):
-        """Store token."""
+    def store_token(self, token, cloud=""):
+        """Store token of a cloud."""
 
         if not isinstance(token, cloudstats.api.Token):
             raise TokenError("Tokens must be of type Token.")
 
-        self._db.execute(
-            "INSERT into tokens VALUES (?,?,?)",
-            [token.type, token.encoded, token.expires],
-        )
-        # Keep only the newest 10 tokens of this type
-        self._db.execute(
-            (
-                "DELETE FROM tokens WHERE type=? AND rowid IN "
-                "(SELECT rowid FROM tokens ORDER BY rowid DESC LIMIT -1 OFFSET 10)"
-            ),
-            [token.type],
-        )
-        self._db.commit()
+        with self.transaction() as db:
+            db.execute(
+                "INSERT into tokens VALUES (?,?,?,?)",
+                [token.type, token.encoded, token.expires, cloud],
+            )
+            # Keep only the newest tokens of this type and cloud
+            db.execute(
+                (
+                    "DELETE FROM tokens WHERE type=? AND cloud=? AND rowid IN "
+                    "(SELECT rowid FROM tokens WHERE type=? AND cloud=? "
+                    "ORDER BY rowid DESC LIMIT -1 OFFSET ?)"
+                ),
+                [token.type, cloud, token.type, cloud, TOKEN_RETENTION[token.type]],
+            )
+
+    def get_report(self, cloud):
+        """Return the last report acknowledged for a cloud and its sync time.
+
+        Return (None, None) if no report of this cloud was stored yet.
+        """
+        rows = self._select("SELECT report, synced FROM reports WHERE cloud=?", [cloud])
+
+        if not rows:
+            return None, None
+
+        return json.loads(rows[0][0]), rows[0][1]
+
+    def store_report(self, cloud, report, full=False):
+        """Store the report acknowledged for a cloud.
+
+        The full sync time is only updated if the whole report was sent.
+        """
+        with self.transaction() as db:
+            synced = datetime.utcnow() if full else self.get_report(cloud)[1]
+            db.execute(
+                "INSERT OR REPLACE INTO reports VALUES (?,?,?)",
+                [cloud, json.dumps(report, sort_keys=True), synced],
+            )
+
+    def _stat_id(self, cloud, name, create=True):
+        """Return the id of a stat of a cloud in the history."""
+        key = (cloud, name)
+        if key not in self._stat_ids:
+            if create:
+                self._connect().execute(
+                    "INSERT OR IGNORE INTO stats (cloud, name) VALUES (?,?)",
+                    [cloud, name],
+                )
+            rows = self._select(
+                "SELECT id FROM stats WHERE cloud=? AND name=?", [cloud, name]
+            )
+            if not rows:
+                return None
+            self._stat_ids[key] = rows[0][0]
+        return self._stat_ids[key]
+
+    def store_stats(self, cloud, stats, at=None):
+        """Add the numeric stats of a report of a cloud to the history."""
+        at = int(time.time() if at is None else at)
+        with self.transaction() as db:
+            rows = [
+                (RAW, self._stat_id(cloud, name), at, 1, value, value, value)
+                for name, value in stats.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            ]
+            db.executemany(
+                "INSERT OR REPLACE INTO history VALUES (?,?,?,?,?,?,?)", rows
+            )
+
+    def downsample_history(self, retention, now=None):
+        """Roll the complete hours and days up and drop the expired samples.
+
+        retention maps each resolution to the seconds its samples are kept,
+        rounded down to whole days so the samples kept start on a bucket of
+        every coarser resolution.
+        """
+        now = int(time.time() if now is None else now)
+        with self.transaction() as db:
+            for source, target in ROLLUPS:
+                row = db.execute(
+                    "SELECT until FROM rollups WHERE resolution=?", [target]
+                ).fetchone()
+                since = row[0] if row else 0
+                until = now - now % target
+                if until <= since:
+                    continue
+                db.execute(
+                    "INSERT OR REPLACE INTO history "
+                    "SELECT ?, stat, time - time % ?, sum(count), sum(sum), min(min), "
+                    "max(max) FROM history "
+                    "WHERE resolution=? AND time>=? AND time<? "
+                    "GROUP BY stat, time - time % ?",
+                    [target, target, source, since, until, target],
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO rollups VALUES (?,?)", [target, until]
+                )
+
+            for resolution, seconds in retention.items():
+                cutoff = now - seconds
+                db.execute(
+                    "DELETE FROM history WHERE resolution=? AND time<?",
+                    [resolution, cutoff - cutoff % DAILY],
+                )
+
+    def get_stat_history(self, cloud, name, since, until=None):
+        """Return the samples of a stat of a cloud between two times, oldest first.
+
+        Each sample is a (time, resolution, count, mean, min, max) tuple. Every
+        period is covered by the finest resolution still kept for it.
+        """
+        stat = self._stat_id(cloud, name, create=False)
+        if stat is None:
+            return []
+
+        samples = []
+        end = sys.maxsize if until is None else int(until)
+        for resolution in (RAW, HOURLY, DAILY):
+            if resolution:
+                end -= end % resolution
+            rows = self._select(
+                "SELECT time, count, sum, min, max FROM history "
+                "WHERE resolution=? AND stat=? AND time>=? AND time<? "
+                "ORDER BY time",
+                [resolution, stat, since, end],
+            )
+            samples[:0] = [
+                (at, resolution, count, total / count, low, high)
+                for at, count, total, low, high in rows
+            ]
+            if rows:
+                end = rows[0][0]
+
+        return samples
@@ -0,0 +1,245 @@
+"""Collection sharded across supervised worker processes.
+
+Parsing the OpenStack listings and building the label sets is CPU bound, so a
+single exporter process is limited to one core by the GIL. Here each worker
+process runs a subset of the collectors with its own OpenstackStats and
+registry and answers every collection request with a compact snapshot of that
+registry. The parent merges the latest snapshot of every worker into the
+families it exports, and restarts workers that die or hang.
+"""
+
+import multiprocessing
+from collections import OrderedDict
+
+from cloudstats.config import Config
+from cloudstats.logging import get_logger
+from cloudstats.snapshot import Snapshot, SnapshotError
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.metrics_core import Metric
+
+# Collectors sharing listings are kept in the same worker
+SHARD_GROUPS = [
+    ["server", "hypervisor", "nova"],
+    ["volume", "image"],
+    ["network", "ipa", "router", "load_balancer", "floating_ip"],
+    ["object"],
+]
+
+# Types whose samples are summed when several workers export the same series
+SUMMED_TYPES = ("counter", "histogram", "summary")
+
+
+def shard_collectors(workers):
+    """Split the collector groups round-robin over a number of workers."""
+    shards = [[] for _ in range(max(1, min(workers, len(SHARD_GROUPS))))]
+    for index, group in enumerate(SHARD_GROUPS):
+        shards[index % len(shards)].extend(group)
+    return shards
+
+
+def worker_main(collectors, args, pipe):
+    """Collect on request and send back snapshots until told to stop."""
+    # Imported here so the worker builds its own connection after starting
+    from cloudstats.opensdk import OpenstackStats
+
+    Config(args)
+    registry = CollectorRegistry()
+    stats = OpenstackStats(registry=registry, collectors=collectors)
+    while True:
+        try:
+            command = pipe.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if command == "stop":
+            return
+
+        try:
+            stats.get_all_stats()
+        except Exception as e:
+            stats.logger.exception("Collection of {} failed".format(collectors))
+            pipe.send(("error", repr(e)))
+            continue
+        snapshot = Snapshot.from_registry(registry)
+        pipe.send(("snapshot", snapshot.dumps(), stats.cache_sizes()))
+
+
+class Worker:
+    """A supervised worker process running a shard of the collectors."""
+
+    def __init__(self, context, collectors, args):
+        """Create a worker for collectors, started by start."""
+        self.context = context
+        self.collectors = collectors
+        self.args = args
+        self.process = None
+        self.pipe = None
+        self.snapshot = None
+        self.cache_sizes = {}
+        self.restarts = 0
+
+    @property
+    def name(self):
+        return "+".join(self.collectors)
+
+    def start(self):
+        """Start the worker process."""
+        self.pipe, child_pipe = self.context.Pipe()
+        self.process = self.context.Process(
+            target=worker_main,
+            args=(self.collectors, self.args, child_pipe),
+            name="cloudstats-worker-{}".format(self.name),
+            daemon=True,
+        )
+        self.process.start()
+        child_pipe.close()
+
+    def restart(self):
+        """Kill the worker process and start a new one."""
+        self.stop(timeout=0)
+        self.restarts += 1
+        self.start()
+
+    def stop(self, timeout=5):
+        """Stop the worker process."""
+        if self.process is None:
+            return
+        try:
+            self.pipe.send("stop")
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.pipe.close()
+        self.process = None
+
+
+class ShardedStats:
+    """Drop-in replacement of OpenstackStats collecting in worker processes."""
+
+    def __init__(self, registry, workers, args=None, timeout=600):
+        """Start the workers and export their merged snapshots in registry."""
+        self.logger = get_logger()
+        self.timeout = timeout
+        context = multiprocessing.get_context("spawn")
+        self.workers = [
+            Worker(context, collectors, args)
+            for collectors in shard_collectors(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        self._restored = None
+        registry.register(self)
+
+    def supervise(self):
+        """Restart the workers that died since the last collection."""
+        for worker in self.workers:
+            if not worker.process.is_alive():
+                self.logger.warning(
+                    "Worker {} exited with {}, restarting it.".format(
+                        worker.name, worker.process.exitcode
+                    )
+                )
+                worker.restart()
+
+    def get_all_stats(self):
+        """Collect in every worker and keep their snapshots."""
+        self.supervise()
+        requested = []
+        for worker in self.workers:
+            try:
+                worker.pipe.send("collect")
+                requested.append(worker)
+            except (BrokenPipeError, OSError):
+                worker.restart()
+
+        for worker in requested:
+            self._receive(worker)
+
+    def _receive(self, worker):
+        """Wait for the reply of a worker, restarting it on failure."""
+        try:
+            if not worker.pipe.poll(self.timeout):
+                self.logger.warning(
+                    "Worker {} didn't answer in {}s, restarting it.".format(
+                        worker.name, self.timeout
+                    )
+                )
+                worker.restart()
+                return
+            reply = worker.pipe.recv()
+        except (EOFError, OSError):
+            self.logger.warning("Worker {} died, restarting it.".format(worker.name))
+            worker.restart()
+            return
+
+        if reply[0] == "error":
+            self.logger.warning(
+                "Worker {} failed to collect: {}".format(worker.name, reply[1])
+            )
+            return
+        try:
+            worker.snapshot = Snapshot.loads(reply[1])
+        except SnapshotError as e:
+            self.logger.warning("Worker {} sent {}".format(worker.name, e))
+            return
+        worker.cache_sizes = reply[2]
+        self._restored = None
+
+    def snapshots(self):
+        """Return the latest snapshot of every worker."""
+        if self._restored is not None:
+            return [self._restored]
+        return [worker.snapshot for worker in self.workers if worker.snapshot]
+
+    def snapshot(self):
+        """Return the merged snapshots of the workers as one Snapshot."""
+        return Snapshot.from_registry(self)
+
+    def restore_snapshot(self, snapshot):
+        """Export a snapshot until the workers sent their first ones."""
+        if any("type" not in metric for metric in snapshot.metrics.values()):
+            raise SnapshotError("Not a snapshot of a sharded exporter.")
+        self._restored = snapshot
+
+    def cache_sizes(self):
+        """Return the objects held by the caches of all workers."""
+        sizes = {}
+        for worker in self.workers:
+            for name, size in worker.cache_sizes.items():
+                sizes[name] = sizes.get(name, 0) + size
+        return sizes
+
+    def collect(self):
+        """Yield the metric families of all workers merged together."""
+        families = OrderedDict()
+        for snapshot in self.snapshots():
+            for name, family in snapshot.metrics.items():
+                merged = families.setdefault(
+                    name, (family["documentation"], family["type"], OrderedDict())
+                )
+                samples = merged[2]
+                for sample_name, labels, value in family["samples"]:
+                    key = (sample_name, tuple(sorted(labels.items())))
+                    summed = family["type"] in SUMMED_TYPES
+                    # _created samples are timestamps, not values to add up
+                    if (
+                        summed
+                        and key in samples
+                        and not sample_name.endswith("_created")
+                    ):
+                        value += samples[key][1]
+                    samples[key] = (labels, value)
+
+        for name, (documentation, metric_type, samples) in families.items():
+            metric = Metric(name, documentation, metric_type)
+            for (sample_name, _), (labels, value) in samples.items():
+                metric.add_sample(sample_name, labels, value)
+            yield metric
+
+    def stop(self):
+        """Stop all workers."""
+        for worker in self.workers:
+            worker.stop()
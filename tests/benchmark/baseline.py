@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""Stored benchmark baselines and regression checks."""
+
+import json
+import multiprocessing
+import os
+from os.path import abspath, dirname, join
+
+BASELINES = join(dirname(abspath(__file__)), "baselines.json")
+
+
+def load_baselines():
+    """Return the stored baselines by scenario name."""
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES) as f:
+        return json.load(f)
+
+
+def save_baselines(baselines):
+    with open(BASELINES, "w") as f:
+        json.dump(baselines, f, indent=4, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(result, baseline, tolerances):
+    """Return a list of metrics that regressed compared to the baseline.
+
+    Tolerances map each checked metric to the relative increase allowed.
+    """
+    regressions = []
+    for metric, tolerance in tolerances.items():
+        if metric not in baseline:
+            continue
+        limit = baseline[metric] * (1 + tolerance)
+        if result[metric] > limit:
+            regressions.append(
+                "{}: {} > {} (baseline {}, tolerance {:.0%})".format(
+                    metric, result[metric], round(limit, 3), baseline[metric], tolerance
+                )
+            )
+    return regressions
+
+
+def run_in_process(func, *args):
+    """Run func in a fresh process so its peak RSS is its own."""
+    with multiprocessing.Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def run_scenarios(names, run, tolerances, update_baseline=False, prefix=""):
+    """Run scenarios, print results and compare them with the baselines.
+
+    Returns True if any scenario regressed.
+    """
+    baselines = load_baselines()
+    failed = False
+    for name in names:
+        result = run_in_process(run, name)
+        print(json.dumps({prefix + name: result}, indent=4, sort_keys=True))
+
+        if update_baseline:
+            baselines[prefix + name] = {metric: result[metric] for metric in tolerances}
+            continue
+
+        baseline = baselines.get(prefix + name, {})
+        for regression in find_regressions(result, baseline, tolerances):
+            print("REGRESSION in {}: {}".format(prefix + name, regression))
+            failed = True
+
+    if update_baseline:
+        save_baselines(baselines)
+
+    return failed
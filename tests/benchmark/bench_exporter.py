@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+"""Scale benchmark of OpenstackStats.get_all_stats against a synthetic cloud.
+
+Each scenario runs in its own process so peak RSS is not inherited from the
+previous one. Results are compared with the stored baselines and the script
+exits non-zero when a metric regressed beyond its tolerance.
+
+    tox -e benchmark -- --scenario small
+    PYTHONPATH=. python3 tests/benchmark/bench_exporter.py --scenario large
+"""
+
+import argparse
+import functools
+import resource
+import sys
+import time
+from collections import defaultdict
+
+from baseline import run_scenarios
+
+from fake_openstack import FakeCloud, FakeConnection
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+SCENARIOS = {
+    "tiny": dict(projects=5, servers=50, volumes=100, images=20, hypervisors=5),
+    "small": dict(projects=100, servers=1000, volumes=2000, images=200),
+    "medium": dict(
+        projects=1000, servers=20000, volumes=40000, images=2000, hypervisors=500
+    ),
+    "large": dict(
+        projects=10000,
+        servers=100000,
+        volumes=200000,
+        images=10000,
+        hypervisors=2000,
+        networks=20000,
+        routers=10000,
+        floating_ips=50000,
+    ),
+}
+
+# Allowed relative increase over the baseline before a metric is a regression
+TOLERANCES = {
+    "api_calls": 0.0,
+    "exposition_bytes": 0.05,
+}
+
+# Same for the metrics that depend on the machine, only checked on request
+# against baselines refreshed on that machine
+TIMING_TOLERANCES = {
+    "cycle_seconds": 0.25,
+    "peak_rss_kb": 0.20,
+}
+
+COLLECTORS = [
+    "_get_network_stats",
+    "_get_ipa_stats",
+    "_get_router_stats",
+    "_get_load_balancer_stats",
+    "_get_volume_stats",
+    "_get_object_stats",
+    "_get_floating_ip_stats",
+    "_get_nova_stats",
+    "_get_image_stats",
+    "_get_server_stats",
+    "_get_hypervisor_stats",
+]
+
+
+def _timed(func, timings, name):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[name] += time.perf_counter() - start
+
+    return wrapper
+
+
+def run_scenario(name, cycles, latency):
+    """Run collection cycles of a scenario and return the measurements."""
+    # Imported here so the config is read in the scenario process
+    from cloudstats.opensdk import OpenstackStats
+
+    cloud = FakeCloud(latency=latency, **SCENARIOS[name])
+    registry = CollectorRegistry()
+    stats = OpenstackStats(registry=registry, connection=FakeConnection(cloud))
+
+    collector_seconds = defaultdict(float)
+    for collector in COLLECTORS:
+        method = getattr(stats, collector)
+        setattr(stats, collector, _timed(method, collector_seconds, collector))
+
+    cycle_seconds = []
+    for _ in range(cycles):
+        cloud.next_cycle()
+        start = time.perf_counter()
+        stats.get_all_stats()
+        cycle_seconds.append(time.perf_counter() - start)
+
+    return {
+        "cycle_seconds": round(min(cycle_seconds), 3),
+        "collector_seconds": {
+            collector.replace("_get_", "", 1): round(seconds / cycles, 3)
+            for collector, seconds in collector_seconds.items()
+        },
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "api_calls": sum(cloud.calls.values()) // cycles,
+        "api_calls_by_endpoint": {
+            "{} {}".format(*key): count // cycles
+            for key, count in sorted(cloud.calls.items())
+        },
+        "exposition_bytes": len(generate_latest(registry)),
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="Scenario to run, may be repeated (default: small)",
+    )
+    parser.add_argument("--cycles", type=int, default=2, help="Cycles per scenario")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds of latency per API call"
+    )
+    parser.add_argument(
+        "--check-timings",
+        action="store_true",
+        help="Also check the wall time and peak RSS against the baselines",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baselines",
+    )
+    args = parser.parse_args(args)
+
+    tolerances = TOLERANCES
+    if args.check_timings or args.update_baseline:
+        tolerances = dict(TOLERANCES, **TIMING_TOLERANCES)
+    run = functools.partial(run_scenario, cycles=args.cycles, latency=args.latency)
+    failed = run_scenarios(
+        args.scenario or ["small"], run, tolerances, args.update_baseline
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
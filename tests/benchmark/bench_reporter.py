@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+"""Benchmark of the reporter query path against a local Prometheus stand-in.
+
+Measures PrometheusStats.get_all_stats and build_dashboard against
+FakePrometheus with different result sizes, latencies and error rates.
+
+    PYTHONPATH=. python3 tests/benchmark/bench_reporter.py --scenario slow
+"""
+
+import argparse
+import functools
+import resource
+import statistics
+import sys
+import time
+
+from baseline import run_scenarios
+
+from fake_prometheus import FakePrometheus
+
+SCENARIOS = {
+    "fast": dict(vector_size=1),
+    "wide": dict(vector_size=1000),
+    "slow": dict(vector_size=1, latency=0.01),
+    "flaky": dict(vector_size=1, error_rate=0.1),
+}
+
+# Allowed relative increase over the baseline before a metric is a regression
+TOLERANCES = {
+    "queries_per_report": 0.0,
+}
+
+# Same for the metrics that depend on the machine, only checked on request
+# against baselines refreshed on that machine
+TIMING_TOLERANCES = {
+    "report_seconds": 0.25,
+    "peak_rss_kb": 0.20,
+}
+
+
+def run_scenario(name, reports):
+    """Build reports against a scenario and return the measurements."""
+    # Imported here so the config is read in the scenario process
+    from cloudstats.config import Config
+    from cloudstats.prometheus import PrometheusStats
+
+    with FakePrometheus(**SCENARIOS[name]) as prometheus:
+        Config().get_config("prometheus")["url"].set(prometheus.url)
+        stats = PrometheusStats()
+
+        report_seconds = []
+        for _ in range(reports):
+            start = time.perf_counter()
+            stats.get_all_stats()
+            report_seconds.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        stats.build_dashboard()
+        dashboard_seconds = time.perf_counter() - start
+        queries = sum(prometheus.queries.values())
+
+    return {
+        "report_seconds": round(statistics.median(report_seconds), 3),
+        "report_seconds_max": round(max(report_seconds), 3),
+        "dashboard_seconds": round(dashboard_seconds, 3),
+        "queries_per_report": queries // reports,
+        "queries_per_second": round(queries / sum(report_seconds), 1),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="Scenario to run, may be repeated (default: fast)",
+    )
+    parser.add_argument("--reports", type=int, default=3, help="Reports per scenario")
+    parser.add_argument(
+        "--check-timings",
+        action="store_true",
+        help="Also check the wall time and peak RSS against the baselines",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baselines",
+    )
+    args = parser.parse_args(args)
+
+    tolerances = TOLERANCES
+    if args.check_timings or args.update_baseline:
+        tolerances = dict(TOLERANCES, **TIMING_TOLERANCES)
+    run = functools.partial(run_scenario, reports=args.reports)
+    failed = run_scenarios(
+        args.scenario or ["fast"],
+        run,
+        tolerances,
+        args.update_baseline,
+        prefix="reporter-",
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
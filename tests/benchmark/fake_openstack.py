@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+"""Synthetic OpenStack cloud standing in for an openstacksdk Connection.
+
+Inventories are generated on the fly from the object index, so even a cloud
+with hundreds of thousands of servers costs the fake almost no memory and the
+measured memory belongs to the code under test. Listings are split into pages
+of realistic sizes, each page counts as one API call and can be delayed to
+simulate latency. Every cycle a fraction of each inventory is replaced by new
+objects so the churn counters have something to do.
+"""
+
+import time
+from collections import Counter
+
+DEFAULT_PAGE_SIZES = {
+    "identity": 1000,
+    "compute": 1000,
+    "network": 1000,
+    "block-storage": 1000,
+    "image": 25,
+    "object-store": 10000,
+}
+
+
+class FakeResource(dict):
+    """A dict that also allows attribute access, like openstacksdk resources."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class FakeResponse:
+    """Minimal requests.Response for raw proxy calls."""
+
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self._data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self._data
+
+
+class FakeCloud:
+    """Sizes and behaviour of a synthetic cloud."""
+
+    def __init__(
+        self,
+        projects=100,
+        servers=1000,
+        volumes=2000,
+        images=200,
+        hypervisors=50,
+        networks=200,
+        routers=100,
+        floating_ips=500,
+        containers_per_project=5,
+        backends=3,
+        churn=0.01,
+        latency=0.0,
+        page_sizes=None,
+    ):
+        self.projects = projects
+        self.servers = servers
+        self.volumes = volumes
+        self.images = images
+        self.hypervisors = hypervisors
+        self.networks = networks
+        self.routers = routers
+        self.floating_ips = floating_ips
+        self.containers_per_project = containers_per_project
+        self.backends = backends
+        self.churn = churn
+        self.latency = latency
+        self.page_sizes = dict(DEFAULT_PAGE_SIZES, **(page_sizes or {}))
+        self.calls = Counter()
+        self.cycle = 0
+
+    def next_cycle(self):
+        """Advance to the next collection cycle, churning the inventory."""
+        self.cycle += 1
+
+    def call(self, service, endpoint):
+        """Account for one API request."""
+        self.calls[(service, endpoint)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def paginate(self, service, endpoint, count, make):
+        """Yield count generated objects, one API call per page."""
+        page_size = self.page_sizes[service]
+        for start in range(0, max(count, 1), page_size):
+            self.call(service, endpoint)
+            for index in range(start, min(start + page_size, count)):
+                yield make(index)
+
+    def object_id(self, kind, index, count):
+        """Return the id of an object, replaced by a new one when churned."""
+        if index < int(count * self.churn):
+            return "{}-{}-c{}".format(kind, index, self.cycle)
+        return "{}-{}".format(kind, index)
+
+    def project(self, index):
+        project = "project-{}".format(index % self.projects)
+        return {"id": project, "name": project, "domain_name": "default"}
+
+    def owned(self, kind, index, count, **attrs):
+        """Return a resource owned by a project, the way openstacksdk does."""
+        project = self.project(index)
+        return FakeResource(
+            id=self.object_id(kind, index, count),
+            project_id=project["id"],
+            location={"project": project},
+            **attrs
+        )
+
+
+class FakeIdentity:
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    def projects(self):
+        def make(index):
+            project = self._cloud.project(index)
+            return FakeResource(id=project["id"], name=project["name"])
+
+        return self._cloud.paginate("identity", "projects", self._cloud.projects, make)
+
+
+class FakeCompute:
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    def hypervisors(self, details=False):
+        def make(index):
+            return FakeResource(
+                name="hv-{}".format(index),
+                cpu_info={"topology": {"cores": 16, "cells": 2}},
+            )
+
+        return self._cloud.paginate(
+            "compute", "os-hypervisors/detail", self._cloud.hypervisors, make
+        )
+
+    def servers(self, details=False, all_projects=False):
+        cloud = self._cloud
+
+        def make(index):
+            size = index % 8 + 1
+            # Resize a few servers every cycle
+            if index % 97 == cloud.cycle % 97:
+                size += 1
+            return cloud.owned(
+                "server",
+                index,
+                cloud.servers,
+                hypervisor_hostname="hv-{}".format(index % cloud.hypervisors),
+                flavor={
+                    "original_name": "m1.size{}".format(size),
+                    "vcpus": size,
+                    "ram": size * 2048,
+                    "disk": size * 20,
+                    "ephemeral": 0,
+                },
+            )
+
+        return cloud.paginate("compute", "servers/detail", cloud.servers, make)
+
+    def get_flavor(self, flavor_id):
+        self._cloud.call("compute", "flavors")
+        return FakeResource(id=flavor_id, disk=20, ephemeral=0)
+
+    def get(self, url, **kwargs):
+        self._cloud.call("compute", url.strip("/"))
+        if url == "/os-hypervisors/statistics":
+            statistics = {
+                "count": self._cloud.hypervisors,
+                "running_vms": self._cloud.servers,
+            }
+            return FakeResponse(data={"hypervisor_statistics": statistics})
+        return FakeResponse(404)
+
+
+class FakeNetwork:
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    def _owned(self, kind, endpoint, count):
+        def make(index):
+            return self._cloud.owned(kind, index, count)
+
+        return self._cloud.paginate("network", endpoint, count, make)
+
+    def networks(self, **query):
+        return self._owned("network", "networks", self._cloud.networks)
+
+    def subnets(self, **query):
+        return self._owned("subnet", "subnets", self._cloud.networks)
+
+    def routers(self, **query):
+        return self._owned("router", "routers", self._cloud.routers)
+
+    def load_balancers(self, **query):
+        return self._owned("lb", "lbaas/loadbalancers", 0)
+
+    def ips(self, **query):
+        return self._owned("fip", "floatingips", self._cloud.floating_ips)
+
+    def network_ip_availabilities(self, **query):
+        cloud = self._cloud
+
+        def make(index):
+            availability = cloud.owned("network", index, cloud.networks)
+            availability["subnet_ip_availability"] = [
+                {
+                    "subnet_id": "subnet-{}".format(index),
+                    "total_ips": 253,
+                    "used_ips": index % 253,
+                }
+            ]
+            return availability
+
+        return cloud.paginate(
+            "network", "network-ip-availabilities", cloud.networks, make
+        )
+
+
+class FakeBlockStorage:
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    @staticmethod
+    def _size(index):
+        return index % 100 + 1
+
+    def volumes(self, all_projects=False):
+        cloud = self._cloud
+
+        def make(index):
+            return cloud.owned(
+                "volume",
+                index,
+                cloud.volumes,
+                host="cinder@backend-{}#pool".format(index % cloud.backends),
+                size=self._size(index),
+            )
+
+        return cloud.paginate("block-storage", "volumes/detail", cloud.volumes, make)
+
+    def get(self, url, **kwargs):
+        self._cloud.call("block-storage", url.strip("/"))
+        if url == "/volumes/summary":
+            summary = {
+                "total_count": self._cloud.volumes,
+                "total_size": sum(self._size(i) for i in range(self._cloud.volumes)),
+            }
+            return FakeResponse(data={"volume-summary": summary})
+        return FakeResponse(404)
+
+
+class FakeImage:
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    def images(self):
+        cloud = self._cloud
+
+        def make(index):
+            return cloud.owned(
+                "image",
+                index,
+                cloud.images,
+                name="image-{}".format(index),
+                disk_format="qcow2",
+                size=(index % 50 + 1) * 100 * 1024 * 1024,
+            )
+
+        return cloud.paginate("image", "images", cloud.images, make)
+
+
+class FakeObjectStore:
+    ENDPOINT = "http://swift.fake/v1/AUTH_project-0"
+
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    def get_endpoint(self):
+        return self.ENDPOINT
+
+    def head(self, url):
+        self._cloud.call("object-store", "account")
+        count = self._cloud.containers_per_project
+        headers = {
+            "X-Account-Container-Count": str(count),
+            "X-Account-Object-Count": str(count * 100),
+            "X-Account-Bytes-Used": str(count * 100 * 4096),
+        }
+        return FakeResponse(204, headers=headers)
+
+    def get(self, url, params=None):
+        self._cloud.call("object-store", "account")
+        if (params or {}).get("marker"):
+            return FakeResponse(data=[])
+        containers = [
+            {"name": "container-{}".format(index), "count": 100, "bytes": 409600}
+            for index in range(self._cloud.containers_per_project)
+        ]
+        return FakeResponse(data=containers)
+
+
+class FakeConnection:
+    """Stand-in for openstack.connection.Connection backed by a FakeCloud."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.current_project_id = "project-0"
+        self.identity = FakeIdentity(cloud)
+        self.compute = FakeCompute(cloud)
+        self.network = FakeNetwork(cloud)
+        self.block_storage = FakeBlockStorage(cloud)
+        self.image = FakeImage(cloud)
+        self.object_store = FakeObjectStore(cloud)
+
+    def authorize(self):
+        # The token is cached by the session, so this is not an API call
+        return "token"
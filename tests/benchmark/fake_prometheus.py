@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+"""Local Prometheus HTTP API stand-in.
+
+Answers /api/v1/query and /api/v1/query_range with vectors and matrices of a
+configurable size, after a configurable latency, failing a configurable
+fraction of the queries with an HTTP 503.
+"""
+
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakePrometheus:
+    """Prometheus API server running in a background thread."""
+
+    def __init__(self, vector_size=1, latency=0.0, error_rate=0.0, seed=0):
+        self.vector_size = vector_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.queries = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}/".format(host, port)
+
+    def start(self):
+        """Start serving on a free localhost port."""
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _series(self, index):
+        return {
+            "instance": "instance-{}".format(index),
+            "tenant": "project-{}".format(index),
+        }
+
+    def vector(self, timestamp):
+        return {
+            "resultType": "vector",
+            "result": [
+                {"metric": self._series(i), "value": [timestamp, str(i + 1)]}
+                for i in range(self.vector_size)
+            ],
+        }
+
+    def matrix(self, start, end, step):
+        timestamps = []
+        timestamp = start
+        while timestamp <= end:
+            timestamps.append(timestamp)
+            timestamp += step
+        return {
+            "resultType": "matrix",
+            "result": [
+                {
+                    "metric": self._series(i),
+                    "values": [[t, str(i + 1)] for t in timestamps],
+                }
+                for i in range(self.vector_size)
+            ],
+        }
+
+    def answer(self, path, params):
+        """Return the HTTP status and body for a query."""
+        with self._lock:
+            self.queries[path] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self._should_fail():
+            error = {"status": "error", "errorType": "unavailable", "error": "fake"}
+            return 503, error
+
+        now = time.time()
+        if path == "/api/v1/query":
+            data = self.vector(float(params.get("time", now)))
+        elif path == "/api/v1/query_range":
+            data = self.matrix(
+                float(params.get("start", now - 3600)),
+                float(params.get("end", now)),
+                float(params.get("step", 60)),
+            )
+        else:
+            return 404, {"status": "error", "errorType": "not_found", "error": path}
+
+        return 200, {"status": "success", "data": data}
+
+    def _handler(self):
+        prometheus = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, params):
+                url = urlparse(self.path)
+                params.update(parse_qs(url.query))
+                params = {key: values[-1] for key, values in params.items()}
+                status, body = prometheus.answer(url.path, params)
+                payload = json.dumps(body).encode("utf8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):  # noqa: N802
+                self._respond({})
+
+            def do_POST(self):  # noqa: N802
+                length = int(self.headers.get("Content-Length", 0))
+                self._respond(parse_qs(self.rfile.read(length).decode("utf8")))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""Smoke test the benchmark suite on a tiny synthetic cloud."""
+
+from baseline import find_regressions, load_baselines
+
+from bench_exporter import SCENARIOS, TIMING_TOLERANCES, TOLERANCES, run_scenario
+
+from bench_reporter import SCENARIOS as REPORTER_SCENARIOS
+from bench_reporter import TOLERANCES as REPORTER_TOLERANCES
+from bench_reporter import run_scenario as run_reporter_scenario
+
+from cloudstats.opensdk import OpenstackStats
+
+from fake_openstack import FakeCloud, FakeConnection
+
+from fake_prometheus import FakePrometheus
+
+from prometheus_client import CollectorRegistry
+
+import requests
+
+
+class TestBenchmark:
+    """Benchmark test class."""
+
+    def test_fake_cloud(self):
+        """Test the fake connection produces the configured inventory."""
+        cloud = FakeCloud(projects=3, servers=30, volumes=40, images=10)
+        registry = CollectorRegistry()
+        stats = OpenstackStats(registry=registry, connection=FakeConnection(cloud))
+        stats.get_all_stats()
+
+        assert registry.get_sample_value("cinder_total_volumes") == 40
+        assert (
+            registry.get_sample_value(
+                "nova_project_servers",
+                {"domain_name": "default", "project_name": "project-1"},
+            )
+            == 10
+        )
+        assert cloud.calls[("image", "images")] == 1
+
+    def test_run_scenario(self):
+        """Test a scenario reports all measurements."""
+        result = run_scenario("tiny", cycles=2, latency=0)
+        assert result["api_calls"] > 0
+        assert result["exposition_bytes"] > 0
+        assert result["peak_rss_kb"] > 0
+        assert "server_stats" in result["collector_seconds"]
+
+    def test_find_regressions(self):
+        """Test metrics beyond the tolerance are flagged."""
+        baseline = {"cycle_seconds": 1.0, "api_calls": 10}
+        tolerances = dict(TOLERANCES, **TIMING_TOLERANCES)
+        assert (
+            find_regressions(
+                {"cycle_seconds": 1.2, "api_calls": 10}, baseline, tolerances
+            )
+            == []
+        )
+        regressions = find_regressions(
+            {"cycle_seconds": 2, "api_calls": 11}, baseline, tolerances
+        )
+        assert len(regressions) == 2
+
+        # Timings are only checked on request
+        regressions = find_regressions(
+            {"cycle_seconds": 2, "api_calls": 10}, baseline, TOLERANCES
+        )
+        assert regressions == []
+
+    def test_baselines(self):
+        """Test every shipped scenario has a baseline."""
+        baselines = load_baselines()
+        for name in SCENARIOS:
+            assert set(TOLERANCES) <= set(baselines[name])
+        for name in REPORTER_SCENARIOS:
+            assert set(REPORTER_TOLERANCES) <= set(baselines["reporter-" + name])
+
+    def test_fake_prometheus(self):
+        """Test the reporter queries the Prometheus stand-in."""
+        with FakePrometheus(vector_size=3) as prometheus:
+            response = requests.get(
+                prometheus.url + "api/v1/query", params={"query": "up"}
+            )
+            assert len(response.json()["data"]["result"]) == 3
+
+            response = requests.get(
+                prometheus.url + "api/v1/query_range",
+                params={"query": "up", "start": 0, "end": 120, "step": 60},
+            )
+            assert len(response.json()["data"]["result"][0]["values"]) == 3
+
+        with FakePrometheus(error_rate=1) as prometheus:
+            response = requests.get(prometheus.url + "api/v1/query")
+            assert response.status_code == 503
+
+    def test_run_reporter_scenario(self, monkeypatch):
+        """Test a reporter scenario reports all measurements."""
+        # The scenario points the global config at the stand-in
+        monkeypatch.setattr("cloudstats.config.config", None)
+        result = run_reporter_scenario("fast", reports=1)
+        assert result["queries_per_report"] > 0
+        assert result["queries_per_second"] > 0
@@ -39,8 +39,8 @@ def mock_requests_get(monkeypatch):
 
 
 @pytest.fixture
-def mock_requests_post(monkeypatch):
-    """Mock requests.post."""
+def mock_session_post(monkeypatch):
+    """Mock requests.Session.post."""
     access_token = jwt.encode(
         {"token_type": "access", "exp": datetime.utcnow() + timedelta(days=1)},
         "secret",
@@ -60,7 +60,7 @@ def mock_requests_post(monkeypatch):
     }
     mock_post_response.status_code = 200
     mock_post.return_value = mock_post_response
-    monkeypatch.setattr("cloudstats.api.requests.post", mock_post)
+    monkeypatch.setattr("cloudstats.api.requests.Session.post", mock_post)
 
     return mock_post
 
@@ -72,6 +72,7 @@ def mock_session_patch(monkeypatch):
     mock_patch_response = mock.Mock()
     mock_patch_response.json.return_value = {}
     mock_patch_response.status_code = 200
+    mock_patch_response.headers = {}
     mock_patch.return_value = mock_patch_response
     monkeypatch.setattr("cloudstats.api.requests.Session.patch", mock_patch)
 
@@ -156,7 +157,7 @@ def mock_openstacksdk_connection(monkeypatch):
 
 @pytest.fixture
 def reporter_daemon(
-    mock_landscape_api, mock_openstacksdk_connection, monkeypatch, client
+    mock_landscape_api, mock_openstacksdk_connection, monkeypatch, client, tmp_path
 ):
     """Daemon with unit mocks applied."""
     from cloudstats.reporter import StatsReporterDaemon
@@ -164,14 +165,18 @@ def reporter_daemon(
     def _daemon(args=""):
         # Clear global
         monkeypatch.setattr("cloudstats.config.config", None)
-        return StatsReporterDaemon(args)
+        monkeypatch.setattr("cloudstats.reporter.Storage", memory_storage)
+        daemon = StatsReporterDaemon(args)
+        for cloud in daemon.clouds:
+            cloud.spool.directory = str(tmp_path / "spool")
+        return daemon
 
     return _daemon
 
 
 @pytest.fixture
 def exporter_daemon(
-    mock_landscape_api, mock_openstacksdk_connection, monkeypatch, client
+    mock_landscape_api, mock_openstacksdk_connection, monkeypatch, client, tmp_path
 ):
     """Daemon with unit mocks applied."""
     from cloudstats.exporter import StatsExporterDaemon
@@ -179,7 +184,9 @@ def exporter_daemon(
     def _daemon(args=""):
         # Clear global
         monkeypatch.setattr("cloudstats.config.config", None)
-        return StatsExporterDaemon(args)
+        daemon = StatsExporterDaemon(args)
+        daemon.snapshot_path = str(tmp_path / "exporter.snap")
+        return daemon
 
     return _daemon
 
@@ -205,7 +212,7 @@ def landscape(mock_landscape_api, monkeypatch):
 
 
 @pytest.fixture
-def client(mock_requests_get, mock_requests_post, mock_session_patch, monkeypatch):
+def client(mock_requests_get, mock_session_post, mock_session_patch, monkeypatch):
     """Restclient with mocks applied."""
     monkeypatch.setattr("cloudstats.api.Storage", memory_storage)
     client = RestClient()
@@ -216,6 +223,8 @@ def client(mock_requests_get, mock_requests_post, mock_session_patch, monkeypatc
 @pytest.fixture
 def openstack(mock_openstacksdk_connection, monkeypatch):
     """Openstack with mocks applied."""
+    # Clear global so config overrides in one test don't leak into the next
+    monkeypatch.setattr("cloudstats.config.config", None)
     openstack = OpenstackStats()
 
     return openstack
@@ -240,6 +249,7 @@ def mock_gauge():
             self.kwargs = []
             self.values = []
             self.call_labels = []
+            self.clears = 0
 
         def __call__(self, *args, **kwargs):
             self.args.append(list(args))
@@ -255,6 +265,9 @@ def mock_gauge():
         def set(self, value):
             self.values.append(value)
 
+        def clear(self):
+            self.clears += 1
+
     return TestArgs()
 
 
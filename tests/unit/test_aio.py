@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+"""Test asyncio collection engine module."""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from cloudstats.aio import AsyncEngine, _next_url
+from cloudstats.cassette import Cassette
+
+import mock
+
+import pytest
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """Answer paginated Keystone and Nova listings and Swift account HEADs."""
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode("utf8") if body is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):  # noqa: N802
+        base = "http://{}:{}".format(*self.server.server_address)
+        if self.path == "/identity/v3/projects":
+            self._send(
+                200,
+                {
+                    "projects": [{"id": "p1", "name": "one"}],
+                    "links": {"next": "/identity/v3/projects?marker=p1"},
+                },
+            )
+        elif self.path == "/identity/v3/projects?marker=p1":
+            self._send(200, {"projects": [{"id": "p2", "name": "two"}], "links": {}})
+        elif self.path == "/compute/v2.1/servers/detail?all_tenants=True":
+            assert self.headers["X-Auth-Token"] == "token"
+            self._send(
+                200,
+                {
+                    "servers": [
+                        {
+                            "id": "s1",
+                            "tenant_id": "p1",
+                            "flavor": {"disk": 10, "ephemeral": 0},
+                        }
+                    ],
+                    "servers_links": [
+                        {"rel": "next", "href": base + "/compute/v2.1/next"}
+                    ],
+                },
+            )
+        elif self.path == "/compute/v2.1/next":
+            self._send(200, {"servers": []})
+        else:
+            self._send(404, {})
+
+    def do_HEAD(self):  # noqa: N802
+        if self.path == "/swift/v1/AUTH_p1":
+            self._send(204, headers={"X-Account-Object-Count": "3"})
+        else:
+            self._send(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api_url():
+    """URL of a fake OpenStack API served from a thread."""
+    server = HTTPServer(("127.0.0.1", 0), FakeAPIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://{}:{}".format(*server.server_address)
+    server.shutdown()
+    server.server_close()
+
+
+class TestAsyncEngine:
+    """Asyncio engine test class."""
+
+    def test_next_url(self):
+        """Test next pages are found in each service's link format."""
+        url = "http://glance/v2/images"
+        assert _next_url(url, {"next": "/v2/images?marker=1"}, "images") == (
+            "http://glance/v2/images?marker=1"
+        )
+        links = {"servers_links": [{"rel": "next", "href": "http://nova/next"}]}
+        assert _next_url(url, links, "servers") == "http://nova/next"
+        assert _next_url(url, {"links": {"next": None}}, "projects") is None
+
+    def test_prefetch(self, openstack, api_url, monkeypatch):
+        """Test listings and Swift accounts are fetched into the caches."""
+        monkeypatch.setattr(
+            "cloudstats.aio.utils.maximum_supported_microversion",
+            lambda adapter, maximum: "2.60",
+        )
+        openstack.config["object_store"]["all_projects"].set(True)
+        connection = openstack.connection
+        connection.session.get_token.return_value = "token"
+        connection.session.verify = True
+        connection.current_project_id = "own"
+        connection.identity.get_endpoint.return_value = api_url + "/identity/v3"
+        connection.compute.get_endpoint.return_value = api_url + "/compute/v2.1"
+        # Blocking openstacksdk calls are made outside of the event loop
+        loops = []
+        connection.object_store.get_endpoint.side_effect = lambda: (
+            loops.append(asyncio._get_running_loop()) or api_url + "/swift/v1/AUTH_own"
+        )
+        monkeypatch.setattr(
+            openstack,
+            "_complete_flavor",
+            lambda server: loops.append(asyncio._get_running_loop()),
+        )
+
+        AsyncEngine(openstack).prefetch(["projects", "servers"], object_accounts=True)
+        assert loops == [None, None]
+
+        assert [project.name for project in openstack._projects_cache] == [
+            "one",
+            "two",
+        ]
+        assert [server["project_id"] for server in openstack._servers_cache] == ["p1"]
+        # The Swift account of p2 doesn't exist
+        assert openstack._object_accounts_cache == [
+            {
+                "project_id": "p1",
+                "project_name": "one",
+                "containers": 0,
+                "objects": 3,
+                "bytes": 0,
+                "container_list": [],
+            }
+        ]
+        labels = {
+            "service": "compute",
+            "endpoint": "/compute/v2.1/servers/detail",
+            "status": "200",
+        }
+        assert openstack._registry.get_sample_value(
+            "cloudstats_openstack_requests_total", labels
+        )
+
+    def test_cassette_sync(self, openstack, monkeypatch):
+        """Test collections don't use aiohttp while a cassette is active."""
+        openstack.config["collection_engine"].set("asyncio")
+        prefetch = mock.Mock()
+        monkeypatch.setattr(openstack, "_prefetch", prefetch)
+        with Cassette().replay():
+            openstack.get_all_stats()
+        prefetch.assert_not_called()
+
+        openstack.get_all_stats()
+        prefetch.assert_called_once()
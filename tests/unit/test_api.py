@@ -1,5 +1,16 @@
 #!/usr/bin/python3
 """Test api module."""
+import gzip
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from cloudstats.api import RequestBody, RestClient, Token
+
+import jwt
+
+import mock
 
 
 class TestRestClient:
@@ -14,13 +25,6 @@ class TestRestClient:
         assert client is not None
         assert client.config["url"].get(str) == "http://example.com:8000/"
 
-    def test_setup_headers(self, client):
-        """Test get_headers."""
-        client._setup_headers()
-        assert client._session.headers["Authorization"] == "Bearer {}".format(
-            client._tokens["access"].encoded
-        )
-
     def test_get_proxies(self, client, monkeypatch):
         """Test _get_proxies."""
         proxies = client._get_proxies()
@@ -57,3 +61,142 @@ class TestRestClient:
         data = {"name": "MockName"}
         response = client.update_cloud_info(client.config["cloud_uuid"].get(str), data)
         assert response == {}
+
+    def test_update_rejected_token(self, client, mock_session_patch, mock_session_post):
+        """Test a rejected access token is refreshed once and the update retried."""
+        rejected = mock.Mock()
+        rejected.status_code = 401
+        rejected.headers = {}
+        mock_session_patch.side_effect = [rejected, mock_session_patch.return_value]
+        # Wait for the refresh started in the background on setup
+        client._token_manager.access()
+        refreshes = mock_session_post.call_count
+
+        response = client.update_cloud_info("example-uuid", {"name": "MockName"})
+        assert response == {}
+        assert mock_session_patch.call_count == 2
+        assert mock_session_post.call_count == refreshes + 1
+        # Refreshed over the session, without the rejected token
+        assert "headers" not in mock_session_post.call_args.kwargs
+
+    def test_request_body(self):
+        """Test a body is serialized once and each coding compressed once."""
+        body = RequestBody({"name": "MockName"})
+        assert json.loads(body.encode(None)) == {"name": "MockName"}
+        compressed = body.encode("gzip")
+        assert json.loads(gzip.decompress(compressed)) == {"name": "MockName"}
+        assert body.encode("gzip") is compressed
+
+    def test_compression(self, client, mock_session_patch):
+        """Test bodies are compressed once the API advertises a coding."""
+        client.config["compression_threshold"].set(0)
+        data = {"name": "MockName"}
+        client.update_cloud_info("example-uuid", data)
+        assert "Content-Encoding" not in mock_session_patch.call_args.kwargs["headers"]
+
+        mock_session_patch.return_value.headers = {"Accept-Encoding": "br, gzip"}
+        client.update_cloud_info("example-uuid", data)
+        client.update_cloud_info("example-uuid", data)
+        kwargs = mock_session_patch.call_args.kwargs
+        assert kwargs["headers"]["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(kwargs["data"])) == data
+
+        # An unsupported coding is dropped and the body sent again uncompressed
+        unsupported = mock.Mock()
+        unsupported.status_code = 415
+        unsupported.headers = {}
+        mock_session_patch.return_value.headers = {}
+        mock_session_patch.side_effect = [unsupported, mock_session_patch.return_value]
+        client.update_cloud_info("example-uuid", data)
+        kwargs = mock_session_patch.call_args.kwargs
+        assert "Content-Encoding" not in kwargs["headers"]
+        assert json.loads(kwargs["data"]) == data
+        assert client._accepted_encodings == set()
+
+    def test_token_refresh_background(self, client, mock_session_post):
+        """Test a client is created without waiting for the token refresh."""
+        release = threading.Event()
+        response = mock_session_post.return_value
+        mock_session_post.side_effect = lambda *args, **kwargs: (
+            release.wait(5) and response
+        )
+        slow_client = RestClient()
+        assert "access" not in slow_client._tokens
+
+        release.set()
+        assert slow_client._token_manager.access().is_current
+        slow_client.close()
+
+    def test_token_refresh_single_flight(self, client, mock_session_post):
+        """Test concurrent refreshes of the same stale token send one request."""
+        manager = client._token_manager
+        stale = manager.access()
+        refreshes = mock_session_post.call_count
+
+        threads = [
+            threading.Thread(target=manager.refresh, args=[stale]) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert mock_session_post.call_count == refreshes + 1
+        assert manager.access() is not stale
+        assert manager.storage.get_token("access").encoded == manager.access().encoded
+
+    def test_token_refresh_delay(self, client):
+        """Test tokens are refreshed ahead of their expiry, with jitter."""
+        manager = client._token_manager
+        expires_in = manager.access().expires_in
+        for _ in range(20):
+            delay = manager.delay()
+            assert expires_in - 300 - 60 - 1 <= delay <= expires_in - 300
+
+    def test_token_refresh_short_lived(self, client, mock_session_post):
+        """Test short-lived tokens are refreshed halfway, never in a loop."""
+        manager = client._token_manager
+        manager.access()
+        tokens = {
+            kind: jwt.encode(
+                {"token_type": kind, "exp": datetime.utcnow() + lifetime},
+                "secret",
+                algorithm="HS256",
+            )
+            for kind, lifetime in (
+                ("access", timedelta(minutes=5)),
+                ("refresh", timedelta(days=1)),
+            )
+        }
+        mock_session_post.return_value.json.return_value = tokens
+        manager.refresh(manager.access())
+
+        # Halfway through the access token, minus the jitter
+        assert 150 - 60 - 1 <= manager.delay() <= 150
+        manager.tokens["access"] = Token(
+            jwt.encode(
+                {"token_type": "access", "exp": datetime.utcnow()},
+                "secret",
+                algorithm="HS256",
+            )
+        )
+        assert manager.delay() == manager.RETRY_DELAY
+
+    def test_token_expiry_utc(self, monkeypatch):
+        """Test token expiries don't depend on the local timezone."""
+        monkeypatch.setenv("TZ", "America/New_York")
+        time.tzset()
+        try:
+            token = Token(
+                jwt.encode(
+                    {
+                        "token_type": "access",
+                        "exp": datetime.utcnow() + timedelta(hours=1),
+                    },
+                    "secret",
+                    algorithm="HS256",
+                )
+            )
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+        assert 3590 < token.expires_in <= 3600
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""Test cassette module."""
+
+import json
+
+from cloudstats.cassette import Cassette, CassetteError
+from cloudstats.config import Config
+from cloudstats.prometheus import PrometheusStats
+
+import pytest
+
+import requests
+
+
+def fake_send(adapter, request, **kwargs):
+    """Answer every request with a one element Prometheus vector."""
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["X-Subject-Token"] = "secret-token"
+    response._content = json.dumps(
+        {
+            "refresh": "secret-jwt",
+            "data": {"result": [{"metric": {"tenant": "admin"}, "value": [0, "7"]}]},
+        }
+    ).encode("utf8")
+    response.url = request.url
+    return response
+
+
+def offline_send(adapter, request, **kwargs):
+    raise AssertionError("Network used during replay")
+
+
+class TestCassette:
+    """Cassette test class."""
+
+    @pytest.fixture(autouse=True)
+    def clean_config(self, monkeypatch):
+        """Reset the global config recorded and replayed cassettes change."""
+        monkeypatch.setattr("cloudstats.config.config", None)
+
+    def test_record_replay(self, monkeypatch, tmp_path):
+        """Test Prometheus stats can be collected offline from a recording."""
+        monkeypatch.setattr("requests.adapters.HTTPAdapter.send", fake_send)
+        with Cassette().record() as cassette:
+            Config().get_config("prometheus")["url"].set("http://prometheus.example/")
+            recorded = PrometheusStats().get_all_stats()
+        assert recorded["num_hosts"] == 7
+        filename = str(tmp_path / "cycle.cassette")
+        cassette.save(filename)
+
+        monkeypatch.setattr("cloudstats.config.config", None)
+        monkeypatch.setattr("requests.adapters.HTTPAdapter.send", offline_send)
+        with Cassette.load(filename).replay():
+            replayed = PrometheusStats().get_all_stats()
+        assert replayed == recorded
+
+    def test_redaction(self, monkeypatch):
+        """Test credentials are not written to the cassette."""
+        monkeypatch.setattr("requests.adapters.HTTPAdapter.send", fake_send)
+        with Cassette().record() as cassette:
+            requests.get("http://prometheus.example/api/v1/query")
+
+        interaction = cassette.interactions[0]
+        assert interaction["headers"]["X-Subject-Token"] == "REDACTED"
+        assert json.loads(interaction["body"])["refresh"] == "REDACTED"
+        assert "password" not in cassette.config["openstack"]
+
+    def test_replay_unknown_request(self, monkeypatch):
+        """Test requests missing from the cassette fail instead of going out."""
+        monkeypatch.setattr("requests.adapters.HTTPAdapter.send", offline_send)
+        with Cassette().replay():
+            with pytest.raises(CassetteError):
+                requests.get("http://prometheus.example/api/v1/query")
@@ -1,5 +1,8 @@
 #!/usr/bin/python3
 """Test cloud stats exporter daemon."""
+import glob
+
+from cloudstats.snapshot import Snapshot
 
 
 class TestExporterDaemon:
@@ -26,3 +29,71 @@ class TestExporterDaemon:
         """Test run."""
         statsd = exporter_daemon()
         statsd.trigger()
+
+    def test_warm_start(self, exporter_daemon):
+        """Test the last collection is restored, marked stale, on startup."""
+        statsd = exporter_daemon()
+        statsd.trigger()
+        registry = statsd._registry
+        assert registry.get_sample_value("cloudstats_snapshot_stale") == 0
+        collected = registry.get_sample_value("neutron_total_networks")
+
+        restarted = exporter_daemon()
+        restarted.snapshot_path = statsd.snapshot_path
+        restarted.load_snapshot()
+        registry = restarted._registry
+        assert registry.get_sample_value("cloudstats_snapshot_stale") == 1
+        assert registry.get_sample_value("neutron_total_networks") == collected
+
+    def test_warm_start_corrupt_snapshot(self, exporter_daemon):
+        """Test an unreadable snapshot is ignored."""
+        statsd = exporter_daemon()
+        with open(statsd.snapshot_path, "wb") as f:
+            f.write(b"garbage")
+        statsd.load_snapshot()
+        assert statsd._registry.get_sample_value("cloudstats_snapshot_stale") == 0
+
+    def test_profile(self, exporter_daemon, tmp_path, monkeypatch):
+        """Test --profile writes the stages of each collection."""
+        monkeypatch.setenv("CLOUDSTATSDIR", str(tmp_path))
+        statsd = exporter_daemon(("--profile",))
+        statsd.trigger()
+        assert "exporter;auth" in statsd.profiler.timings
+        assert "exporter;network_stats" in statsd.profiler.timings
+        assert glob.glob(str(tmp_path / "profiles" / "exporter-*.folded"))
+
+    def test_scrape_mode(self, exporter_daemon):
+        """Test a scrape collects and serves the rendered collection."""
+        statsd = exporter_daemon()
+        statsd.config["exporter"]["collection_mode"].set("scrape")
+        statsd.on_demand = statsd.setup_on_demand()
+
+        status, _, body = statsd.scrape({})
+        assert status == 200
+        assert b"cloudstats_snapshot_stale 0.0" in body
+        assert statsd.on_demand.last_collection is not None
+
+    def test_scheduler_metrics(self, exporter_daemon):
+        """Test the scheduler series only exist when collections are scheduled."""
+        statsd = exporter_daemon()
+        labels = {"daemon": "exporter"}
+        lag = statsd._registry.get_sample_value("cloudstats_cycle_lag_seconds", labels)
+        assert lag == 0
+
+        statsd.config["exporter"]["collection_mode"].set("scrape")
+        assert statsd.setup_scheduler() is None
+
+    def test_snapshot_endpoint(self, exporter_daemon):
+        """Test the snapshot of the last collection is served with an ETag."""
+        statsd = exporter_daemon()
+        assert statsd.snapshot_cache.handle({})[0] == 503
+        statsd.trigger()
+
+        status, _, body, headers = statsd.snapshot_cache.handle({})
+        assert status == 200
+        snapshot = Snapshot.loads(body)
+        assert snapshot.samples("neutron_total_networks")
+        etag = dict(headers)["ETag"]
+        status, _, body, _ = statsd.snapshot_cache.handle({"HTTP_IF_NONE_MATCH": etag})
+        assert status == 304
+        assert body == b""
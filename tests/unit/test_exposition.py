@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+"""Test exposition cache module."""
+import gzip
+
+from cloudstats.exposition import ExpositionCache
+
+from prometheus_client import CollectorRegistry, Gauge
+
+
+class TestExpositionCache:
+    """Exposition cache test class."""
+
+    def test_negotiation(self):
+        """Test the format and encoding follow the scrape's headers."""
+        registry = CollectorRegistry()
+        Gauge("test_gauge", "Test", registry=registry).set(1)
+        cache = ExpositionCache(registry)
+
+        _, content_type, body = cache.handle({})
+        assert content_type.startswith("text/plain")
+        assert b"test_gauge 1.0" in body
+
+        environ = {
+            "HTTP_ACCEPT": "application/openmetrics-text; version=1.0.0",
+            "HTTP_ACCEPT_ENCODING": "gzip, deflate",
+        }
+        _, content_type, body, headers = cache.handle(environ)
+        assert content_type.startswith("application/openmetrics-text")
+        assert headers == [("Content-Encoding", "gzip")]
+        assert gzip.decompress(body).endswith(b"# EOF\n")
+
+        # Codings refused or preferred less than no coding at all
+        for encoding in ("gzip;q=0", "identity, gzip;q=0.5", "x-gzip", "*;q=0"):
+            response = cache.handle({"HTTP_ACCEPT_ENCODING": encoding})
+            assert len(response) == 3, encoding
+        for encoding in ("gzip;q=0.5", "*", "identity;q=0.5, GZIP"):
+            response = cache.handle({"HTTP_ACCEPT_ENCODING": encoding})
+            assert response[3] == [("Content-Encoding", "gzip")], encoding
+
+    def test_name_filter(self):
+        """Test scrapes selecting metrics by name are rendered on demand."""
+        registry = CollectorRegistry()
+        Gauge("test_gauge", "Test", registry=registry).set(1)
+        Gauge("other_gauge", "Other", registry=registry).set(2)
+        cache = ExpositionCache(registry)
+        cache.render()
+
+        _, _, body = cache.handle({"QUERY_STRING": "name[]=other_gauge"})
+        assert b"other_gauge 2.0" in body
+        assert b"test_gauge" not in body
+
+        environ = {"QUERY_STRING": "name[]=test_gauge", "HTTP_ACCEPT_ENCODING": "gzip"}
+        body = gzip.decompress(cache.handle(environ)[2])
+        assert b"test_gauge 1.0" in body
+        assert b"other_gauge" not in body
+
+    def test_render(self):
+        """Test changes to the registry are only served once rendered."""
+        registry = CollectorRegistry()
+        gauge = Gauge("test_gauge", "Test", registry=registry)
+        cache = ExpositionCache(registry)
+        cache.render()
+
+        gauge.set(2)
+        assert b"test_gauge 0.0" in cache.handle({})[2]
+        cache.render()
+        assert b"test_gauge 2.0" in cache.handle({})[2]
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+"""Test local stats module."""
+import os
+import re
+
+import cloudstats.opensdk
+from cloudstats.localstats import (
+    LOCAL_STATS,
+    SnapshotSamples,
+    SnapshotSource,
+    promql_round,
+    quantile,
+)
+from cloudstats.snapshot import Snapshot
+
+import mock
+
+import yaml
+
+
+def subnet_snapshot():
+    """Snapshot of the subnet and volume gauges of an exporter."""
+    return Snapshot(
+        {
+            "neutron_subnet_ips_total": {
+                "documentation": "total number of configured IPs in subnet",
+                "labelnames": ["subnet_id"],
+                "samples": [["a", 250], ["b", 10]],
+            },
+            "neutron_subnet_ips_used": {
+                "documentation": "number of used IPs in subnet",
+                "labelnames": ["subnet_id"],
+                "samples": [["a", 50], ["b", 7]],
+            },
+            "hypervisor_servers": {
+                "documentation": "Number of servers per hypervisor",
+                "labelnames": ["hypervisor"],
+                "samples": [["a", 3], ["b", 4]],
+            },
+            "hypervisor_ephemeral_size": {
+                "documentation": "Ephemeral size of the servers per hypervisor",
+                "labelnames": ["hypervisor"],
+                "samples": [["a", 30], ["b", 40]],
+            },
+            "glance_project_images": {
+                "documentation": "Number of images in glance per project",
+                "labelnames": ["domain_name", "project_name"],
+                "samples": [["default", "a", 2], ["default", "b", 1]],
+            },
+            "glance_project_image_size": {
+                "documentation": "Size of images in glance per project",
+                "labelnames": ["domain_name", "project_name"],
+                "samples": [["default", "a", 1500000], ["default", "b", 260000]],
+            },
+            "cinder_volume_size": {
+                "documentation": "Size of volume in cinder",
+                "type": "gauge",
+                "samples": [
+                    ["cinder_volume_size", {"volume_id": "1"}, 10.0],
+                    ["cinder_volume_size", {"volume_id": "2"}, 20.0],
+                    ["cinder_volume_size", {"volume_id": "3"}, 25.0],
+                ],
+            },
+        }
+    )
+
+
+class TestLocalStats:
+    """Local stats test class."""
+
+    def test_promql_functions(self):
+        """Test rounding and quantiles match PromQL."""
+        assert promql_round(12.345, 0.1) == 12.3
+        assert promql_round(2.5, 1) == 3
+        assert quantile(0.5, [3, 1, 2]) == 2
+        assert quantile(0.5, [1, 2, 3, 4]) == 2.5
+
+    def test_local_stats(self):
+        """Test stats are computed from both snapshot layouts."""
+        samples = SnapshotSamples(subnet_snapshot())
+        ipaddress = LOCAL_STATS["ipaddress_stats"]
+        assert ipaddress["min_subnet_free"](samples) == 3
+        assert ipaddress["min_subnet_free_name"](samples) == "b"
+        assert ipaddress["mean_ip_allocation_percent"](samples) == 45
+        assert ipaddress["num_ip_allocated"](samples) == 57
+        assert LOCAL_STATS["networking_stats"]["num_subnets"](samples) == 2
+
+        volume = LOCAL_STATS["volume_stats"]
+        assert volume["max_volume_size"](samples) == 25
+        assert volume["median_volume_size"](samples) == 20
+        assert volume["mean_volume_size"](samples) == 18.3
+        assert volume["num_volumes"](samples) is None
+
+        virtual_server = LOCAL_STATS["virtual_server_stats"]
+        assert virtual_server["total_ephemeral_servers"](samples) == 7
+        assert virtual_server["total_ephemeral_size"](samples) == 70
+        image = LOCAL_STATS["image_stats"]
+        assert image["num_images"](samples) == 3
+        assert image["total_image_size"](samples) == 1.8
+
+    def test_local_stats_coverage(self):
+        """Test every query of the exporter's metrics only has a local stat."""
+        directory = os.path.dirname(cloudstats.opensdk.__file__)
+        with open(os.path.join(directory, "opensdk.py")) as f:
+            exported = set(re.findall(r'"([a-z]+_[a-z_]+)"', f.read()))
+        with open(os.path.join(directory, "prometheus_queries.yaml")) as f:
+            queries = yaml.safe_load(f)
+
+        missing = []
+        for collector, stats in queries.items():
+            if collector.endswith("_config"):
+                continue
+            for stat, query in stats.items():
+                # Metric names, without the labels of groupings and selectors
+                metrics = set(
+                    re.findall(
+                        r"[a-z][a-z0-9]*(?:_[a-z0-9]+)+",
+                        re.sub(r"by \([^)]*\)|\{[^}]*\}", "", query),
+                    )
+                )
+                if metrics <= exported and stat not in LOCAL_STATS.get(collector, {}):
+                    missing.append(stat)
+        assert missing == []
+
+    def test_snapshot_source(self, monkeypatch):
+        """Test the snapshot is only downloaded again once modified."""
+        body = subnet_snapshot().dumps()
+        modified = mock.Mock(status_code=200, content=body, headers={"ETag": '"1"'})
+        not_modified = mock.Mock(status_code=304, headers={})
+        get = mock.Mock(side_effect=[modified, not_modified])
+        monkeypatch.setattr("cloudstats.localstats.requests.get", get)
+
+        source = SnapshotSource("http://127.0.0.1:9748/snapshot", max_age=60)
+        first = source.fetch()
+        assert first.metrics.keys() == subnet_snapshot().metrics.keys()
+        assert source.fetch() is first
+        assert get.call_args.kwargs["headers"] == {"If-None-Match": '"1"'}
+
+        source.max_age = -1
+        get.side_effect = [not_modified]
+        assert source.fetch() is None
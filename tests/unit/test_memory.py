@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""Test memory accounting module."""
+import json
+import tracemalloc
+from wsgiref.util import setup_testing_defaults
+
+from cloudstats.http import ExporterApp
+from cloudstats.memory import MemoryAccounting
+
+import mock
+
+from prometheus_client import CollectorRegistry, Gauge
+
+import pytest
+
+
+@pytest.fixture
+def memory():
+    """Memory accounting of a registry with one labelled gauge."""
+    registry = CollectorRegistry()
+    gauge = Gauge("test_gauge", "Test", ["project_name"], registry=registry)
+    gauge.labels("a").set(1)
+    gauge.labels("b").set(2)
+    openstack = mock.Mock()
+    openstack.cache_sizes.return_value = {"servers": 3}
+
+    yield MemoryAccounting(openstack, registry, top=5)
+    tracemalloc.stop()
+
+
+class TestMemoryAccounting:
+    """Memory accounting test class."""
+
+    def test_report(self, memory):
+        """Test the report is returned and exported as gauges."""
+        report = memory.report()
+        assert report["metrics"]["test_gauge"]["series"] == 2
+        assert report["metrics"]["test_gauge"]["bytes"] > 0
+        assert report["caches"] == {"servers": 3}
+        assert len(report["top_allocations"]) <= 5
+
+        registry = memory.registry
+        labels = {"metric": "test_gauge"}
+        assert registry.get_sample_value("cloudstats_metric_series", labels) == 2
+        labels = {"cache": "servers"}
+        assert registry.get_sample_value("cloudstats_cache_objects", labels) == 3
+        assert registry.get_sample_value("cloudstats_memory_traced_bytes") > 0
+
+    def test_endpoint(self, memory):
+        """Test the report is served next to the metrics."""
+        app = ExporterApp(memory.registry)
+        app.add_route("/debug/memory", memory.handle)
+        start_response = mock.Mock()
+
+        environ = {"PATH_INFO": "/debug/memory"}
+        setup_testing_defaults(environ)
+        body = b"".join(app(environ, start_response))
+        assert start_response.call_args[0][0] == "200 OK"
+        assert json.loads(body.decode("utf8"))["caches"] == {"servers": 3}
+
+        environ = {"PATH_INFO": "/metrics"}
+        setup_testing_defaults(environ)
+        body = b"".join(app(environ, start_response))
+        assert b"test_gauge" in body
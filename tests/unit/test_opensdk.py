@@ -3,6 +3,8 @@
 
 from keystoneauth1 import exceptions as keystone_exceptions
 
+import mock
+
 from openstack import exceptions as openstack_exceptions
 
 import pytest
@@ -68,21 +70,260 @@ class TestOpenstack:
         assert opensdk_gauge.kwargs == [{}]
         assert opensdk_gauge.call_labels == []
         assert opensdk_gauge.values == [0]
+        conn.network.load_balancers.assert_called_with(fields="id")
 
     def test_get_oject_exception(
         self, openstack, mock_openstacksdk_connection, opensdk_gauge
     ):
         """Test exception handling on object query."""
-        # Raise error when collecting containers
+        # Raise error when looking up the object store endpoint
         conn = mock_openstacksdk_connection
-        conn.object_store.containers.side_effect = (
+        conn.object_store.get_endpoint.side_effect = (
             keystone_exceptions.catalog.EndpointNotFound
         )
         # Verify error is being raised
         with pytest.raises(keystone_exceptions.catalog.EndpointNotFound):
-            conn.object_store.containers()
+            conn.object_store.get_endpoint()
         # Verify collection completes as expected
         openstack._get_object_stats()
         assert opensdk_gauge.args == []
         assert opensdk_gauge.kwargs == []
         assert opensdk_gauge.values == []
+
+    def test_get_object_stats_all_projects(
+        self, openstack, mock_openstacksdk_connection, opensdk_gauge
+    ):
+        """Test account totals are collected for every project."""
+        openstack.config["object_store"]["all_projects"].set(True)
+        conn = mock_openstacksdk_connection
+        conn.current_project_id = "admin-id"
+        conn.object_store.get_endpoint.return_value = "http://swift/v1/AUTH_admin-id"
+        projects = [mock.Mock(id="p1-id"), mock.Mock(id="p2-id")]
+        projects[0].name = "p1"
+        projects[1].name = "p2"
+        conn.identity.projects.return_value = projects
+        conn.object_store.head.return_value = mock.Mock(
+            status_code=204,
+            headers={
+                "X-Account-Container-Count": "2",
+                "X-Account-Object-Count": "10",
+                "X-Account-Bytes-Used": "1024",
+            },
+        )
+
+        openstack._get_object_stats()
+        head_urls = sorted(call.args[0] for call in conn.object_store.head.mock_calls)
+        assert head_urls == [
+            "http://swift/v1/AUTH_p1-id",
+            "http://swift/v1/AUTH_p2-id",
+        ]
+        assert [args[0] for args in opensdk_gauge.args] == [
+            "swift_account_containers",
+            "swift_account_objects",
+            "swift_account_bytes",
+        ]
+        assert opensdk_gauge.values == [2, 10, 1024, 2, 10, 1024]
+        conn.object_store.get.assert_not_called()
+
+    def test_get_object_stats_account_errors(
+        self, openstack, mock_openstacksdk_connection, opensdk_gauge, caplog
+    ):
+        """Test a failing or denied Swift account doesn't fail the others."""
+        openstack.config["object_store"]["all_projects"].set(True)
+        conn = mock_openstacksdk_connection
+        conn.current_project_id = "admin-id"
+        conn.object_store.get_endpoint.return_value = "http://swift/v1/AUTH_admin-id"
+        projects = [mock.Mock(id="p{}-id".format(i)) for i in range(4)]
+        for i, project in enumerate(projects):
+            project.name = "p{}".format(i)
+        conn.identity.projects.return_value = projects
+        responses = {
+            "http://swift/v1/AUTH_p0-id": openstack_exceptions.HttpException(),
+            "http://swift/v1/AUTH_p1-id": mock.Mock(status_code=403, headers={}),
+            "http://swift/v1/AUTH_p2-id": mock.Mock(status_code=403, headers={}),
+            "http://swift/v1/AUTH_p3-id": mock.Mock(
+                status_code=204, headers={"X-Account-Object-Count": "10"}
+            ),
+        }
+
+        def head(url):
+            if isinstance(responses[url], Exception):
+                raise responses[url]
+            return responses[url]
+
+        conn.object_store.head.side_effect = head
+
+        openstack._get_object_stats()
+        assert opensdk_gauge.values == [0, 10, 0]
+        warnings = [
+            record.getMessage()
+            for record in caplog.records
+            if record.levelname == "WARNING"
+        ]
+        assert len([message for message in warnings if "denied" in message]) == 1
+        assert any("project p0-id" in message for message in warnings)
+
+    def test_get_object_stats_container_details(
+        self, openstack, mock_openstacksdk_connection, opensdk_gauge
+    ):
+        """Test per-container gauges are paged in when enabled."""
+        openstack.config["object_store"]["all_projects"].set(False)
+        openstack.config["object_store"]["container_details"].set(True)
+        conn = mock_openstacksdk_connection
+        conn.object_store.get_endpoint.return_value = "http://swift/v1/AUTH_admin-id"
+        conn.object_store.head.return_value = mock.Mock(status_code=204, headers={})
+        pages = [
+            [{"name": "a", "count": 1, "bytes": 10}],
+            [{"name": "b", "count": 2, "bytes": 20}],
+            [],
+        ]
+        conn.object_store.get.side_effect = [
+            mock.Mock(status_code=200, json=mock.Mock(return_value=page))
+            for page in pages
+        ]
+
+        openstack._get_object_stats()
+        assert conn.object_store.get.mock_calls[1].kwargs["params"] == {
+            "format": "json",
+            "marker": "a",
+        }
+        assert {"container_name": "b", "project_name": "admin"} in (
+            opensdk_gauge.call_labels
+        )
+        assert opensdk_gauge.values == [0, 0, 0, 1, 10, 2, 20]
+
+    def test_get_volume_stats_summary(
+        self, openstack, mock_openstacksdk_connection, opensdk_gauge
+    ):
+        """Test volume totals come from the summary API without a listing."""
+        openstack.config["per_object_gauges"].set(False)
+        openstack.config["aggregated_gauges"].set(False)
+        conn = mock_openstacksdk_connection
+        conn.block_storage.get.return_value = mock.Mock(
+            status_code=200,
+            json=mock.Mock(
+                return_value={"volume-summary": {"total_count": 3, "total_size": 60}}
+            ),
+        )
+
+        openstack._get_volume_stats()
+        assert opensdk_gauge.args == [
+            ["cinder_total_volumes", "Total number of volumes in cinder"],
+            ["cinder_total_volume_size", "Total size of volumes in cinder"],
+        ]
+        assert opensdk_gauge.values == [3, 60]
+        conn.block_storage.volumes.assert_not_called()
+
+    def test_get_volume_stats_summary_fallback(
+        self, openstack, mock_openstacksdk_connection, opensdk_gauge
+    ):
+        """Test volume totals are counted from the listing on older clouds."""
+        openstack.config["per_object_gauges"].set(False)
+        openstack.config["aggregated_gauges"].set(False)
+        conn = mock_openstacksdk_connection
+        conn.block_storage.get.return_value = mock.Mock(status_code=404)
+        conn.block_storage.volumes.return_value = [{"size": 10}, {"size": None}]
+
+        openstack._get_volume_stats()
+        assert opensdk_gauge.values == [2, 10]
+
+    def test_get_server_stats_aggregated(
+        self, openstack, mock_openstacksdk_connection, opensdk_gauge
+    ):
+        """Test per-project and per-hypervisor totals are computed in one pass."""
+        openstack.config["per_object_gauges"].set(False)
+
+        def server(id, project, hypervisor, disk):
+            return {
+                "id": id,
+                "hypervisor_hostname": hypervisor,
+                "location": {"project": {"domain_name": "d", "name": project}},
+                "flavor": {"disk": disk, "ephemeral": 0},
+            }
+
+        mock_openstacksdk_connection.compute.servers.return_value = [
+            server("s1", "p1", "hv1", 10),
+            server("s2", "p1", "hv2", 20),
+            server("s3", "p2", "hv2", 40),
+        ]
+
+        openstack._get_server_stats()
+        assert [args[0] for args in opensdk_gauge.args] == [
+            "nova_project_servers",
+            "nova_project_ephemeral_size",
+            "hypervisor_servers",
+            "hypervisor_ephemeral_size",
+        ]
+        results = list(zip(opensdk_gauge.call_labels, opensdk_gauge.values))
+        assert results == [
+            ({"domain_name": "d", "project_name": "p1"}, 2),
+            ({"domain_name": "d", "project_name": "p2"}, 1),
+            ({"domain_name": "d", "project_name": "p1"}, 30),
+            ({"domain_name": "d", "project_name": "p2"}, 40),
+            ({"hypervisor_hostname": "hv1"}, 1),
+            ({"hypervisor_hostname": "hv2"}, 2),
+            ({"hypervisor_hostname": "hv1"}, 10),
+            ({"hypervisor_hostname": "hv2"}, 60),
+        ]
+
+        # A second pass replaces the previous series instead of adding to them
+        openstack._clear_cache()
+        openstack._get_server_stats()
+        assert opensdk_gauge.clears == 4
+
+    def test_churn_counters(self, openstack, mock_openstacksdk_connection):
+        """Test created, deleted and resized volumes are counted per project."""
+        openstack.keyerrorcount = 0
+
+        def volume(id, size):
+            return {
+                "id": id,
+                "host": "backend",
+                "size": size,
+                "location": {"project": {"domain_name": "d", "name": "p1"}},
+            }
+
+        def count(action):
+            return openstack._registry.get_sample_value(
+                "openstack_resources_{}_total".format(action),
+                {"resource": "volume", "project_name": "p1"},
+            )
+
+        volumes = mock_openstacksdk_connection.block_storage.volumes
+        volumes.return_value = [volume("v1", 10), volume("v2", 20)]
+        openstack._get_volume_stats()
+        # The first collection has nothing to be compared with
+        assert count("created") is None
+
+        openstack._clear_cache()
+        volumes.return_value = [volume("v1", 15), volume("v3", 30), volume("v4", 5)]
+        openstack._get_volume_stats()
+        assert count("created") == 2
+        assert count("deleted") == 1
+        assert count("resized") == 1
+
+    def test_cache_sizes(self, openstack):
+        """Test the number of objects held by each cache is reported."""
+        openstack._servers_cache = [{}, {}]
+        openstack._inventories["server"] = {"a": ("admin", 1)}
+        sizes = openstack.cache_sizes()
+        assert sizes["servers"] == 2
+        assert sizes["server_inventory"] == 1
+        assert "projects" not in sizes
+
+        # Summaries are not listings
+        openstack._volume_summary_cache = {"count": 3, "size": 30}
+        assert "volume_summary" not in openstack.cache_sizes()
+
+    def test_self_metrics(self, openstack):
+        """Test the collection exports its own durations and errors."""
+        openstack.get_all_stats()
+        registry = openstack._registry
+        labels = {"collector": "hypervisor"}
+        assert registry.get_sample_value(
+            "cloudstats_collector_last_success_timestamp_seconds", labels
+        )
+        labels = {"resource": "hypervisors"}
+        assert (
+            registry.get_sample_value("cloudstats_objects_processed_total", labels) == 3
+        )
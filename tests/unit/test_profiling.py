@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+"""Test profiling module."""
+import glob
+import os
+
+from cloudstats.profiling import Profiler
+
+
+class TestProfiler:
+    """Profiler test class."""
+
+    def test_disabled(self, tmp_path):
+        """Test a disabled profiler records and writes nothing."""
+        profiler = Profiler("test", directory=str(tmp_path))
+        with profiler.cycle():
+            with profiler.stage("stage"):
+                pass
+        assert profiler.timings == {}
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_self_times(self):
+        """Test nested stages are subtracted from their parent."""
+        profiler = Profiler("test", enabled=True)
+        profiler.timings = {"test": 10.0, "test;a": 4.0, "test;a;b": 3.0, "test;c": 1}
+        assert profiler.self_times() == {
+            "test": 5.0,
+            "test;a": 1.0,
+            "test;a;b": 3.0,
+            "test;c": 1,
+        }
+
+    def test_cycle(self, tmp_path):
+        """Test a cycle writes its folded stacks and cProfile stats."""
+        profiler = Profiler("test", cprofile=True, directory=str(tmp_path))
+        with profiler.cycle():
+            with profiler.stage("outer"):
+                with profiler.stage("inner"):
+                    sum(range(100000))
+        assert set(profiler.timings) == {"test", "test;outer", "test;outer;inner"}
+
+        (folded,) = glob.glob(str(tmp_path / "test-*.folded"))
+        with open(folded) as f:
+            stacks = [line.rsplit(" ", 1)[0] for line in f]
+        assert "test;outer;inner" in stacks
+        assert glob.glob(str(tmp_path / "test-*.prof"))
+
+    def test_prune(self, tmp_path):
+        """Test only the most recent profiles are kept."""
+        profiler = Profiler("test", enabled=True, directory=str(tmp_path), keep=2)
+        for name in ("test-1.folded", "test-2.folded", "test-3.folded"):
+            (tmp_path / name).write_text("")
+        profiler._prune()
+        assert sorted(os.listdir(str(tmp_path))) == ["test-2.folded", "test-3.folded"]
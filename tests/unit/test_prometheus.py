@@ -1,5 +1,7 @@
 #!/usr/bin/python3
 """Test prometheus module."""
+from cloudstats.localstats import SnapshotSource
+from cloudstats.snapshot import Snapshot
 
 
 class TestPrometheus:
@@ -86,3 +88,26 @@ class TestPrometheus:
             # grid height units , 1 == 30 pixels
             assert 1 <= panel["gridPos"]["h"]
             assert 0 <= panel["gridPos"]["y"]
+
+    def test_snapshot_source(self, prometheus, monkeypatch):
+        """Test OpenStack stats are computed from the exporter snapshot."""
+        snapshot = Snapshot(
+            {
+                "neutron_total_routers": {
+                    "documentation": "Total number of routers",
+                    "labelnames": [],
+                    "samples": [[4]],
+                }
+            }
+        )
+        prometheus.snapshot_source = SnapshotSource("http://exporter/", 60)
+        monkeypatch.setattr(prometheus.snapshot_source, "fetch", lambda: snapshot)
+        queries = []
+        monkeypatch.setattr(
+            prometheus, "_query_prometheus", lambda query: queries.append(query)
+        )
+
+        stats = prometheus.get_all_stats()
+        assert stats["num_routers"] == 4
+        assert "neutron_total_routers" not in queries
+        assert any(query.startswith("round(ceph_cluster") for query in queries)
@@ -1,7 +1,16 @@
 #!/usr/bin/python3
 """Test cloud stats reporter daemon."""
+
+import json
+
+from cloudstats.api import UpdateFailed
+
+import mock
+
 import pytest
 
+import requests
+
 
 class TestReporterDaemon:
     """Reporter daemon test class."""
@@ -51,3 +60,212 @@ class TestReporterDaemon:
         """Test run."""
         statsd = reporter_daemon()
         statsd.trigger()
+
+    def test_rest_client_reuse(self, reporter_daemon, monkeypatch):
+        """Test the rest client is kept until the api config changes."""
+        statsd = reporter_daemon()
+        cloud = statsd.clouds[0]
+        setups = []
+        setup = cloud.setup_rest_client
+        monkeypatch.setattr(
+            cloud, "setup_rest_client", lambda: setups.append(1) or setup()
+        )
+        cloud.upload_data({})
+        cloud.upload_data({})
+        assert len(setups) == 1
+
+        statsd.config["api"]["url"].set("http://example.org:8000/")
+        client = cloud.rest_client
+        cloud.upload_data({})
+        assert len(setups) == 2
+        assert cloud.rest_client is not client
+
+    def test_delta_uploads(self, reporter_daemon, mock_session_patch):
+        """Test only changed stats are sent between full syncs."""
+        statsd = reporter_daemon()
+        cloud = statsd.clouds[0]
+        cloud.upload_data({"vcpus": 8, "ram": 64})
+        cloud.upload_data({"vcpus": 16, "ram": 64})
+        cloud.upload_data({"vcpus": 16, "ram": 64})
+        sent = [
+            json.loads(call.kwargs["data"])
+            for call in mock_session_patch.call_args_list
+        ]
+        assert sent == [{"vcpus": 8, "ram": 64}, {"vcpus": 16}]
+
+        # A rejected partial update falls back to the whole report
+        rejected = mock.Mock()
+        rejected.status_code = 400
+        rejected.headers = {}
+        mock_session_patch.side_effect = [rejected, mock_session_patch.return_value]
+        cloud.upload_data({"vcpus": 32, "ram": 64})
+        sent = [
+            json.loads(call.kwargs["data"])
+            for call in mock_session_patch.call_args_list
+        ]
+        assert sent[-2:] == [{"vcpus": 32}, {"vcpus": 32, "ram": 64}]
+
+        # A partial update failing while the API is down is not retried whole
+        unavailable = mock.Mock()
+        unavailable.status_code = 503
+        unavailable.headers = {}
+        mock_session_patch.side_effect = [unavailable]
+        calls = mock_session_patch.call_count
+        with pytest.raises(UpdateFailed):
+            cloud.upload_data({"vcpus": 64, "ram": 64})
+        assert mock_session_patch.call_count == calls + 1
+
+        mock_session_patch.side_effect = None
+        statsd.config["api"]["full_sync_interval"].set(0)
+        cloud.upload_data({"vcpus": 32, "ram": 64})
+        assert json.loads(mock_session_patch.call_args.kwargs["data"]) == {
+            "vcpus": 32,
+            "ram": 64,
+        }
+
+    def test_record_history(self, reporter_daemon, monkeypatch):
+        """Test every collected report is added to the stats history."""
+        statsd = reporter_daemon()
+        cloud = statsd.clouds[0]
+        monkeypatch.setattr(cloud, "collect_prometheus_data", lambda: {"vcpus": 8})
+        cloud.trigger()
+
+        uuid = statsd.config["api"]["cloud_uuid"].get(str)
+        history = statsd.storage.get_stat_history(uuid, "vcpus", 0)
+        assert [sample[2:] for sample in history] == [(1, 8, 8, 8)]
+
+    def test_spool(self, reporter_daemon, mock_session_patch):
+        """Test failed reports are spooled and drained once the API is back."""
+        statsd = reporter_daemon()
+        cloud = statsd.clouds[0]
+        mock_session_patch.side_effect = requests.exceptions.ConnectionError()
+        cloud.report({"vcpus": 8})
+        assert len(cloud.spool) == 1
+        assert cloud.backoff.failures == 1
+
+        # Spooled behind the first one, without an attempt during the backoff
+        cloud.report({"vcpus": 16})
+        assert len(cloud.spool) == 2
+        assert mock_session_patch.call_count == 1
+
+        mock_session_patch.side_effect = None
+        cloud.backoff.next_attempt = 0
+        cloud.report({"vcpus": 32})
+        assert len(cloud.spool) == 0
+        sent = [
+            json.loads(call.kwargs["data"])
+            for call in mock_session_patch.call_args_list
+        ]
+        assert sent[1] == {"vcpus": 8}
+        assert sent[-1] == {"vcpus": 32}
+        assert cloud.storage.get_report("example-uuid")[0] == {"vcpus": 32}
+        assert cloud.backoff.failures == 0
+
+    def test_spool_scheduled_drain(self, reporter_daemon, mock_session_patch):
+        """Test the daemon retries spooled reports when the backoff passed."""
+        statsd = reporter_daemon()
+        cloud = statsd.clouds[0]
+        cloud.drain_between_cycles = True
+        timers = []
+
+        class Timer:
+            def __init__(self, delay, function, args=()):
+                if function == cloud._scheduled_drain:
+                    timers.append((delay, function))
+
+            def start(self):
+                pass
+
+            def cancel(self):
+                pass
+
+        with mock.patch("cloudstats.reporter.threading.Timer", Timer):
+            mock_session_patch.side_effect = requests.exceptions.ConnectionError()
+            cloud.report({"vcpus": 8})
+            delay, drain = timers[-1]
+            assert 0 < delay <= cloud.backoff.base
+
+            # Drained in batches, each scheduling the next one
+            cloud.config["api"]["spool_batch_size"].set(1)
+            cloud.spool.put("example-uuid", {"vcpus": 16})
+            mock_session_patch.side_effect = None
+            cloud.backoff.next_attempt = 0
+            drain()
+            assert len(cloud.spool) == 1
+            delay, drain = timers[-1]
+            assert delay == 0
+            drain()
+            assert len(cloud.spool) == 0
+            assert cloud.storage.get_report("example-uuid")[0] == {"vcpus": 16}
+
+    def test_spool_rejected(self, reporter_daemon, mock_session_patch):
+        """Test reports the API rejects for good are dropped, not spooled."""
+        statsd = reporter_daemon()
+        cloud = statsd.clouds[0]
+        responses = {}
+        for status_code in (400, 503):
+            responses[status_code] = mock.Mock()
+            responses[status_code].status_code = status_code
+            responses[status_code].headers = {}
+        ok = mock_session_patch.return_value
+
+        mock_session_patch.side_effect = [responses[503]]
+        cloud.report({"vcpus": 8})
+        assert len(cloud.spool) == 1
+
+        # The rejected spooled report doesn't hold back the newer one
+        mock_session_patch.side_effect = [responses[400], ok]
+        cloud.backoff.next_attempt = 0
+        cloud.report({"vcpus": 16})
+        assert len(cloud.spool) == 0
+        assert cloud.storage.get_report("example-uuid")[0] == {"vcpus": 16}
+
+        # Rejected as a partial then as a whole report
+        mock_session_patch.side_effect = [responses[400], responses[400]]
+        cloud.report({"vcpus": 32})
+        assert len(cloud.spool) == 0
+        assert cloud.backoff.failures == 0
+
+    def test_update_api(self, reporter_daemon, mock_session_patch, caplog):
+        """Test a one-shot report tells whether the stats were uploaded."""
+        statsd = reporter_daemon()
+        cloud = statsd.clouds[0]
+        cloud.collect_prometheus_data = lambda: {"vcpus": 8}
+        assert statsd.update_api() is True
+
+        mock_session_patch.side_effect = requests.exceptions.ConnectionError()
+        cloud.collect_prometheus_data = lambda: {"vcpus": 16}
+        assert statsd.update_api() is False
+        assert len(cloud.spool) == 1
+        assert "until a reporter daemon uploads them" in caplog.text
+
+    def test_multi_cloud(self, reporter_daemon, monkeypatch):
+        """Test each cloud is reported with its own settings and failures."""
+        statsd = reporter_daemon()
+        statsd.config["clouds"].set(
+            [
+                {"name": "a", "api": {"cloud_uuid": "uuid-a"}},
+                {
+                    "api": {"cloud_uuid": "uuid-b"},
+                    "prometheus": {"url": "http://10.0.0.2:9090/"},
+                },
+            ]
+        )
+        statsd.clouds = statsd.setup_clouds()
+        a, b = statsd.clouds
+        assert (a.name, a.token_key) == ("a", "uuid-a")
+        assert (b.name, b.token_key) == ("uuid-b", "uuid-b")
+        assert a.spool.directory.endswith("/spool/a")
+        assert b.prometheus.promurl == "http://10.0.0.2:9090/api/v1/query"
+        assert a.config["api"]["url"].get() == b.config["api"]["url"].get()
+        assert a.adapter is b.adapter
+
+        reported = []
+
+        def fail():
+            raise RuntimeError("cloud a is down")
+
+        monkeypatch.setattr(a, "trigger", fail)
+        monkeypatch.setattr(b, "trigger", lambda: reported.append(b.name))
+        statsd.trigger()
+        assert reported == ["uuid-b"]
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""Test scheduler module."""
+from cloudstats.scheduler import Scheduler
+
+from prometheus_client import CollectorRegistry
+
+
+class FakeClock:
+    """Clock advanced by the tasks and waits of a scheduler."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def run_cycles(scheduler, clock, durations):
+    """Run one cycle per duration, return the start time of each."""
+    starts = []
+    durations = list(durations)
+
+    def task():
+        starts.append(clock.now)
+        clock.now += durations.pop(0)
+        if not durations:
+            scheduler.stop()
+
+    def wait(seconds):
+        clock.now += max(seconds, 0)
+
+    scheduler.wait = wait
+    scheduler.run(task)
+    return starts
+
+
+class TestScheduler:
+    """Scheduler test class."""
+
+    def test_boundaries(self):
+        """Test cycles start on interval boundaries whatever their duration."""
+        clock = FakeClock(1003.0)
+        scheduler = Scheduler("test", 30, clock=clock)
+        assert scheduler.offset == 0
+        starts = run_cycles(scheduler, clock, [5, 12, 1, 29])
+        assert starts == [1003.0, 1020.0, 1050.0, 1080.0]
+
+    def test_jitter(self):
+        """Test the boundaries are shifted by a per instance offset."""
+        scheduler = Scheduler("test", 30, jitter=10)
+        assert 0 <= scheduler.offset <= 10
+        assert Scheduler("test", 30, jitter=10).offset == scheduler.offset
+        assert scheduler.next_tick(0) == scheduler.offset
+        assert scheduler.next_tick(scheduler.offset) == 30 + scheduler.offset
+
+    def test_overrun(self):
+        """Test ticks missed by a long cycle are skipped and counted."""
+        registry = CollectorRegistry()
+        clock = FakeClock(0.0)
+        scheduler = Scheduler("test", 10, registry=registry, clock=clock)
+        starts = run_cycles(scheduler, clock, [25, 1])
+        assert starts == [0.0, 30.0]
+        labels = {"daemon": "test"}
+        assert registry.get_sample_value("cloudstats_cycles_skipped_total", labels) == 2
+        assert registry.get_sample_value("cloudstats_cycle_lag_seconds", labels) == 0
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+"""Test scrape-triggered collection module."""
+import threading
+
+from cloudstats.scrape import OnDemandCollector
+
+
+class TestOnDemandCollector:
+    """On-demand collector test class."""
+
+    def test_min_age(self):
+        """Test scrapes only collect once the data reached the minimum age."""
+        collections = []
+        collector = OnDemandCollector(lambda: collections.append(1), 60, 5)
+        assert collector.refresh() is True
+        assert collector.refresh() is True
+        assert len(collections) == 1
+
+        collector.min_age = 0
+        assert collector.refresh() is True
+        assert len(collections) == 2
+
+    def test_coalescing(self):
+        """Test concurrent scrapes wait for the same collection."""
+        release = threading.Event()
+        collections = []
+
+        def collect():
+            collections.append(1)
+            release.wait(5)
+
+        collector = OnDemandCollector(collect, 60, 5)
+        results = []
+        scrapes = [
+            threading.Thread(target=lambda: results.append(collector.refresh()))
+            for _ in range(3)
+        ]
+        for scrape in scrapes:
+            scrape.start()
+        release.set()
+        for scrape in scrapes:
+            scrape.join()
+
+        assert results == [True, True, True]
+        assert len(collections) == 1
+
+    def test_deadline(self):
+        """Test a scrape gives up waiting once the deadline passed."""
+        release = threading.Event()
+        collector = OnDemandCollector(lambda: release.wait(5), 60, 0.01)
+        assert collector.refresh() is False
+        release.set()
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+"""Test exporter self-metrics module."""
+from cloudstats.selfmetrics import CollectionMetrics, endpoint_label
+
+import mock
+
+from prometheus_client import CollectorRegistry
+
+import pytest
+
+
+class TestCollectionMetrics:
+    """Collection metrics test class."""
+
+    def test_endpoint_label(self):
+        """Test object ids are removed from the endpoint label."""
+        assert endpoint_label("/servers/detail") == "/servers/detail"
+        assert (
+            endpoint_label("http://nova:8774/v2.1/flavors/42?x=1")
+            == "/v2.1/flavors/{id}"
+        )
+        assert (
+            endpoint_label("http://swift/v1/AUTH_0123456789abcdef0123456789abcdef")
+            == "/v1/{id}"
+        )
+
+    def test_collector(self):
+        """Test collectors are timed and their last success recorded."""
+        registry = CollectorRegistry()
+        metrics = CollectionMetrics(registry)
+        with metrics.collector("ok"):
+            pass
+        with pytest.raises(ValueError):
+            with metrics.collector("broken"):
+                raise ValueError()
+
+        labels = {"collector": "ok"}
+        assert registry.get_sample_value(
+            "cloudstats_collector_last_success_timestamp_seconds", labels
+        )
+        assert (
+            registry.get_sample_value(
+                "cloudstats_collector_duration_seconds_count", labels
+            )
+            == 1
+        )
+        labels = {"collector": "broken"}
+        assert (
+            registry.get_sample_value("cloudstats_collector_failures_total", labels)
+            == 1
+        )
+        assert (
+            registry.get_sample_value(
+                "cloudstats_collector_last_success_timestamp_seconds", labels
+            )
+            is None
+        )
+
+    def test_instrument_session(self):
+        """Test requests are counted by service, endpoint and status."""
+        registry = CollectorRegistry()
+        metrics = CollectionMetrics(registry)
+        session = mock.Mock()
+        session.request.return_value.status_code = 200
+        metrics.instrument_session(session)
+
+        session.request(
+            "/servers/detail", "GET", endpoint_filter={"service_type": "compute"}
+        )
+        session.request("http://keystone/v3/auth/tokens", "POST")
+
+        labels = {"service": "compute", "endpoint": "/servers/detail", "status": "200"}
+        assert registry.get_sample_value("cloudstats_openstack_requests_total", labels)
+        labels = {"service": "identity", "endpoint": "/v3/auth/tokens"}
+        assert (
+            registry.get_sample_value(
+                "cloudstats_openstack_request_duration_seconds_count", labels
+            )
+            == 1
+        )
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+"""Test snapshot module."""
+from cloudstats.snapshot import Snapshot, SnapshotError
+
+from prometheus_client import CollectorRegistry, Gauge
+
+import pytest
+
+
+class TestSnapshot:
+    """Snapshot test class."""
+
+    def test_from_gauges(self):
+        """Test gauges are captured with their labels and values."""
+        registry = CollectorRegistry()
+        labelled = Gauge("labelled", "Labelled", ["a", "b"], registry=registry)
+        labelled.labels(a="1", b="2").set(3)
+        plain = Gauge("plain", "Plain", registry=registry)
+        plain.set(4)
+
+        snapshot = Snapshot.from_gauges({"labelled": labelled, "plain": plain})
+        assert snapshot.metrics == {
+            "labelled": {
+                "documentation": "Labelled",
+                "labelnames": ["a", "b"],
+                "samples": [["1", "2", 3.0]],
+            },
+            "plain": {"documentation": "Plain", "labelnames": [], "samples": [[4.0]]},
+        }
+
+    def test_save_load(self, tmp_path):
+        """Test a snapshot survives a round trip through a file."""
+        snapshot = Snapshot({"m": {"documentation": "", "labelnames": []}}, 1.5)
+        filename = str(tmp_path / "test.snap")
+        snapshot.save(filename)
+
+        loaded = Snapshot.load(filename)
+        assert loaded.metrics == snapshot.metrics
+        assert loaded.timestamp == 1.5
+
+    def test_loads_invalid(self):
+        """Test invalid data raises SnapshotError."""
+        with pytest.raises(SnapshotError):
+            Snapshot.loads(b"not a snapshot")
+        with pytest.raises(SnapshotError):
+            Snapshot.loads(Snapshot.MAGIC + b"truncated")
@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+"""Test spool module."""
+from cloudstats.spool import Backoff, Spool
+
+
+class TestSpool:
+    """Spool test class."""
+
+    def test_put_get(self, tmp_path):
+        """Test reports are kept oldest first and bounded."""
+        spool = Spool(str(tmp_path / "spool"), max_reports=2)
+        assert len(spool) == 0
+        for vcpus in (8, 16, 32):
+            spool.put("uuid", {"vcpus": vcpus})
+
+        names = spool.names()
+        assert len(names) == 2
+        assert [spool.get(name) for name in names] == [
+            ("uuid", {"vcpus": 16}),
+            ("uuid", {"vcpus": 32}),
+        ]
+        spool.remove(names[0])
+        assert spool.names() == names[1:]
+        assert Spool(str(tmp_path / "spool")).names() == names[1:]
+
+    def test_backoff(self):
+        """Test the delay doubles up to the maximum, with jitter."""
+        now = [0.0]
+        backoff = Backoff(60, 300, clock=lambda: now[0])
+        assert backoff.ready()
+        for delay in (60, 120, 240, 300, 300):
+            assert delay / 2 <= backoff.failure() <= delay
+            assert not backoff.ready()
+        now[0] = 300
+        assert backoff.ready()
+        backoff.success()
+        assert backoff.failures == 0
@@ -1,6 +1,20 @@
 #!/usr/bin/python3
 """Test storage module."""
+
+import sqlite3
+import threading
+
 from cloudstats.api import Token
+from cloudstats.storage import (
+    DAILY,
+    HOURLY,
+    MIGRATIONS,
+    RAW,
+    Storage,
+    StorageError,
+)
+
+import pytest
 
 
 class TestStorage:
@@ -29,3 +43,120 @@ class TestStorage:
         """Test no token."""
         token = storage.get_token("access")
         assert token is None
+
+    def test_store_report(self, storage):
+        """Test storing the last acknowledged report of a cloud."""
+        assert storage.get_report("uuid") == (None, None)
+
+        storage.store_report("uuid", {"vcpus": 8}, full=True)
+        report, synced = storage.get_report("uuid")
+        assert report == {"vcpus": 8}
+        assert synced is not None
+
+        storage.store_report("uuid", {"vcpus": 16})
+        assert storage.get_report("uuid") == ({"vcpus": 16}, synced)
+        assert storage.get_report("other") == (None, None)
+
+    def test_tokens_per_cloud(self, storage, mock_session_post):
+        """Test tokens are stored and pruned per cloud."""
+        refresh = Token(mock_session_post.return_value.json()["refresh"])
+        for _ in range(11):
+            storage.store_token(refresh, "uuid-a")
+        storage.store_token(refresh, "uuid-b")
+
+        assert storage.get_token("refresh", "uuid-a") == refresh
+        assert storage.get_token("refresh", "uuid-b") == refresh
+        assert storage.get_token("refresh") is None
+        rows = storage._select("SELECT cloud, count(*) FROM tokens GROUP BY cloud")
+        assert dict(rows) == {"uuid-a": 10, "uuid-b": 1}
+
+    def test_stats_history(self, storage):
+        """Test reports are rolled up hourly then daily and expired."""
+        day = 10 * DAILY
+        for minute in range(0, 48 * 60, 30):
+            storage.store_stats(
+                "uuid", {"vcpus": minute, "name": "a", "up": True}, day + minute * 60
+            )
+        now = day + 2 * DAILY + 3 * HOURLY
+        storage.store_stats("uuid", {"vcpus": 1}, now)
+        storage.downsample_history({RAW: 0, HOURLY: DAILY}, now=now)
+
+        history = storage.get_stat_history("uuid", "vcpus", 0)
+        # The first day is kept daily, the second hourly and the last raw
+        assert [sample[:3] for sample in history[:2]] == [
+            (day, DAILY, 48),
+            (day + DAILY, HOURLY, 2),
+        ]
+        assert history[0][3:] == (705.0, 0, 1410)
+        assert history[25][:2] == (now, RAW)
+        assert len(history) == 1 + 24 + 1
+        assert storage.get_stat_history("uuid", "name", 0) == []
+        assert storage.get_stat_history("other", "vcpus", 0) == []
+
+        # Rolling up again doesn't change the samples
+        storage.downsample_history({}, now=now)
+        assert storage.get_stat_history("uuid", "vcpus", 0) == history
+
+    def test_transaction(self, storage):
+        """Test writes batched in a transaction are committed or rolled back."""
+        with pytest.raises(ValueError):
+            with storage.transaction():
+                storage.store_report("uuid", {"vcpus": 8}, full=True)
+                storage.store_stats("uuid", {"vcpus": 8})
+                raise ValueError()
+        assert storage.get_report("uuid") == (None, None)
+        assert storage.get_stat_history("uuid", "vcpus", 0) == []
+
+        with storage.transaction():
+            storage.store_report("uuid", {"vcpus": 8}, full=True)
+            storage.store_stats("uuid", {"vcpus": 8})
+        assert storage.get_report("uuid")[0] == {"vcpus": 8}
+        assert len(storage.get_stat_history("uuid", "vcpus", 0)) == 1
+
+    def test_concurrent_writes(self, tmp_path):
+        """Test threads and processes write a WAL database concurrently."""
+        filename = tmp_path / "state.db"
+        storage = Storage(filename)
+        other_process = Storage(filename)
+
+        def report(cloud):
+            for vcpus in range(20):
+                storage.store_report(cloud, {"vcpus": vcpus}, full=True)
+                other_process.store_stats(cloud, {"vcpus": vcpus}, at=vcpus)
+
+        threads = [
+            threading.Thread(target=report, args=["uuid-{}".format(i)])
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert storage._select("PRAGMA journal_mode") == [("wal",)]
+        for i in range(8):
+            cloud = "uuid-{}".format(i)
+            assert storage.get_report(cloud)[0] == {"vcpus": 19}
+            assert len(storage.get_stat_history(cloud, "vcpus", 0)) == 20
+        storage.close()
+        other_process.close()
+
+    def test_migrations(self, tmp_path):
+        """Test a database of a release before schema versioning is migrated."""
+        filename = str(tmp_path / "state.db")
+        db = sqlite3.connect(filename)
+        db.execute("CREATE TABLE tokens (type TEXT, encoded TEXT, expires TIMESTAMP)")
+        db.execute("INSERT INTO tokens VALUES ('access', 'encoded', NULL)")
+        db.commit()
+        db.close()
+
+        storage = Storage(filename)
+        assert storage._select("PRAGMA user_version") == [(len(MIGRATIONS),)]
+        assert storage._select("SELECT encoded, cloud FROM tokens") == [("encoded", "")]
+        indexes = storage._select("PRAGMA index_list(tokens)")
+        assert "tokens_type_cloud" in [index[1] for index in indexes]
+
+        storage._connect().execute("PRAGMA user_version=99")
+        storage.close()
+        with pytest.raises(StorageError):
+            Storage(filename)
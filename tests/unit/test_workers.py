@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""Test worker processes module."""
+from cloudstats.snapshot import Snapshot
+from cloudstats.workers import ShardedStats, Worker, shard_collectors
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+import pytest
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    """Sharded stats with a single worker process."""
+    monkeypatch.setattr("cloudstats.config.config", None)
+    registry = CollectorRegistry()
+    stats = ShardedStats(registry, 1, timeout=60)
+    yield stats
+    stats.stop()
+
+
+def worker_snapshot(project, value):
+    """Snapshot of a registry as sent by a worker."""
+    registry = CollectorRegistry()
+    gauge = Gauge("servers", "Servers", ["project_name"], registry=registry)
+    gauge.labels(project).set(value)
+    Counter("requests", "Requests", registry=registry).inc(value)
+    return Snapshot.from_registry(registry)
+
+
+class TestShardedStats:
+    """Sharded stats test class."""
+
+    def test_shard_collectors(self):
+        """Test collector groups are spread over the workers."""
+        shards = shard_collectors(2)
+        assert len(shards) == 2
+        assert "server" in shards[0] and "hypervisor" in shards[0]
+        assert "volume" in shards[1]
+        assert len(shard_collectors(100)) == 4
+
+    def test_merge(self, sharded):
+        """Test worker snapshots are merged, summing counters."""
+        sharded.workers[0].snapshot = worker_snapshot("a", 1)
+        second = Worker(None, ["volume"], None)
+        second.snapshot = worker_snapshot("b", 2)
+        sharded.workers.append(second)
+
+        families = {metric.name: metric for metric in sharded.collect()}
+        samples = {
+            (sample.name, sample.labels.get("project_name")): sample.value
+            for sample in families["servers"].samples
+        }
+        assert samples == {("servers", "a"): 1, ("servers", "b"): 2}
+        totals = [s for s in families["requests"].samples if s.name.endswith("_total")]
+        assert [sample.value for sample in totals] == [3]
+        sharded.workers.remove(second)
+
+    def test_supervise(self, sharded):
+        """Test a worker that died is restarted."""
+        worker = sharded.workers[0]
+        worker.process.kill()
+        worker.process.join()
+        sharded.supervise()
+        assert worker.restarts == 1
+        assert worker.process.is_alive()